@@ -0,0 +1,71 @@
+'''
+Microbenchmarks for the IPv4 value types.
+
+Run from the top-level directory with ``python -m bench.bench_IPv4``.
+'''
+
+import timeit
+import tracemalloc
+
+from src.net.IPv4 import Address, Subnet
+
+OBJECT_COUNT = 100000
+TIMEIT_NUMBER = 200000
+
+
+def bytes_per_object(factory, count=OBJECT_COUNT):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    objects = [factory(i) for i in range(count)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Don't count the list itself
+    list_overhead = 8 * count
+    del objects
+    return (after - before - list_overhead) / count
+
+
+def ops_per_second(stmt, bench_globals, number=TIMEIT_NUMBER):
+    elapsed = min(timeit.repeat(
+        stmt, globals=bench_globals, number=number, repeat=3
+    ))
+    return number / elapsed
+
+
+def main():
+    print("Memory")
+    print("  Address: {0:8.1f} bytes/object".format(
+        bytes_per_object(lambda i: Address(i << 8))
+    ))
+    print("  Subnet:  {0:8.1f} bytes/object".format(
+        bytes_per_object(lambda i: Subnet(Address(i << 8), 24))
+    ))
+
+    bench_globals = {
+        'Address': Address,
+        'Subnet': Subnet,
+        'sub': Subnet(Address('10.11.0.0'), 16),
+        'inner': Subnet(Address('10.11.12.0'), 24),
+        'addr': Address('10.11.12.13'),
+        'other': Address('10.11.12.14'),
+    }
+    print("Throughput")
+    for label, stmt in (
+            ('Address in Subnet', 'addr in sub'),
+            ('Subnet in Subnet', 'inner in sub'),
+            ('Address < Address', 'addr < other'),
+            ('Address == Address', 'addr == other'),
+            ('Subnet == Subnet', 'inner == sub'),
+            ('hash(Subnet)', 'hash(sub)'),
+            ('Subnet.floor()', 'sub.floor()'),
+            ('Subnet.ceiling()', 'sub.ceiling()'),
+            ('Subnet(Address, int)', 'Subnet(addr, 24)'),
+            ('Address(str)', 'Address("10.11.12.13")'),
+    ):
+        print("  {0:<22} {1:12,.0f} ops/s".format(
+            label, ops_per_second(stmt, bench_globals)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+'''
+Microbenchmarks for the vectorised IPv4 containers.
+
+Run from the top-level directory with ``python -m bench.bench_arrays``.
+'''
+
+import random
+import time
+
+from src.net.IPv4 import Address, Subnet
+from src.net.arrays import AddressArray, SubnetArray
+
+ADDRESS_COUNT = 1000000
+SUBNET_COUNT = 100000
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print("  {0:<30} {1:14,.0f} items/s".format(label, count / elapsed))
+    return result
+
+
+def main():
+    rng = random.Random(42)
+    dotted_quads = [
+        str(Address(rng.getrandbits(32))) for _ in range(ADDRESS_COUNT)
+    ]
+    subnets = [
+        Subnet(Address(rng.getrandbits(32)), rng.randint(8, 24))
+        for _ in range(SUBNET_COUNT)
+    ]
+
+    print("Scalar")
+    sample = dotted_quads[:ADDRESS_COUNT // 10]
+    scalar_addresses = timed(
+        'Address(str)', len(sample), lambda: [Address(a) for a in sample]
+    )
+    timed(
+        'str(Address)', len(sample),
+        lambda: [str(a) for a in scalar_addresses]
+    )
+    few = scalar_addresses[:1000]
+    timed(
+        'any(a in s for s in subnets)', len(few),
+        lambda: [any(a in s for s in subnets) for a in few]
+    )
+
+    print("Vectorised")
+    addresses = timed(
+        'AddressArray.from_strings', ADDRESS_COUNT,
+        lambda: AddressArray.from_strings(dotted_quads)
+    )
+    timed('AddressArray.to_strings', ADDRESS_COUNT, addresses.to_strings)
+    timed('AddressArray.mask', ADDRESS_COUNT, lambda: addresses.mask(24))
+    timed('AddressArray.sorted', ADDRESS_COUNT, addresses.sorted)
+    subnet_array = SubnetArray.from_subnets(subnets)
+    timed(
+        'SubnetArray.contains', ADDRESS_COUNT,
+        lambda: subnet_array.contains(addresses)
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+'''
+Microbenchmark for the bulk dotted quad parser.
+
+Run from the top-level directory with ``python -m bench.bench_bulk``.
+'''
+
+import random
+import time
+
+from src.net.IPv4 import Address
+from src.net.bulk import read_addresses
+
+LINE_COUNT = 2000000
+
+
+def main():
+    rng = random.Random(42)
+    lines = [str(Address(rng.getrandbits(32))) for _ in range(LINE_COUNT)]
+    buf = ('\n'.join(lines) + '\n').encode('ascii')
+
+    start = time.perf_counter()
+    [Address(line) for line in lines[:LINE_COUNT // 10]]
+    elapsed = (time.perf_counter() - start) * 10
+    print("  {0:<20} {1:12,.0f} lines/s".format(
+        'Address(str)', LINE_COUNT / elapsed
+    ))
+
+    start = time.perf_counter()
+    read_addresses(buf)
+    elapsed = time.perf_counter() - start
+    print("  {0:<20} {1:12,.0f} lines/s".format(
+        'read_addresses', LINE_COUNT / elapsed
+    ))
+
+
+if __name__ == '__main__':
+    main()
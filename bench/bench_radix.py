@@ -0,0 +1,57 @@
+'''
+Microbenchmarks for the radix tree.
+
+Run from the top-level directory with ``python -m bench.bench_radix``.
+'''
+
+import random
+
+from src.net.IPv4 import Address, Subnet
+from src.net.arrays import AddressArray
+from src.net.radix import RadixTree
+from .bench_arrays import timed
+
+SUBNET_COUNT = 200000
+LOOKUP_COUNT = 1000000
+
+
+def main():
+    rng = random.Random(42)
+    subnets = [
+        Subnet(Address(rng.getrandbits(32)), rng.randint(8, 28))
+        for _ in range(SUBNET_COUNT)
+    ]
+    addresses = [Address(rng.getrandbits(32)) for _ in range(LOOKUP_COUNT)]
+
+    address_array = AddressArray.from_addresses(addresses)
+
+    tree = RadixTree()
+
+    def insert_all():
+        for subnet in subnets:
+            tree.insert(subnet, subnet)
+    timed('insert', len(subnets), insert_all)
+
+    def lookup_all():
+        longest_match = tree.longest_match
+        for address in addresses:
+            try:
+                longest_match(address)
+            except KeyError:
+                pass
+    timed('longest_match(Address)', len(addresses), lookup_all)
+    timed(
+        'longest_matches(AddressArray)', len(addresses),
+        lambda: tree.longest_matches(address_array)
+    )
+    timed('iterate', len(tree), lambda: sum(1 for _ in tree.items()))
+
+    def delete_all():
+        for subnet in subnets:
+            if subnet in tree:
+                tree.delete(subnet)
+    timed('delete', len(subnets), delete_all)
+
+
+if __name__ == '__main__':
+    main()
@@ -43,12 +43,18 @@ setup(
     ],
     packages=package_names(),
     package_dir={PROJECT_NAME: 'src'},
+    package_data={
+        PROJECT_NAME + '.metadata': ['data/ipv4-address-space.xml'],
+    },
     install_requires=[
         'SQLAlchemy',
         'blessings',
         'pyxdg',
         'requests',
     ],
+    extras_require={
+        'arrays': ['numpy'],
+    },
     entry_points={
         'console_scripts': [
             PROJECT_NAME+'='+PROJECT_NAME+'.tools.cli:main',
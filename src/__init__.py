@@ -13,3 +13,33 @@ SQLITE_PATH = os.path.join(
     xdg.BaseDirectory.save_data_path(PROJECT_NAME),
     PROJECT_NAME + '.sqlite'
 )
+
+# Raw RDAP responses are cached apart from the address-space DB
+RDAP_CACHE_PATH = os.path.join(
+    xdg.BaseDirectory.save_data_path(PROJECT_NAME),
+    PROJECT_NAME + '-rdap-cache.sqlite'
+)
+
+# Addresses and endpoints that failed recently
+FAILURE_CACHE_PATH = os.path.join(
+    xdg.BaseDirectory.save_data_path(PROJECT_NAME),
+    PROJECT_NAME + '-failures.sqlite'
+)
+
+# Address ranges RIRs redirected our RDAP queries for
+REDIRECT_MAP_PATH = os.path.join(
+    xdg.BaseDirectory.save_data_path(PROJECT_NAME),
+    PROJECT_NAME + '-redirects.sqlite'
+)
+
+# Local copy of the IANA IPv4 address space registry
+IANA_REGISTRY_PATH = os.path.join(
+    xdg.BaseDirectory.save_data_path(PROJECT_NAME),
+    'ipv4-address-space.xml'
+)
+
+# Local copy of the IANA RDAP bootstrap registry for IPv4
+RDAP_BOOTSTRAP_PATH = os.path.join(
+    xdg.BaseDirectory.save_data_path(PROJECT_NAME),
+    'rdap-ipv4.json'
+)
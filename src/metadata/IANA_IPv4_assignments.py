@@ -1,9 +1,20 @@
+from .. import IANA_REGISTRY_PATH
 from ..net.IPv4 import Subnet, Address
+from ..tools.logger import ModuleLogger
 from . import constants
 
+from email.utils import formatdate
+import os
 import requests
+import time
 import xml.etree.ElementTree as ET
 
+log = ModuleLogger(__name__)
+
+IANA_REGISTRY_SNAPSHOT_PATH = os.path.join(
+    os.path.dirname(__file__), 'data', 'ipv4-address-space.xml'
+)
+
 
 class TopLevelDelegation(object):
     def __init__(self, top_byte):
@@ -15,6 +26,21 @@ class TopLevelDelegation(object):
 
         self.rdap_URLs = set([])
         self.whois_host = None
+        self.designation = None
+        self.status = None
+
+    @property
+    def registry(self):
+        '''
+        The RIR that administers this /8, or IANA's designation for it if
+        there isn't one.
+        '''
+        return constants.REGIONAL_REGISTRY_WHOIS_HOSTS.get(
+            self.whois_host, self.designation
+        )
+
+    def is_mappable(self):
+        return self.status in constants.IANA_MAPPABLE_STATUSES
 
     def __repr__(self):
         return "<{klass} {top_byte}: {url}>".format(
@@ -24,30 +50,40 @@ class TopLevelDelegation(object):
         )
 
 
-def populate_IANA_IPv4_assignments():
-    slash_eights = {}
-
-    iana_xml = requests.get(constants.IANA_TOP_LEVEL_ALLOCATION_URL)
-    if not iana_xml.ok:
-        iana_xml.raise_for_status()
-
-    registry_DOM = ET.fromstringlist(iana_xml.iter_lines())
-    for iana_record_element in registry_DOM.findall(
-            'assignments:record', constants.IANA_TOP_LEVEL_ALLOCATION_NS):
-        prefix_element = iana_record_element.find(
-                'assignments:prefix', constants.IANA_TOP_LEVEL_ALLOCATION_NS)
-        if prefix_element is None:
+def _record_child_text(record_element, tag):
+    element = record_element.find(
+        'assignments:' + tag, constants.IANA_TOP_LEVEL_ALLOCATION_NS
+    )
+    if element is None:
+        return None
+    return element.text.strip()
+
+
+def parse_IANA_IPv4_assignments(xml_source):
+    '''
+    Parses the IANA IPv4 address space registry from xml_source, a file name
+    or a binary file object. Returns a list of 256 TopLevelDelegations
+    indexed by top byte, with None for /8s that aren't in the registry.
+    '''
+    slash_eights = [None] * 256
+    record_tag = '{{{0}}}record'.format(
+        constants.IANA_TOP_LEVEL_ALLOCATION_NS['assignments']
+    )
+
+    # Records are handled and thrown away as soon as they're parsed
+    for _, iana_record_element in ET.iterparse(xml_source):
+        if iana_record_element.tag != record_tag:
+            continue
+
+        slash_eight = _record_child_text(iana_record_element, 'prefix')
+        if slash_eight is None:
             raise ValueError("Record does not have a prefix element")
-
-        slash_eight = prefix_element.text
         if not slash_eight.endswith('/8'):
             raise ValueError(
                 "Malformed record prefix: {0}".format(slash_eight)
             )
 
         top_byte = int(slash_eight[:-2])
-        delegation_cidr = Subnet(Address((top_byte, 0, 0, 0)), 8)
-
         tld = TopLevelDelegation(top_byte)
         rdap_element = iana_record_element.find(
                 'assignments:rdap', constants.IANA_TOP_LEVEL_ALLOCATION_NS)
@@ -59,13 +95,95 @@ def populate_IANA_IPv4_assignments():
                     ):
                 tld.rdap_URLs.add(rdap_server_element.text.rstrip('/'))
 
-        whois_element = iana_record_element.find(
-                'assignments:whois', constants.IANA_TOP_LEVEL_ALLOCATION_NS)
-
-        if whois_element is not None:
-            tld.whois_host = whois_element.text
-            tld.whois_host.strip()
+        tld.whois_host = _record_child_text(iana_record_element, 'whois')
+        tld.designation = _record_child_text(
+            iana_record_element, 'designation'
+        )
+        tld.status = _record_child_text(iana_record_element, 'status')
 
-        slash_eights[delegation_cidr] = tld
+        slash_eights[top_byte] = tld
+        iana_record_element.clear()
 
     return slash_eights
+
+
+def refresh_IANA_IPv4_assignments(registry_path):
+    '''
+    Downloads the IANA registry to registry_path, unless the copy already
+    there is current. The download is checked before it replaces the local
+    copy.
+    '''
+    refresh_local_copy(
+        constants.IANA_TOP_LEVEL_ALLOCATION_URL, registry_path,
+        parse_IANA_IPv4_assignments
+    )
+
+
+def refresh_local_copy(url, local_path, validate):
+    '''
+    Downloads url to local_path with a conditional GET. validate is called
+    with the path of the download, and should raise if it's broken, in which
+    case the local copy is left alone.
+    '''
+    request_headers = {}
+    if os.path.exists(local_path):
+        request_headers['If-Modified-Since'] = formatdate(
+            os.path.getmtime(local_path), usegmt=True
+        )
+
+    response = requests.get(url, headers=request_headers, stream=True)
+    if response.status_code == requests.codes['NOT_MODIFIED']:
+        log.debug("%s hasn't changed", url)
+        os.utime(local_path)
+        return
+    if not response.ok:
+        response.raise_for_status()
+
+    download_path = local_path + '.download'
+    try:
+        with open(download_path, 'wb') as download:
+            for chunk in response.iter_content(chunk_size=65536):
+                download.write(chunk)
+        validate(download_path)
+        os.replace(download_path, local_path)
+    finally:
+        if os.path.exists(download_path):
+            os.remove(download_path)
+    log.info("Downloaded %s to %s", url, local_path)
+
+
+def populate_IANA_IPv4_assignments(registry_path=None,
+                                   max_age=constants.IANA_REGISTRY_MAX_AGE,
+                                   offline=False):
+    '''
+    Returns the IANA delegations as parse_IANA_IPv4_assignments() does, from
+    the local copy of the registry at registry_path. The local copy is only
+    refreshed when it's older than max_age seconds. If it can't be, e.g.
+    when offline, we make do with whatever copy we have, or with the
+    snapshot bundled with vast.
+    '''
+    if registry_path is None:
+        registry_path = IANA_REGISTRY_PATH
+
+    if not offline and is_stale(registry_path, max_age):
+        try:
+            refresh_IANA_IPv4_assignments(registry_path)
+        except (requests.RequestException, OSError,
+                ET.ParseError, ValueError) as ex:
+            log.warning("Couldn't refresh IANA registry: %s", ex)
+
+    if os.path.exists(registry_path):
+        return parse_IANA_IPv4_assignments(registry_path)
+    log.warning("Using bundled IANA registry snapshot")
+    return parse_IANA_IPv4_assignments(IANA_REGISTRY_SNAPSHOT_PATH)
+
+
+def is_stale(local_path, max_age):
+    '''
+    Returns whether the file at local_path is missing or older than max_age
+    seconds.
+    '''
+    try:
+        return time.time() - os.path.getmtime(local_path) > max_age
+    except OSError:
+        return True
@@ -5,25 +5,41 @@ from . import (
 from ..net.IPv4 import Address
 from ..tools.logger import ModuleLogger
 from .assigned import AssignedSubnet
+from .ratelimit import HostRateLimiter, parse_retry_after
 
+from urllib.parse import urlsplit
+import json
 import pprint
 import requests
-import time
 
 # TODO Do we ever get a 'name' attribute from afrinic?
 log = ModuleLogger(__name__)
 json_printer = pprint.PrettyPrinter()
 
+REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+
 
 class RDAP_Resolver(object):
     GET_RETRIES = 10
     RATE_LIMITATION_RETRIES = 5
-    RATE_LIMITATION_DELAY = 61
 
-    def __init__(self, ipv4_resolver):
+    def __init__(self, ipv4_resolver, rate_limiter=None, cache=None,
+                 failure_cache=None, bootstrap=None):
+        '''
+        cache is an optional RDAPCache for the responses we get, and
+        failure_cache an optional FailureCache for the RDAP hosts that fail.
+        bootstrap is an optional RadixTree of RDAP base URLs, as returned by
+        populate_RDAP_bootstrap()
+        '''
         # TODO Use some sort of deque here
         self._resolver = ipv4_resolver
         self._session = requests.Session()
+        if rate_limiter is None:
+            rate_limiter = HostRateLimiter()
+        self._rate_limiter = rate_limiter
+        self._cache = cache
+        self._failure_cache = failure_cache
+        self._bootstrap = bootstrap
         # TODO Global header and hook stuff here
 
     def _get_raw_RDAP_JSON(self, rdap_url):
@@ -35,51 +51,173 @@ class RDAP_Resolver(object):
         like RDAP notices indicating rate limitation violations.
         '''
 
+        cached = self._cached_response(rdap_url)
+        if cached is not None and self._cache.is_fresh(cached):
+            return self._cached_RDAP_JSON(cached)
+        get_kwargs = {}
+        if cached is not None:
+            get_kwargs['headers'] = cached.validators()
+
         redirect_url = None
         req_count = 0
+        host = urlsplit(rdap_url).hostname
         while req_count < self.GET_RETRIES:
-            network_response = self._session.get(
-                rdap_url,
-                allow_redirects=False,
-            )
+            self._rate_limiter.wait(host)
+            try:
+                network_response = self._session.get(
+                    rdap_url,
+                    allow_redirects=False,
+                    **get_kwargs
+                )
+            except requests.RequestException as ex:
+                raise self._endpoint_failure(
+                    host, "RDAP request to {0} failed: {1!r}", rdap_url, ex
+                )
             req_count += 1
 
             log.info(
                 "RDAP query %s: %d", rdap_url, network_response.status_code
             )
 
+            if self._is_not_modified(
+                    rdap_url, cached, network_response.status_code):
+                return self._cached_RDAP_JSON(cached)
+
             if network_response.is_redirect:
-                redirect_url = network_response.headers.get('Location')
-                if redirect_url:
-                    log.debug('RDAP redirect to %s', redirect_url)
-                    break
-                else:
-                    raise RDAPResolutionException('RDAP redirect with no URI')
+                redirect_url = self._redirect_location(
+                    network_response.headers
+                )
+                break
 
-            if network_response.status_code == requests.codes['OK']:
+            if self._is_final_status(
+                    rdap_url,
+                    network_response.status_code,
+                    network_response.headers
+            ):
                 break
+        else:
+            raise self._endpoint_failure(
+                host, "Out of retries for RDAP resource: {0}", rdap_url
+            )
 
-            if network_response.status_code == requests.codes['NOT_FOUND']:
-                raise RDAPResolutionException(
-                    "RDAP resource not found: {0}",
-                    rdap_url
-                )
+        self._store_response(
+            rdap_url,
+            network_response.status_code,
+            network_response.content,
+            network_response.headers
+        )
+        return self._RDAP_JSON_from_body(network_response.json, redirect_url)
 
-            # What codes exactly does this cover?
-            if network_response.status_code == requests.codes['BAD_REQUEST']:
-                raise RDAPResolutionException(
-                    "RDAP request returned {0}",
-                    network_response.status_code
-                )
-        else:
+    def _cached_response(self, rdap_url):
+        if self._cache is None:
+            return None
+        return self._cache.lookup(rdap_url)
+
+    def _cached_RDAP_JSON(self, cached):
+        '''
+        Does for a CachedResponse what _get_raw_RDAP_JSON() does for a
+        network response.
+        '''
+        redirect_url = None
+        if cached.status_code in REDIRECT_STATUS_CODES:
+            redirect_url = cached.location
+        return self._RDAP_JSON_from_body(
+            lambda: json.loads(cached.body.decode('utf-8')), redirect_url
+        )
+
+    def _is_not_modified(self, rdap_url, cached, status_code):
+        '''
+        Whether a response to a conditional GET means our cached response is
+        still current.
+        '''
+        if cached is None or status_code != requests.codes['NOT_MODIFIED']:
+            return False
+        log.debug("Cached RDAP response for %s is current", rdap_url)
+        self._cache.revalidated(rdap_url)
+        return True
+
+    def _check_past_failure(self, host):
+        '''
+        Raises RDAPResolutionException if the RDAP host failed recently.
+        '''
+        if self._failure_cache is None:
+            return
+        failure = self._failure_cache.endpoint_failure(host)
+        if failure is not None:
             raise RDAPResolutionException(
-                "Out of retries for RDAP resource: {0}",
+                "Skipping {0}, it failed {1} time(s): {2}",
+                host, failure.failures, failure.reason
+            )
+
+    def _endpoint_failure(self, host, msg, *msg_args):
+        '''
+        Records that the RDAP host failed us, as opposed to not having what
+        we asked for, and returns the RDAPResolutionException to raise.
+        '''
+        failure = RDAPResolutionException(msg, *msg_args)
+        if self._failure_cache is not None:
+            self._failure_cache.record_endpoint_failure(host, str(failure))
+        return failure
+
+    def _endpoint_succeeded(self, host):
+        if self._failure_cache is not None:
+            self._failure_cache.endpoint_succeeded(host)
+
+    def _store_response(self, rdap_url, status_code, body, headers):
+        # Errors aren't cached, they may well be transient
+        if self._cache is not None and (
+                status_code == requests.codes['OK'] or
+                status_code in REDIRECT_STATUS_CODES):
+            self._cache.store(rdap_url, status_code, body, headers)
+
+    @staticmethod
+    def _redirect_location(headers):
+        redirect_url = headers.get('Location')
+        if not redirect_url:
+            raise RDAPResolutionException('RDAP redirect with no URI')
+        log.debug('RDAP redirect to %s', redirect_url)
+        return redirect_url
+
+    @staticmethod
+    def _is_final_status(rdap_url, status_code, headers):
+        '''
+        Whether a non-redirect HTTP status code means we got the RDAP JSON.
+        Raises RDAPResolutionException for status codes that won't get any
+        better if we try again, and RateLimitationException for 429s.
+        '''
+        if status_code == requests.codes['OK']:
+            return True
+
+        if status_code == requests.codes['TOO_MANY_REQUESTS']:
+            raise RateLimitationException(
+                "Too many requests: {0}",
+                rdap_url,
+                retry_after=parse_retry_after(headers.get('Retry-After'))
+            )
+
+        if status_code == requests.codes['NOT_FOUND']:
+            raise RDAPResolutionException(
+                "RDAP resource not found: {0}",
                 rdap_url
             )
 
+        # What codes exactly does this cover?
+        if status_code == requests.codes['BAD_REQUEST']:
+            raise RDAPResolutionException(
+                "RDAP request returned {0}",
+                status_code
+            )
+        return False
+
+    @staticmethod
+    def _RDAP_JSON_from_body(decode_json, redirect_url):
+        '''
+        Calls decode_json to get the RDAP JSON out of a response body, and
+        raises RDAPRedirectionDetected if the response was a redirect.
+        '''
         raw_json = None
         try:
-            raw_json = network_response.json()
+            raw_json = decode_json()
         except Exception:  # pylint:disable=W0703
             if redirect_url:
                 raise RDAPRedirectionDetected(redir_url=redirect_url)
@@ -92,25 +230,61 @@ class RDAP_Resolver(object):
             )
         return raw_json
 
+    @staticmethod
+    def _check_rate_limitation(rdap_json):
+        '''
+        Raises RateLimitationException if the RDAP JSON has a notice telling
+        us we're making too many queries.
+        '''
+        try:
+            for notice_json in rdap_json['notices']:
+                if 'rate limit' in notice_json['title'].lower():
+                    log.warning(
+                        'Rate limitation complaint: %s',
+                        str(notice_json)
+                    )
+                    raise RateLimitationException
+
+        except KeyError:
+            # Notices are optional
+            pass
+
     def resolve(self, network):
         # Discovers inetnums contained within network
-        network_slash_eight = network % 8
-        slash_eight_delegation = self._resolver.\
-            get_top_level_assignment(network_slash_eight)
+        return self.resolve_from_url(self._RDAP_URL(network))
 
-        if not slash_eight_delegation.rdap_URLs:
-            raise RDAPResolutionException("No RDAP URL for {0}", network)
+    def _RDAP_URL(self, network):
+        rdap_base_URLs = None
+        if self._bootstrap is not None:
+            try:
+                _, rdap_base_URLs = self._bootstrap.longest_match(network)
+            except KeyError:
+                pass
 
-        rdap_base_url = None
-        for rdap_base_url in slash_eight_delegation.rdap_URLs:
-            if rdap_base_url.startswith('http:'):
-                break
+        if not rdap_base_URLs:
+            network_slash_eight = network % 8
+            slash_eight_delegation = self._resolver.\
+                get_top_level_assignment(network_slash_eight)
+            rdap_base_URLs = slash_eight_delegation.rdap_URLs
+
+        if not rdap_base_URLs:
+            raise RDAPResolutionException("No RDAP URL for {0}", network)
 
         # We want to avoid double slashes
-        if rdap_base_url.endswith('/'):
-            rdap_base_url = rdap_base_url[:-1]
-        rdap_url = rdap_base_url + '/ip/' + str(network.floor())
-        return self.resolve_from_url(rdap_url)
+        rdap_base_url = self._preferred_URL(rdap_base_URLs).rstrip('/')
+        return rdap_base_url + '/ip/' + str(network.floor())
+
+    @staticmethod
+    def _preferred_URL(rdap_base_URLs):
+        '''
+        Picks one of the equivalent URLs of an RDAP service, preferring HTTPS
+        as RFC 7484 suggests. The choice doesn't depend on the order the URLs
+        come in, so that responses to it can be cached.
+        '''
+        return min(
+            rdap_base_URLs,
+            key=lambda url: (not url.startswith('https:'), url)
+        )
 
     def resolve_from_url(self, rdap_url):
         '''
@@ -120,31 +294,24 @@ class RDAP_Resolver(object):
         violations.
         '''
 
+        host = urlsplit(rdap_url).hostname
+        self._check_past_failure(host)
         rate_limitation_retries = 0
         rdap_json = redirect = None
 
         while rate_limitation_retries < self.RATE_LIMITATION_RETRIES:
 
             try:
-                rdap_json = self._get_raw_RDAP_JSON(rdap_url)
                 rate_limitation_retries += 1
+                rdap_json = self._get_raw_RDAP_JSON(rdap_url)
+                self._check_rate_limitation(rdap_json)
 
-                try:
-                    for notice_json in rdap_json['notices']:
-                        if 'rate limit' in notice_json['title'].lower():
-                            log.warning(
-                                'Rate limitation complaint: %s',
-                                str(notice_json)
-                            )
-                            raise RateLimitationException
-
-                except KeyError:
-                    # Notices are optional
-                    pass
-
-            except RateLimitationException:
-                # Take five and try again
-                time.sleep(self.RATE_LIMITATION_DELAY)
+            except RateLimitationException as rate_ex:
+                # Slow down, the next query will be paced accordingly
+                self._rate_limiter.throttle(host, rate_ex.retry_after)
+                # The complaint may well be what we've just cached
+                if self._cache is not None:
+                    self._cache.discard(rdap_url)
 
             except RDAPRedirectionDetected as redir:
                 # We got an HTTP redirection. If we didn't get a RDAP JSON
@@ -174,6 +341,8 @@ class RDAP_Resolver(object):
                 )
                 raise ex
             else:
+                self._rate_limiter.succeeded(host)
+                self._endpoint_succeeded(host)
                 break
 
         else:
@@ -204,7 +373,10 @@ class RDAP_Resolver(object):
                 end_address = end_address[:-3]
             end_address = Address(end_address)
 
-            assigned = AssignedSubnet(
+            # The RDAP range may not be a CIDR subnet. We return the
+            # assignment for the start of the range, the rest is in its
+            # range_subnets
+            assigned, *_ = AssignedSubnet.from_range(
                 start_address,
                 end_address,
                 rdap_json['name']
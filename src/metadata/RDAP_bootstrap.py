@@ -0,0 +1,84 @@
+'''
+RFC 7484 bootstrap registry of the RDAP services that are authoritative for
+IPv4 prefixes. Its entries can be more specific than the /8s in the IANA
+address space registry, e.g. for space that's been transferred between RIRs.
+'''
+
+from .. import RDAP_BOOTSTRAP_PATH
+from ..net.IPv4 import Subnet, Address
+from ..net.radix import RadixTree
+from ..tools.logger import ModuleLogger
+from . import constants
+from .IANA_IPv4_assignments import refresh_local_copy, is_stale
+
+import json
+import os
+import requests
+
+log = ModuleLogger(__name__)
+
+
+def parse_RDAP_bootstrap(json_path):
+    '''
+    Parses the bootstrap registry at json_path into a RadixTree that maps
+    every prefix to a tuple of RDAP base URLs, without trailing slashes.
+    '''
+    with open(json_path, 'rb') as json_file:
+        bootstrap = json.loads(json_file.read().decode('utf-8'))
+
+    prefixes = RadixTree()
+    for service_prefixes, service_URLs in bootstrap['services']:
+        base_URLs = tuple(url.rstrip('/') for url in service_URLs)
+        if not base_URLs:
+            continue
+        for prefix in service_prefixes:
+            network, _, prefix_length = prefix.partition('/')
+            if not prefix_length:
+                raise ValueError("Malformed prefix: {0}".format(prefix))
+            prefixes.insert(
+                Subnet(Address(network), int(prefix_length)), base_URLs
+            )
+
+    # Resolvers in several threads look prefixes up
+    prefixes.build()
+    log.debug("%d prefixes in the RDAP bootstrap registry", len(prefixes))
+    return prefixes
+
+
+def refresh_RDAP_bootstrap(bootstrap_path):
+    '''
+    Downloads the bootstrap registry to bootstrap_path, unless the copy
+    already there is current.
+    '''
+    refresh_local_copy(
+        constants.RDAP_BOOTSTRAP_URL, bootstrap_path, parse_RDAP_bootstrap
+    )
+
+
+def populate_RDAP_bootstrap(bootstrap_path=None,
+                            max_age=constants.RDAP_BOOTSTRAP_MAX_AGE,
+                            offline=False):
+    '''
+    Returns the bootstrap registry as parse_RDAP_bootstrap() does, from the
+    local copy at bootstrap_path. The local copy is only refreshed when it's
+    older than max_age seconds. Returns None if there's no local copy and it
+    can't be downloaded, in which case RDAP queries go to the services IANA
+    lists for each /8.
+    '''
+    if bootstrap_path is None:
+        bootstrap_path = RDAP_BOOTSTRAP_PATH
+
+    if not offline and is_stale(bootstrap_path, max_age):
+        try:
+            refresh_RDAP_bootstrap(bootstrap_path)
+        except (requests.RequestException, OSError, ValueError,
+                KeyError) as ex:
+            log.warning("Couldn't refresh RDAP bootstrap registry: %s", ex)
+
+    if not os.path.exists(bootstrap_path):
+        return None
+    try:
+        return parse_RDAP_bootstrap(bootstrap_path)
+    except (OSError, ValueError, KeyError) as ex:
+        log.warning("Couldn't parse RDAP bootstrap registry: %s", ex)
+        return None
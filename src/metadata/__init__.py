@@ -42,7 +42,30 @@ class RDAPRedirectionDetected(ResolutionException):
 
 
 class RateLimitationException(ResolutionException):
-    pass
+    def __init__(self, *args, retry_after=None):
+        super().__init__(*args)
+        self.retry_after = retry_after
+
+
+class QueryDeferredException(ResolutionException):
+    '''
+    Raised instead of waiting for a throttled host when the wait would be too
+    long. The query should be retried after retry_after seconds.
+    '''
+    def __init__(self, host, retry_after):
+        super().__init__(
+            "Query to {0} deferred by {1:.1f}s", host, retry_after
+        )
+        self.host = host
+        self.retry_after = retry_after
+
+
+class WhoisConnectionException(ResolutionException):
+    '''
+    Raised when a whois server can't be reached, or doesn't answer in time.
+    Unlike most resolution failures, it may well not happen again if the
+    query is retried later.
+    '''
 
 
 class DataException(Exception):
@@ -1,11 +1,12 @@
-from ..net.IPv4 import Subnet
+from ..net.IPv4 import Subnet, range_to_subnets
 from . import get_dec_base
 from .types import SQLAddress
 from ..tools.logger import term
 
-from sqlalchemy import Column, Unicode, SmallInteger, Integer
+from sqlalchemy import Column, Unicode, SmallInteger, Integer, Float
 from sqlalchemy import UniqueConstraint, ForeignKey
 from sqlalchemy.orm import relationship, remote, foreign, synonym, backref
+from sqlalchemy.orm import reconstructor
 from sqlalchemy.ext.declarative import declared_attr
 
 
@@ -24,6 +25,11 @@ class AssignedSubnet(Subnet, sa_base):
     _name = Column(Unicode, name='name')
     _network = Column(SQLAddress, name='address')
     _prefix_length = Column(SmallInteger, name='prefix')
+    # When the assignment was fetched from a registry, as a UNIX timestamp
+    _updated = Column(Float, name='updated')
+    # Where bulk-imported assignments come from. Those we resolved one at a
+    # time with RDAP or whois have none.
+    _source = Column(Unicode, name='source')
 
     # These synonyms are provided so that other code can dereference class
     # attributes that aren't private when, e.g. setting up a query to sort on
@@ -31,6 +37,8 @@ class AssignedSubnet(Subnet, sa_base):
     mapped_name = synonym("_name")
     mapped_network = synonym("_network")
     mapped_prefix_length = synonym("_prefix_length")
+    mapped_updated = synonym("_updated")
+    mapped_source = synonym("_source")
 
     __table_args__ = (
         # We want to allow multiple names for the same network address,
@@ -95,10 +103,55 @@ class AssignedSubnet(Subnet, sa_base):
             )
         self._name = value
 
+    @property
+    def updated(self):
+        return self._updated
+
+    @property
+    def source(self):
+        return self._source
+
     def __init__(self, *args):
         super(self.__class__, self).__init__(*args[:2])
         *_, name = args
         self.name = name
+        # These aren't persisted. See from_range()
+        self.range_subnets = (self,)
+        self.related_ranges = ()
+
+    def _set_network(self, network, prefix_length):
+        # These are columns, so they're set through the ORM's descriptors
+        # rather than Subnet's slots
+        object.__setattr__(self, '_network', network)
+        object.__setattr__(self, '_prefix_length', prefix_length)
+        self._cache_bounds()
+
+    @reconstructor
+    def _init_on_load(self):
+        # SQLAlchemy doesn't call __init__ on instances loaded from the DB,
+        # so the bounds cached by Subnet need to be computed here
+        self._cache_bounds()
+        self.range_subnets = (self,)
+        self.related_ranges = ()
+
+    @classmethod
+    def from_range(clazz, start, end, name):
+        '''
+        Registries assign ranges of addresses that needn't be CIDR subnets.
+        This returns the assigned subnets that exactly cover the range from
+        start to end, in ascending order. The range_subnets attribute of each
+        of them is set to the whole sequence.
+
+        Resolvers that come across other assignments while resolving this one
+        can set related_ranges to a tuple of their range_subnets.
+        '''
+        range_subnets = tuple(
+            clazz(subnet.network, subnet.prefix_length, name)
+            for subnet in range_to_subnets(start, end)
+        )
+        for assigned in range_subnets:
+            assigned.range_subnets = range_subnets
+        return range_subnets
 
     def __repr__(self):
         return ("<IPv4 assignment: {t.bold}{0}{t.normal}/{t.green}{1}"
@@ -0,0 +1,255 @@
+'''
+asyncio flavour of the RDAP resolver, so that many RDAP queries can be in
+flight at once.
+'''
+
+from . import (
+    RDAPResolutionException, RateLimitationException,
+    RDAPRedirectException, RDAPRedirectionDetected
+)
+from .RDAP import RDAP_Resolver, REDIRECT_STATUS_CODES
+from ..tools.logger import ModuleLogger
+
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import urlsplit
+import asyncio
+import functools
+import json
+
+log = ModuleLogger(__name__)
+
+
+class AsyncRDAP_Resolver(RDAP_Resolver):
+    '''
+    Resolves networks with RDAP the same way RDAP_Resolver does, except that
+    every query is a coroutine. The number of concurrent requests to any
+    given RDAP host is bounded.
+    '''
+
+    HOST_CONCURRENCY = 4
+    REQUEST_TIMEOUT = 30
+
+    def __init__(self, ipv4_resolver, host_concurrency=None,
+                 rate_limiter=None, cache=None, failure_cache=None,
+                 bootstrap=None):
+        '''
+        host_concurrency maps RDAP host names to the maximum number of
+        concurrent requests to them. Other hosts get HOST_CONCURRENCY. See
+        RDAP_Resolver for the other arguments.
+        '''
+        super().__init__(
+            ipv4_resolver, rate_limiter, cache, failure_cache, bootstrap
+        )
+        self._host_concurrency = dict(host_concurrency or {})
+        self._host_semaphores = {}
+
+    @staticmethod
+    async def _blocking(func, *args):
+        '''
+        Calls func in the event loop's default executor, since the caches
+        are SQLite databases and would block the event loop.
+        '''
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(func, *args)
+        )
+
+    def _host_semaphore(self, host):
+        try:
+            return self._host_semaphores[host]
+        except KeyError:
+            semaphore = asyncio.Semaphore(
+                self._host_concurrency.get(host, self.HOST_CONCURRENCY)
+            )
+            self._host_semaphores[host] = semaphore
+            return semaphore
+
+    async def _http_get(self, url, request_headers=None):
+        '''
+        Performs a single HTTP GET without following redirects. Returns the
+        status code, the headers and the body.
+        '''
+        split_url = urlsplit(url)
+        if split_url.scheme not in ('http', 'https'):
+            raise RDAPResolutionException("Unsupported RDAP URL: {0}", url)
+
+        async with self._host_semaphore(split_url.hostname):
+            await self._rate_limiter.wait_async(split_url.hostname)
+            try:
+                return await asyncio.wait_for(
+                    self._http_exchange(split_url, request_headers),
+                    self.REQUEST_TIMEOUT
+                )
+            except (OSError, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError, ValueError) as ex:
+                raise await self._blocking(
+                    self._endpoint_failure, split_url.hostname,
+                    "RDAP request to {0} failed: {1!r}", url, ex
+                )
+
+    @staticmethod
+    async def _http_exchange(split_url, request_headers=None):
+        use_tls = 'https' == split_url.scheme
+        port = split_url.port or (443 if use_tls else 80)
+        path = split_url.path or '/'
+        if split_url.query:
+            path += '?' + split_url.query
+
+        reader, writer = await asyncio.open_connection(
+            split_url.hostname, port, ssl=use_tls or None
+        )
+        try:
+            writer.write((
+                "GET {0} HTTP/1.1\r\n"
+                "Host: {1}\r\n"
+                "Accept: application/rdap+json, application/json\r\n"
+                "{2}"
+                "Connection: close\r\n"
+                "\r\n"
+            ).format(path, split_url.netloc, ''.join(
+                "{0}: {1}\r\n".format(name, value)
+                for name, value in (request_headers or {}).items()
+            )).encode('latin-1'))
+            await writer.drain()
+
+            status_line = await reader.readline()
+            status_code = int(status_line.split(None, 2)[1])
+
+            headers = CaseInsensitiveDict()
+            while True:
+                header_line = await reader.readline()
+                if header_line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = header_line.decode('latin-1').partition(':')
+                headers[name.strip()] = value.strip()
+
+            if 'chunked' == headers.get('Transfer-Encoding', '').lower():
+                body = bytearray()
+                while True:
+                    chunk_size = int(
+                        (await reader.readline()).split(b';')[0], 16
+                    )
+                    if not chunk_size:
+                        break
+                    body += await reader.readexactly(chunk_size)
+                    await reader.readexactly(2)
+            elif 'Content-Length' in headers:
+                body = await reader.readexactly(
+                    int(headers['Content-Length'])
+                )
+            else:
+                body = await reader.read()
+        finally:
+            writer.close()
+
+        return status_code, headers, bytes(body)
+
+    async def _get_raw_RDAP_JSON(self, rdap_url):
+        '''
+        See RDAP_Resolver._get_raw_RDAP_JSON()
+        '''
+
+        cached = None
+        if self._cache is not None:
+            cached = await self._blocking(self._cache.lookup, rdap_url)
+        if cached is not None and self._cache.is_fresh(cached):
+            return self._cached_RDAP_JSON(cached)
+        request_headers = cached.validators() if cached is not None else None
+
+        redirect_url = None
+        req_count = 0
+        host = urlsplit(rdap_url).hostname
+        while req_count < self.GET_RETRIES:
+            status_code, headers, body = await self._http_get(
+                rdap_url, request_headers
+            )
+            req_count += 1
+
+            log.info("RDAP query %s: %d", rdap_url, status_code)
+
+            if cached is not None and await self._blocking(
+                    self._is_not_modified, rdap_url, cached, status_code):
+                return self._cached_RDAP_JSON(cached)
+
+            if status_code in REDIRECT_STATUS_CODES:
+                redirect_url = self._redirect_location(headers)
+                break
+
+            if self._is_final_status(rdap_url, status_code, headers):
+                break
+        else:
+            raise await self._blocking(
+                self._endpoint_failure,
+                host, "Out of retries for RDAP resource: {0}", rdap_url
+            )
+
+        await self._blocking(
+            self._store_response, rdap_url, status_code, body, headers
+        )
+        return self._RDAP_JSON_from_body(
+            lambda: json.loads(body.decode('utf-8')), redirect_url
+        )
+
+    async def resolve(self, network):
+        return await self.resolve_from_url(self._RDAP_URL(network))
+
+    async def resolve_from_url(self, rdap_url):
+        '''
+        See RDAP_Resolver.resolve_from_url()
+        '''
+
+        host = urlsplit(rdap_url).hostname
+        await self._blocking(self._check_past_failure, host)
+        rate_limitation_retries = 0
+        rdap_json = redirect = None
+
+        while rate_limitation_retries < self.RATE_LIMITATION_RETRIES:
+
+            try:
+                rate_limitation_retries += 1
+                rdap_json = await self._get_raw_RDAP_JSON(rdap_url)
+                self._check_rate_limitation(rdap_json)
+
+            except RateLimitationException as rate_ex:
+                self._rate_limiter.throttle(host, rate_ex.retry_after)
+                if self._cache is not None:
+                    await self._blocking(self._cache.discard, rdap_url)
+
+            except RDAPRedirectionDetected as redir:
+                if not redir.redir_json:
+                    raise RDAPRedirectException(
+                        'Redirection to {0}. No provisional assignment',
+                        redir.redir_url,
+                        rdap_url,
+                        redir_url=redir.redir_url,
+                    )
+                redirect = redir.redir_url
+                rdap_json = redir.redir_json
+                break
+
+            except RDAPResolutionException:
+                log.error(
+                    'Failed to get a valid RDAP response for: %s',
+                    rdap_url
+                )
+                raise
+            else:
+                self._rate_limiter.succeeded(host)
+                await self._blocking(self._endpoint_succeeded, host)
+                break
+
+        else:
+            raise RDAPResolutionException(
+                "Couldn't get around rate limitation for {0}", rdap_url
+            )
+
+        return self._assigned_subnet_from_RDAP(rdap_json, redirect=redirect)
+
+    async def resolve_many(self, networks):
+        '''
+        Resolves networks concurrently. Returns a list with either the
+        AssignedSubnet or the ResolutionException for each network.
+        '''
+        return await asyncio.gather(
+            *(self.resolve(network) for network in networks),
+            return_exceptions=True
+        )
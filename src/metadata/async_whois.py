@@ -0,0 +1,88 @@
+'''
+Batches the whois fallback queries of concurrent asyncio resolutions, so that
+they can be pipelined.
+'''
+
+from ..tools.logger import ModuleLogger
+
+import asyncio
+
+log = ModuleLogger(__name__)
+
+
+class WhoisBatcher(object):
+    '''
+    Falls back on whois for DelegationResolver.resolve_async(). The networks
+    that fall back on the same whois host while a batch for it is in flight
+    are queued, and sent together in the next batch with
+    DelegationResolver.resolve_whois_many(). At most MAX_BATCH networks go
+    in a batch.
+
+    Batches run in the event loop's default executor. Each one gets a clone
+    of resolver of its own, since whois clients can't be shared between
+    threads. Clones are reused from one batch to the next, so that their
+    connections to whois servers are too.
+    '''
+
+    MAX_BATCH = 16
+
+    def __init__(self, resolver, max_batch=MAX_BATCH):
+        self._resolver = resolver
+        self._max_batch = max_batch
+        # Whois host (or None for the /8's) -> [(network, future), ...], for
+        # the hosts a batch is in flight for
+        self._pending = {}
+        self._idle_resolvers = []
+        self._senders = set()
+
+    async def resolve(self, network, rdap_ex):
+        '''
+        Returns the assignment whois has for network after RDAP failed with
+        rdap_ex, or raises the ResolutionException that prevented it.
+        '''
+        log.warning("Caught \"%s\". Trying whois", rdap_ex)
+        whois_host = self._resolver.whois_fallback_host(rdap_ex)
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._pending[whois_host].append((network, future))
+        except KeyError:
+            self._pending[whois_host] = [(network, future)]
+            sender = asyncio.ensure_future(self._send_batches(whois_host))
+            # The event loop only keeps weak references to its tasks
+            self._senders.add(sender)
+            sender.add_done_callback(self._senders.discard)
+        return await future
+
+    async def _send_batches(self, whois_host):
+        '''
+        Sends batches for whois_host until there's nothing left to send.
+        '''
+        loop = asyncio.get_running_loop()
+        pending = self._pending[whois_host]
+        while pending:
+            batch = pending[:self._max_batch]
+            del pending[:len(batch)]
+            networks = [network for network, _ in batch]
+
+            if self._idle_resolvers:
+                resolver = self._idle_resolvers.pop()
+            else:
+                resolver = self._resolver.clone()
+            try:
+                results = await loop.run_in_executor(
+                    None, resolver.resolve_whois_many, networks, whois_host
+                )
+            except Exception as ex:  # pylint:disable=W0703
+                results = [ex] * len(batch)
+            finally:
+                self._idle_resolvers.append(resolver)
+
+            for (_, future), result in zip(batch, results):
+                # Nobody's waiting for the result of a cancelled resolution
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        del self._pending[whois_host]
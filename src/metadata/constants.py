@@ -9,6 +9,36 @@ IANA_TOP_LEVEL_ALLOCATION_NS = {
     "assignments": "http://www.iana.org/assignments"
 }
 
+# The registry changes a few times a year at most
+IANA_REGISTRY_MAX_AGE = 7 * 24 * 3600
+
+# RFC 7484 bootstrap registry of the RDAP services for IPv4 prefixes
+RDAP_BOOTSTRAP_URL = 'https://data.iana.org/rdap/ipv4.json'
+
+# Unlike the /8s, its finer-grained entries change as space is transferred
+RDAP_BOOTSTRAP_MAX_AGE = 24 * 3600
+
+# Only these /8s are handed out by IANA, either to RIRs or, historically, to
+# end users
+IANA_MAPPABLE_STATUSES = ('ALLOCATED', 'LEGACY')
+
+REGIONAL_REGISTRY_WHOIS_HOSTS = {
+    'whois.afrinic.net': 'AFRINIC',
+    'whois.apnic.net': 'APNIC',
+    'whois.arin.net': 'ARIN',
+    'whois.lacnic.net': 'LACNIC',
+    'whois.ripe.net': 'RIPE NCC',
+}
+
+# These run the RIPE NCC's whois server, which keeps the connection open for
+# more queries when asked to with -k
+KEEPALIVE_WHOIS_HOSTS = (
+    'whois.afrinic.net', 'whois.apnic.net', 'whois.ripe.net',
+)
+
+# Whois attributes that refer queries to another server: ARIN's, and IANA's
+WHOIS_REFERRAL_ATTRIBUTES = ('ReferralServer', 'refer')
+
 reserved_networks = (
     AssignedSubnet(
         Address((0, 0, 0, 0)), 8,
@@ -0,0 +1,116 @@
+'''
+Parser for the RIR statistics exchange format, i.e. the
+delegated-<registry>-extended-latest files every RIR publishes. They list
+what each RIR has allocated and assigned, but not the names of the networks.
+'''
+
+from ..net.IPv4 import Address, MAX_UINT32, range_to_subnets
+from ..tools.logger import ModuleLogger
+
+from collections import namedtuple
+import bz2
+import gzip
+
+log = ModuleLogger(__name__)
+
+# Only these records are for address space that's been handed out
+DELEGATED_STATUSES = ('allocated', 'assigned')
+
+# Bulk-imported subnets are tagged with this prefix and the registry's name
+DELEGATED_SOURCE_PREFIX = 'delegated-'
+
+
+class DelegatedRecord(namedtuple('DelegatedRecord', (
+        'registry', 'cc', 'start', 'count', 'date', 'status', 'opaque_id'))):
+    '''
+    An IPv4 record in a delegated statistics file. count is the number of
+    addresses from start onwards, which isn't always a power of two.
+    '''
+
+    __slots__ = ()
+
+    @property
+    def name(self):
+        '''
+        A placeholder name made of the registry, the country and, if the
+        file is an extended one, the ID of the organisation the space was
+        delegated to.
+        '''
+        name = '{0}-{1}'.format(self.registry, self.cc).upper()
+        if self.opaque_id:
+            name += '-' + self.opaque_id
+        return name
+
+    @property
+    def source(self):
+        return DELEGATED_SOURCE_PREFIX + self.registry
+
+    def subnets(self):
+        '''
+        Returns an iterator over the CIDR subnets that exactly cover the
+        record's addresses.
+        '''
+        first = int(self.start)
+        return range_to_subnets(first, first + self.count - 1)
+
+
+def open_delegated(path):
+    '''
+    Opens a delegated statistics file for reading in binary mode. Files
+    that are compressed with gzip or bzip2, as some RIRs publish them, are
+    decompressed on the fly.
+    '''
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def iter_delegated_IPv4(lines):
+    '''
+    Yields a DelegatedRecord for every allocated or assigned IPv4 range in
+    lines, an iterable of the lines of a delegated statistics file as bytes
+    or str. Headers, summaries, comments and records for other kinds of
+    resources are skipped. Raises ValueError for malformed IPv4 records.
+    '''
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        fields = line.split('|')
+        # The version header starts with a digit. Summary lines have a '*'
+        # for a country and end with 'summary'.
+        if len(fields) < 7 or 'ipv4' != fields[2] or 'summary' == fields[-1]:
+            continue
+
+        registry, cc, _, start, count, date, status = fields[:7]
+        if status not in DELEGATED_STATUSES:
+            continue
+
+        try:
+            record = DelegatedRecord(
+                registry, cc, Address(start), int(count), date, status,
+                fields[7] if len(fields) > 7 else None
+            )
+        except ValueError:
+            raise ValueError("Malformed delegated record: {0}".format(line))
+        if record.count < 1 or \
+                int(record.start) + record.count - 1 > MAX_UINT32:
+            raise ValueError("Malformed delegated record: {0}".format(line))
+        yield record
+
+
+def delegated_rows(records):
+    '''
+    Yields a (subnet, name, source) row for every subnet of every
+    DelegatedRecord in records, as DataManager.bulk_upsert() expects them.
+    '''
+    for record in records:
+        name = record.name
+        source = record.source
+        for subnet in record.subnets():
+            yield subnet, name, source
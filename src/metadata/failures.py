@@ -0,0 +1,140 @@
+'''
+On-disk record of the addresses we couldn't resolve and the endpoints that
+failed us, so that we don't waste queries on them again too soon.
+'''
+
+from ..tools.logger import ModuleLogger
+from .sqlite_store import SQLiteStore
+
+from collections import namedtuple
+import time
+
+log = ModuleLogger(__name__)
+
+
+class Failure(namedtuple('Failure', (
+        'reason', 'failures', 'failed', 'expires'))):
+    '''
+    A failure to resolve an address range or to get an answer from an
+    endpoint. failures is the number of times in a row it failed.
+    '''
+
+    __slots__ = ()
+
+
+class FailureCache(SQLiteStore):
+    '''
+    A SQLite store of failed address ranges and endpoints (RDAP and whois
+    hosts). A failure is remembered for a TTL that doubles every time it
+    happens again, up to a cap. Endpoints get shorter TTLs than addresses,
+    since they're more likely to fail for transient reasons.
+    '''
+
+    RANGE_TTL = 3600
+    RANGE_MAX_TTL = 30 * 24 * 3600
+    ENDPOINT_TTL = 60
+    ENDPOINT_MAX_TTL = 24 * 3600
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS failed_ranges ('
+        ' first INTEGER NOT NULL,'
+        ' last INTEGER NOT NULL,'
+        ' reason TEXT,'
+        ' failures INTEGER NOT NULL,'
+        ' failed REAL NOT NULL,'
+        ' expires REAL NOT NULL,'
+        ' PRIMARY KEY (first, last)'
+        ');'
+        'CREATE TABLE IF NOT EXISTS failed_endpoints ('
+        ' endpoint TEXT PRIMARY KEY,'
+        ' reason TEXT,'
+        ' failures INTEGER NOT NULL,'
+        ' failed REAL NOT NULL,'
+        ' expires REAL NOT NULL'
+        ');'
+    )
+
+    def _record(self, table, key_columns, key, reason, ttl, max_ttl):
+        key_clause = ' AND '.join(column + ' = ?' for column in key_columns)
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                'SELECT failures FROM {0} WHERE {1}'.format(table, key_clause),
+                key
+            ).fetchone()
+            failures = 1 if row is None else row[0] + 1
+            now = self._clock()
+            expires = now + min(max_ttl, ttl * 2 ** (failures - 1))
+            db.execute(
+                'INSERT OR REPLACE INTO {0} ({1}, reason, failures, failed,'
+                ' expires) VALUES ({2})'.format(
+                    table, ', '.join(key_columns),
+                    ', '.join('?' * (len(key_columns) + 4))
+                ),
+                key + (reason, failures, now, expires)
+            )
+            db.commit()
+        log.debug("Failure #%d for %s: %s", failures, key, reason)
+        return Failure(reason, failures, now, expires)
+
+    def _lookup(self, query, args):
+        with self._lock:
+            row = self._db().execute(query, args + (self._clock(),)).fetchone()
+        if row is None:
+            return None
+        return Failure(*row)
+
+    def record_range_failure(self, first, last, reason):
+        '''
+        Records that the addresses from first to last couldn't be resolved.
+        '''
+        return self._record(
+            'failed_ranges', ('first', 'last'), (int(first), int(last)),
+            reason, self.RANGE_TTL, self.RANGE_MAX_TTL
+        )
+
+    def range_failure(self, address):
+        '''
+        Returns the unexpired Failure of a range that includes address, or
+        None.
+        '''
+        address = int(address)
+        return self._lookup(
+            'SELECT reason, failures, failed, expires FROM failed_ranges'
+            ' WHERE first <= ? AND last >= ? AND expires > ?'
+            ' ORDER BY expires DESC',
+            (address, address)
+        )
+
+    def record_endpoint_failure(self, endpoint, reason):
+        return self._record(
+            'failed_endpoints', ('endpoint',), (endpoint,), reason,
+            self.ENDPOINT_TTL, self.ENDPOINT_MAX_TTL
+        )
+
+    def endpoint_failure(self, endpoint):
+        '''
+        Returns the unexpired Failure of endpoint, or None.
+        '''
+        return self._lookup(
+            'SELECT reason, failures, failed, expires FROM failed_endpoints'
+            ' WHERE endpoint = ? AND expires > ?',
+            (endpoint,)
+        )
+
+    def time_left(self, failure):
+        '''
+        Returns the number of seconds until failure expires.
+        '''
+        return max(0.0, failure.expires - self._clock())
+
+    def endpoint_succeeded(self, endpoint):
+        '''
+        Forgets endpoint's past failures.
+        '''
+        with self._lock:
+            db = self._db()
+            db.execute(
+                'DELETE FROM failed_endpoints WHERE endpoint = ?', (endpoint,)
+            )
+            db.commit()
@@ -0,0 +1,94 @@
+from collections import namedtuple
+from heapq import merge
+
+from ..net.IPv4 import Address
+from ..net.intervals import IntervalSet
+from ..tools.logger import ModuleLogger
+from .constants import reserved_networks
+
+log = ModuleLogger(__name__)
+
+
+class Gap(namedtuple('Gap', ('first', 'last', 'registry'))):
+    '''
+    A range of addresses that should be assigned but isn't in the DB. registry
+    is None unless gaps are grouped by registry.
+    '''
+
+    __slots__ = ()
+
+    @property
+    def size(self):
+        return int(self.last) - int(self.first) + 1
+
+    def __str__(self):
+        return "{0} - {1}".format(self.first, self.last)
+
+
+class GapFinder(object):
+    '''
+    Finds the parts of the IPv4 address space that IANA has handed out but
+    that aren't covered by any complete assignment in the DB. Space that's
+    only covered by placeholders or by the enclosing inetnums of other
+    assignments still has to be mapped, so it's part of the gaps.
+    '''
+
+    def __init__(self, data_mgr, top_level_delegations):
+        '''
+        top_level_delegations is the list of TopLevelDelegations indexed by
+        top byte returned by populate_IANA_IPv4_assignments()
+        '''
+        self.data_mgr = data_mgr
+        self.top_level_delegations = top_level_delegations
+
+    def mappable_space(self, by_registry=False):
+        '''
+        Returns the sorted, disjoint (first, last, registry) ranges of
+        allocated /8s, minus reserved networks. When by_registry is False,
+        registry is None and adjacent ranges are coalesced.
+        '''
+        registry_space = {}
+        for tld in self.top_level_delegations:
+            if tld is None:
+                continue
+            if not tld.is_mappable():
+                log.debug("Skipping %r", tld)
+                continue
+            registry = tld.registry if by_registry else None
+            registry_space.setdefault(registry, IntervalSet()).add(
+                tld.delegation_subnet
+            )
+
+        reserved = IntervalSet(reserved_networks)
+        return list(merge(*(
+            [(first, last, registry) for first, last in space - reserved]
+            for registry, space in registry_space.items()
+        )))
+
+    def gaps(self, by_registry=False, by_size=False):
+        '''
+        Iterates over the Gaps in the mappable space, in address order or
+        from the largest to the smallest if by_size is True. Only the latter
+        needs to hold all gaps in memory.
+        '''
+        gaps = self._iter_gaps(by_registry)
+        if by_size:
+            return iter(sorted(gaps, key=lambda gap: -gap.size))
+        return gaps
+
+    def _iter_gaps(self, by_registry):
+        # This is a single merge of the mappable space with the assigned
+        # ranges, which come out of the DB sorted by first address
+        covered = self.data_mgr.address_ranges(complete_only=True)
+        cover = next(covered, None)
+        for first, last, registry in self.mappable_space(by_registry):
+            cursor = first
+            while cursor <= last:
+                while cover is not None and cover[1] < cursor:
+                    cover = next(covered, None)
+                if cover is None or cover[0] > last:
+                    yield Gap(Address(cursor), Address(last), registry)
+                    break
+                if cover[0] > cursor:
+                    yield Gap(Address(cursor), Address(cover[0] - 1), registry)
+                cursor = cover[1] + 1
@@ -0,0 +1,112 @@
+'''
+On-disk cache of RDAP HTTP responses, so that mapping the same space again
+doesn't have to query the RIRs again.
+'''
+
+from .sqlite_store import SQLiteStore
+
+from collections import namedtuple
+import time
+
+
+class CachedResponse(namedtuple('CachedResponse', (
+        'status_code', 'location', 'body', 'etag', 'last_modified',
+        'fetched'))):
+    '''
+    An HTTP response we got for an RDAP URL. location is only set for
+    redirects.
+    '''
+
+    __slots__ = ()
+
+    def validators(self):
+        '''
+        Returns the request headers that make a GET for the same URL
+        conditional on the response having changed.
+        '''
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class RDAPCache(SQLiteStore):
+    '''
+    A SQLite store of RDAP responses keyed by URL. Responses younger than ttl
+    seconds are fresh and can be used as they are. Stale ones have to be
+    revalidated with a conditional GET.
+    '''
+
+    # RIRs don't reassign address space that often
+    DEFAULT_TTL = 7 * 24 * 3600
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS rdap_responses ('
+        ' url TEXT PRIMARY KEY,'
+        ' status_code INTEGER NOT NULL,'
+        ' location TEXT,'
+        ' body BLOB NOT NULL,'
+        ' etag TEXT,'
+        ' last_modified TEXT,'
+        ' fetched REAL NOT NULL'
+        ');'
+    )
+
+    def __init__(self, path, ttl=DEFAULT_TTL, clock=time.time):
+        super().__init__(path, clock)
+        self.ttl = ttl
+
+    def lookup(self, url):
+        '''
+        Returns the CachedResponse for url, or None.
+        '''
+        with self._lock:
+            row = self._db().execute(
+                'SELECT status_code, location, body, etag, last_modified,'
+                ' fetched FROM rdap_responses WHERE url = ?',
+                (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return CachedResponse(*row)
+
+    def is_fresh(self, cached_response):
+        return self._clock() - cached_response.fetched < self.ttl
+
+    def store(self, url, status_code, body, headers):
+        '''
+        Stores the response to a GET for url. headers are the response's.
+        '''
+        with self._lock:
+            db = self._db()
+            db.execute(
+                'INSERT OR REPLACE INTO rdap_responses VALUES'
+                ' (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    url, status_code, headers.get('Location'), bytes(body),
+                    headers.get('ETag'), headers.get('Last-Modified'),
+                    self._clock(),
+                )
+            )
+            db.commit()
+
+    def revalidated(self, url):
+        '''
+        Records that the cached response for url is still current, e.g. after
+        a 304.
+        '''
+        with self._lock:
+            db = self._db()
+            db.execute(
+                'UPDATE rdap_responses SET fetched = ? WHERE url = ?',
+                (self._clock(), url)
+            )
+            db.commit()
+
+    def discard(self, url):
+        with self._lock:
+            db = self._db()
+            db.execute('DELETE FROM rdap_responses WHERE url = ?', (url,))
+            db.commit()
@@ -34,23 +34,22 @@ class SubnetLinker(object):
         ).filter(
             AssignedSubnet.next == None,  # noqa
             AssignedSubnet.previous == None,  # noqa
-        ).order_by(
-            AssignedSubnet.mapped_prefix_length
         )
 
+        containers = self.data_mgr.radix_tree(container_subnet_iter)
+
+        # The parent of a subnet is the most specific container that's
+        # strictly larger than it
         child_subnets = []
-        for cs in container_subnet_iter:
-            log.info("Finding subnets nested under %r", cs)
-            children_subnet_iter = self.data_mgr.query(
-                AssignedSubnet
-            ).filter(
-                AssignedSubnet.mapped_network >= cs.floor(),
-                AssignedSubnet.mapped_network <= cs.ceiling(),
-                AssignedSubnet.mapped_prefix_length > cs.prefix_length
-            )
-            for nested_subnet in children_subnet_iter:
-                log.info("Found %r", nested_subnet)
-                nested_subnet.parent = cs
-                child_subnets.append(nested_subnet)
+        for sub in self.data_mgr.all_records():
+            parent = None
+            for container, _ in containers.covering(sub):
+                if container.prefix_length >= sub.prefix_length:
+                    break
+                parent = container
+            if parent is not None:
+                log.info("Found %r nested under %r", sub, parent)
+                sub.parent = parent
+                child_subnets.append(sub)
 
         self.data_mgr.update_records(child_subnets)
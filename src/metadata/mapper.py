@@ -1,6 +1,16 @@
-from ..net.IPv4 import Subnet
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, zip_longest
+import asyncio
+import queue
+
+from ..net.IPv4 import Address, Subnet
 from ..metadata.resolver import DelegationResolver
-from ..metadata import ResolutionException
+from ..metadata.async_whois import WhoisBatcher
+from ..metadata import (
+    ResolutionException, RateLimitationException, QueryDeferredException,
+    WhoisConnectionException
+)
+from ..metadata.retry import RetryQueue
 from ..tools.logger import ModuleLogger
 
 
@@ -9,24 +19,298 @@ log = ModuleLogger(__name__)
 
 class SubnetMapper(object):
 
-    def __init__(self, data_mgr):
+    # Workers don't wait longer than this for a throttled host, they defer
+    # the query and move on to another one
+    MAX_PACING_WAIT = 0.5
+    # Nor do they keep queries that can't be sent for longer than this
+    MAX_DEFERRAL = 15 * 60
+    # Transient failures, e.g. whois servers that time out, are retried with
+    # an exponential backoff
+    RETRY_LIMIT = 4
+    RETRY_BACKOFF = 2.0
+
+    def __init__(self, data_mgr, rdap_cache=None, failure_cache=None,
+                 local_first=False, max_age=None, redirect_map=None,
+                 rdap_bootstrap=None, whois_referrals=None):
+        '''
+        If local_first is True, assignments already in the DB are used
+        instead of querying registries, provided they were fetched less than
+        max_age seconds ago or max_age is None.
+        '''
         self.data_mgr = data_mgr
-        self.resolver = DelegationResolver()
+        self.resolver = DelegationResolver(
+            rdap_cache=rdap_cache, failure_cache=failure_cache,
+            local_store=data_mgr if local_first else None, max_age=max_age,
+            redirect_map=redirect_map, rdap_bootstrap=rdap_bootstrap,
+            whois_referrals=whois_referrals
+        )
+
+    def scan_up(self, sub_first_address, last_address=None):
+        '''
+        Maps the assignments from sub_first_address upwards, one at a time.
+        Stops after last_address if it isn't None, or at the first address
+        that can't be resolved.
+        '''
+        self._scan(
+            self.resolver, sub_first_address, last_address,
+            self.data_mgr.update_records
+        )
 
-    def scan_up(self, sub_first_address):
+    def _scan(self, resolver, sub_first_address, last_address, found):
+        '''
+        Resolves the assignments from sub_first_address upwards and passes the
+        subnets of each one to found. Stops after last_address if it isn't
+        None, or at the first address that can't be resolved.
+        '''
         while True:
             try:
-                assigned_subnet = self.resolver.resolve(
+                assigned_subnet = resolver.resolve(
                     Subnet(sub_first_address, 32)
                 )
-                if sub_first_address not in assigned_subnet:
+                # The assigned range may span several CIDR subnets. We store
+                # them all and carry on from the end of the range.
+                range_subnets = assigned_subnet.range_subnets
+                if not any(
+                        sub_first_address in sub for sub in range_subnets):
                     raise ResolutionException
 
-                sub_first_address = assigned_subnet.ceiling() + 1
-                log.info("Found %r", assigned_subnet)
-                self.data_mgr.update_record(assigned_subnet)
+                log.info("Found %r", range_subnets)
+                found(range_subnets)
+                range_ceiling = self._harvest(
+                    assigned_subnet, range_subnets[-1].ceiling(), found
+                )
+
+                if last_address is not None and range_ceiling >= last_address:
+                    break
+                sub_first_address = range_ceiling + 1
+
+            except WhoisConnectionException as ex:
+                # There's no retrying without holding up the rest of the scan
+                log.warning("Couldn't resolve %s: %s", sub_first_address, ex)
+                resolver.record_failure(Subnet(sub_first_address, 32), ex)
+                break
 
             except ResolutionException:
                 log.warning("Couldn't resolve %s", sub_first_address)
-                # sub_first_address += 4
                 break
+
+    @staticmethod
+    def _harvest(assigned_subnet, range_ceiling, found):
+        '''
+        Passes the other ranges the resolver found along with assigned_subnet
+        to found. Returns the last address of the run of ranges that directly
+        follows assigned_subnet's, so that the scan doesn't query any of them
+        again.
+        '''
+        related_floors = {}
+        for related_subnets in assigned_subnet.related_ranges:
+            log.info("Found related %r", related_subnets)
+            found(related_subnets)
+            related_floors[related_subnets[0].floor()] = \
+                related_subnets[-1].ceiling()
+
+        while range_ceiling + 1 in related_floors:
+            range_ceiling = related_floors.pop(range_ceiling + 1)
+        return range_ceiling
+
+    def work_units(self, start_address, end_address=None):
+        '''
+        Splits the address space from start_address to end_address (or the
+        top of the address space) into one (first, last) Address range per
+        /8 that IANA has handed out. Units are interleaved across registries
+        so that concurrent workers query different registries.
+        '''
+        start_uint = int(start_address)
+        end_uint = int(end_address) if end_address is not None \
+            else int(Address('255.255.255.255'))
+
+        registry_units = {}
+        for tld in self.resolver.top_level_delegations():
+            if tld is None or not tld.is_mappable():
+                continue
+            slash_eight = tld.delegation_subnet
+            first = max(start_uint, int(slash_eight.floor()))
+            last = min(end_uint, int(slash_eight.ceiling()))
+            if first > last:
+                continue
+            registry_units.setdefault(tld.registry, []).append(
+                (Address(first), Address(last))
+            )
+
+        return [
+            unit for unit in chain.from_iterable(
+                zip_longest(*registry_units.values())
+            ) if unit is not None
+        ]
+
+    def _scan_step(self, resolver, task, found):
+        '''
+        Resolves the first address of a (first, last, attempt) scan task and
+        passes the subnets of its assignment to found. Returns the follow-up
+        task and how many seconds to wait before it, or (None, 0) when the
+        task is finished.
+        '''
+        try:
+            outcome = resolver.resolve(Subnet(task[0], 32))
+        except ResolutionException as ex:
+            outcome = ex
+        return self._next_task(resolver, task, outcome, found)
+
+    def _next_task(self, resolver, task, outcome, found):
+        '''
+        Does what _scan_step() does once the first address of task resolved
+        to outcome, an assignment or the ResolutionException that was raised
+        instead.
+        '''
+        sub_first_address, last_address, attempt = task
+        try:
+            if isinstance(outcome, ResolutionException):
+                raise outcome
+            assigned_subnet = outcome
+            range_subnets = assigned_subnet.range_subnets
+            if not any(sub_first_address in sub for sub in range_subnets):
+                raise ResolutionException
+
+        except QueryDeferredException as deferral:
+            if deferral.retry_after > self.MAX_DEFERRAL:
+                log.warning("Giving up on %s: %s", sub_first_address, deferral)
+                return None, 0
+            log.debug(
+                "Deferring %s by %.1fs",
+                sub_first_address, deferral.retry_after
+            )
+            return task, deferral.retry_after
+
+        except (RateLimitationException, WhoisConnectionException) as ex:
+            if attempt >= self.RETRY_LIMIT:
+                log.warning("Giving up on %s: %s", sub_first_address, ex)
+                if isinstance(ex, WhoisConnectionException):
+                    resolver.record_failure(Subnet(sub_first_address, 32), ex)
+                return None, 0
+            delay = getattr(ex, 'retry_after', None) or \
+                self.RETRY_BACKOFF * 2 ** attempt
+            log.info(
+                "Retrying %s in %.1fs: %s", sub_first_address, delay, ex
+            )
+            return (sub_first_address, last_address, attempt + 1), delay
+
+        except ResolutionException:
+            log.warning("Couldn't resolve %s", sub_first_address)
+            return None, 0
+
+        log.info("Found %r", range_subnets)
+        found(range_subnets)
+        range_ceiling = self._harvest(
+            assigned_subnet, range_subnets[-1].ceiling(), found
+        )
+        if range_ceiling >= last_address:
+            return None, 0
+        return (range_ceiling + 1, last_address, 0), 0
+
+    def map_parallel(self, start_address, end_address=None, workers=4):
+        '''
+        Maps the space from start_address to end_address on a pool of worker
+        threads. Each worker has its own resolver. The calling thread is the
+        only one that writes to the DB.
+
+        Workers take one query at a time off a RetryQueue. Queries to a host
+        that's throttled, and queries that failed transiently, go back on the
+        queue until they're eligible, so the workers carry on with the other
+        hosts meanwhile.
+        '''
+        units = self.work_units(start_address, end_address)
+        log.info("Mapping %d /8s with %d workers", len(units), workers)
+
+        tasks = RetryQueue()
+        for first, last in units:
+            tasks.push((first, last, 0))
+        found_ranges = queue.Queue()
+
+        def work():
+            try:
+                resolver = self.resolver.clone(max_wait=self.MAX_PACING_WAIT)
+                while True:
+                    task = tasks.get()
+                    if task is None:
+                        break
+                    try:
+                        follow_up, delay = self._scan_step(
+                            resolver, task, found_ranges.put
+                        )
+                        if follow_up is not None:
+                            tasks.push(follow_up, delay)
+                    finally:
+                        tasks.task_done()
+            finally:
+                # Tell the writer this worker is done
+                found_ranges.put(None)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(work) for _ in range(workers)]
+
+            running_workers = workers
+            while running_workers:
+                range_subnets = found_ranges.get()
+                if range_subnets is None:
+                    running_workers -= 1
+                else:
+                    self.data_mgr.update_records(range_subnets)
+
+        # Re-raise whatever went wrong in a worker
+        for future in futures:
+            future.result()
+
+    def map_async(self, start_address, end_address=None, scans=16,
+                  host_concurrency=None):
+        '''
+        Maps the space from start_address to end_address in an asyncio event
+        loop, with up to scans /8s being scanned at once. Their RDAP queries
+        share an AsyncRDAP_Resolver, so that many can be in flight without a
+        thread each. host_concurrency is passed on to it.
+
+        Each scan has its own resolver, like map_parallel()'s workers, but
+        waits for throttled hosts instead of deferring its queries. Local
+        store lookups block, so they run in the event loop's default
+        executor. So do whois queries, which a WhoisBatcher pipelines when
+        several scans fall back on the same whois host.
+        '''
+        units = self.work_units(start_address, end_address)
+        log.info("Mapping %d /8s with %d concurrent scans", len(units), scans)
+        asyncio.run(self._map_async(units, scans, host_concurrency))
+
+    async def _map_async(self, units, scans, host_concurrency):
+        rdap_resolver = self.resolver.async_RDAP_resolver(host_concurrency)
+        whois = WhoisBatcher(self.resolver)
+        # Shared by the scans, which take the next unit when they're done
+        units = iter(units)
+
+        async def scan():
+            resolver = self.resolver.clone()
+            for first, last in units:
+                await self._scan_async(
+                    resolver, rdap_resolver, whois, first, last
+                )
+
+        await asyncio.gather(*(scan() for _ in range(scans)))
+
+    async def _scan_async(self, resolver, rdap_resolver, whois, first,
+                          last):
+        '''
+        Coroutine flavour of _scan() for the range from first to last, which
+        retries transient failures the way map_parallel() does.
+        '''
+        task = (first, last, 0)
+        while task is not None:
+            try:
+                outcome = await resolver.resolve_async(
+                    Subnet(task[0], 32), rdap_resolver, whois.resolve
+                )
+            except ResolutionException as ex:
+                outcome = ex
+            # Like map_parallel(), the calling thread is the only one that
+            # writes to the DB
+            task, delay = self._next_task(
+                resolver, task, outcome, self.data_mgr.update_records
+            )
+            if delay:
+                await asyncio.sleep(delay)
@@ -1,12 +1,21 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import func
+from sqlalchemy.pool import StaticPool
+from sqlalchemy import func, select, tuple_, type_coerce, Integer
+from sqlalchemy import and_, or_, not_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from functools import reduce
+import threading
+import time
 
 from .. import SQLITE_PATH
+from ..net.IPv4 import MAX_UINT32
+from ..net.radix import RadixTree
 from ..tools.logger import ModuleLogger
 from .assigned import AssignedSubnet
+from .delegated import DELEGATED_SOURCE_PREFIX
+from .whois import WHOIS_PARENT_SOURCE
 from . import get_dec_base
 
 log = ModuleLogger(__name__)
@@ -20,24 +29,61 @@ class DataManager(object):
 
     def __init__(self):
         log.debug('Creating engine for %s', SQLITE_PATH)
+        engine_kwargs = {}
+        if ':memory:' == SQLITE_PATH:
+            # Every new connection to :memory: is to a new, empty DB. We want
+            # the same one from every thread.
+            engine_kwargs['poolclass'] = StaticPool
         session_engine = create_engine(
             # That's right, *three* slashes + an absolute path
             # That's how SQLAlchemy rolls. Just fucken hardcore, you know?
-            'sqlite:///' + SQLITE_PATH
+            'sqlite:///' + SQLITE_PATH,
+            **engine_kwargs
         )
         decbase = get_dec_base()
         decbase.metadata.create_all(session_engine)
+        self._add_missing_columns(session_engine)
         session_factory = sessionmaker(bind=session_engine)
         self._sa_session = session_factory()
+        # The session may be used by the mapper's workers as well as by its
+        # writer
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _add_missing_columns(engine):
+        '''
+        create_all() doesn't add the columns that are new since the DB was
+        created. All of them are nullable, so this is all the migration we
+        need.
+        '''
+        table = AssignedSubnet.__table__
+        existing = set(
+            column['name'] for column in inspect(engine).get_columns(
+                table.name
+            )
+        )
+        with engine.begin() as connection:
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                log.info('Adding column %s to %s', column.name, table.name)
+                connection.execute(text(
+                    'ALTER TABLE {0} ADD COLUMN {1} {2}'.format(
+                        table.name, column.name,
+                        column.type.compile(engine.dialect)
+                    )
+                ))
 
     def update_record(self, assigned_subnet):
-        self._update_single_record(assigned_subnet)
-        self._sa_session.commit()
+        with self._lock:
+            self._update_single_record(assigned_subnet)
+            self._sa_session.commit()
 
     def update_records(self, subnet_sequence):
-        for sub in subnet_sequence:
-            self._update_single_record(sub)
-        self._sa_session.commit()
+        with self._lock:
+            for sub in subnet_sequence:
+                self._update_single_record(sub)
+            self._sa_session.commit()
 
     def _update_single_record(self, assigned_subnet):
         '''
@@ -47,6 +93,11 @@ class DataManager(object):
         # use either autocommit=True or transaction nesting, the session is
         # always implicitly in a transaction. See also:
         # http://stackoverflow.com/a/7481826
+        # Assignments that were just fetched are timestamped now. Those that
+        # came out of the DB keep their timestamp.
+        if assigned_subnet.updated is None:
+            assigned_subnet._updated = time.time()
+
         existing_records = self._sa_session.query(AssignedSubnet).filter_by(
             _network=assigned_subnet.network,
             _prefix_length=assigned_subnet.prefix_length,
@@ -58,6 +109,8 @@ class DataManager(object):
         else:
             log.debug('Updating existing record for %r', assigned_subnet)
             old_record.name = assigned_subnet.name
+            old_record._updated = assigned_subnet.updated
+            old_record._source = assigned_subnet.source
             if assigned_subnet.next:
                 old_record.next = assigned_subnet.next
             if assigned_subnet.previous:
@@ -65,11 +118,156 @@ class DataManager(object):
             if assigned_subnet.parent:
                 old_record.parent = assigned_subnet.parent
 
+    def bulk_upsert(self, rows, batch_size=10000):
+        '''
+        Inserts (subnet, name, source) rows, batch_size at a time, without
+        instantiating any AssignedSubnet. Rows for subnets that are already
+        in the DB only replace them if those were bulk-imported as well, so
+        the names we got from RDAP or whois are kept. Placeholders from
+        delegated statistics files don't replace real names from RPSL dumps
+        either. Returns the number of rows.
+        '''
+        table = AssignedSubnet.__table__
+        upsert = sqlite_insert(table)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[table.c.address, table.c.prefix],
+            set_={
+                'name': upsert.excluded.name,
+                'source': upsert.excluded.source,
+                'updated': upsert.excluded.updated,
+            },
+            where=and_(
+                table.c.source.isnot(None),
+                or_(
+                    self._is_placeholder(table.c.source),
+                    not_(self._is_placeholder(upsert.excluded.source))
+                )
+            ),
+        )
+
+        now = time.time()
+        row_count = 0
+        batch = []
+        with self._lock:
+            for subnet, name, source in rows:
+                batch.append({
+                    'address': subnet._floor_uint,
+                    'prefix': subnet.prefix_length,
+                    'name': name,
+                    'source': source,
+                    'updated': now,
+                })
+                if len(batch) >= batch_size:
+                    row_count += self._execute_batch(upsert, batch)
+            if batch:
+                row_count += self._execute_batch(upsert, batch)
+            # Any record the session holds may have just been overwritten
+            self._sa_session.expire_all()
+        return row_count
+
+    @staticmethod
+    def _is_placeholder(source_column):
+        return source_column.startswith(DELEGATED_SOURCE_PREFIX)
+
+    @classmethod
+    def _is_complete(clazz, source_column):
+        '''
+        Whether assignments with a given source are final. Placeholders from
+        delegated statistics files aren't, until RDAP or whois names them.
+        Nor are the enclosing inetnums whois gave us along with another one,
+        since more specific assignments in them may not have been fetched
+        yet.
+        '''
+        return or_(
+            source_column.is_(None),
+            and_(
+                not_(clazz._is_placeholder(source_column)),
+                source_column != WHOIS_PARENT_SOURCE
+            )
+        )
+
+    def _execute_batch(self, statement, batch):
+        self._sa_session.execute(statement, batch)
+        self._sa_session.commit()
+        batch_size = len(batch)
+        log.debug('Upserted %d rows', batch_size)
+        batch.clear()
+        return batch_size
+
     def all_records(self):
         # Use a baked query?
         # This simply returns a generator-like object
         return self._sa_session.query(AssignedSubnet)
 
+    def longest_match(self, network, max_age=None):
+        '''
+        Returns a copy of the most specific assigned subnet in the DB that
+        covers network, or None. If max_age isn't None and that subnet was
+        fetched longer than max_age seconds ago, None is returned too.
+        Only complete assignments count, see _is_complete().
+        '''
+        # There are at most 33 candidates, each of them an index lookup
+        floor = network._floor_uint
+        candidates = [
+            (floor & (MAX_UINT32 << (32 - prefix_length)), prefix_length)
+            for prefix_length in range(network.prefix_length, -1, -1)
+        ]
+        with self._lock:
+            record = self._sa_session.query(AssignedSubnet).filter(
+                tuple_(
+                    AssignedSubnet.mapped_network,
+                    AssignedSubnet.mapped_prefix_length
+                ).in_(candidates),
+                self._is_complete(AssignedSubnet.mapped_source)
+            ).order_by(AssignedSubnet.mapped_prefix_length.desc()).first()
+            if record is None:
+                return None
+            if max_age is not None and (
+                    record.updated is None or
+                    time.time() - record.updated > max_age):
+                log.debug('%r is stale', record)
+                return None
+
+            # The copy is safe to hand over to other threads
+            match = AssignedSubnet(
+                record.network, record.prefix_length, record.name
+            )
+            # Writing it back mustn't make a bulk-imported record look like
+            # one we resolved, which newer dumps wouldn't update
+            match._updated = record.updated
+            match._source = record.source
+        return match
+
+    def radix_tree(self, records=None):
+        '''
+        Loads assigned subnets (all of them unless records is given) in a
+        RadixTree, where every subnet is its own payload
+        '''
+        if records is None:
+            records = self.all_records()
+        tree = RadixTree()
+        for record in records:
+            tree.insert(record, record)
+        return tree
+
+    def address_ranges(self, complete_only=False):
+        '''
+        Yields (first, last) uint32 tuples for every assigned subnet, in
+        ascending order, straight off the DB cursor. No AssignedSubnet is
+        instantiated so this is suitable for building an IntervalSet. If
+        complete_only is True, only the assignments longest_match() would
+        use are included, see _is_complete().
+        '''
+        table = AssignedSubnet.__table__
+        # Skip SQLAddress' conversion to Address
+        network = type_coerce(table.c.address, Integer)
+        query = select(network, table.c.prefix).order_by(network)
+        if complete_only:
+            query = query.where(self._is_complete(table.c.source))
+        rows = self._sa_session.execute(query)
+        for network_uint, prefix_length in rows:
+            yield network_uint, network_uint + (1 << (32 - prefix_length)) - 1
+
     def fine_subnet_iter(self):
         # This simply returns a generator-like object
 
@@ -0,0 +1,178 @@
+'''
+Adaptive pacing of the queries we send to each RDAP and whois host.
+'''
+
+from . import QueryDeferredException
+from ..tools.logger import ModuleLogger
+
+from email.utils import parsedate_to_datetime
+import asyncio
+import copy
+import threading
+import time
+
+log = ModuleLogger(__name__)
+
+
+def parse_retry_after(value, now=None):
+    '''
+    Returns the number of seconds a Retry-After header value asks us to wait,
+    or None if there's no usable value. Both delay-seconds and HTTP dates are
+    supported.
+    '''
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if now is None:
+        now = time.time()
+    return max(0.0, retry_at.timestamp() - now)
+
+
+class _HostBucket(object):
+    __slots__ = ('rate', 'tokens', 'updated')
+
+    def __init__(self, rate, tokens, updated):
+        self.rate = rate
+        self.tokens = tokens
+        self.updated = updated
+
+
+class HostRateLimiter(object):
+    '''
+    A token bucket per host, whose refill rate is learnt with AIMD: every
+    successful query increases it by RATE_INCREASE queries per second, and
+    every rate limitation complaint multiplies it by RATE_DECREASE_FACTOR.
+    Queries are paced so that we stay just under a host's limit instead of
+    going over it and waiting for a penalty to expire.
+
+    This is thread-safe, so a single instance can be shared by all the
+    resolvers that query the same hosts.
+    '''
+
+    INITIAL_RATE = 1.0
+    # We never wait longer between two queries than RDAP_Resolver used to
+    # after a rate limitation notice
+    MIN_RATE = 1 / 61
+    MAX_RATE = 50.0
+    RATE_INCREASE = 0.1
+    RATE_DECREASE_FACTOR = 0.5
+    BURST = 3
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep,
+                 host_rates=None):
+        '''
+        host_rates maps host names to the rate (in queries per second) we
+        start with for them, instead of INITIAL_RATE.
+        '''
+        self._clock = clock
+        self._sleep = sleep
+        self._host_rates = dict(host_rates or {})
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._max_wait = None
+
+    def with_max_wait(self, max_wait):
+        '''
+        Returns a limiter that shares this one's hosts, but raises
+        QueryDeferredException instead of waiting longer than max_wait
+        seconds.
+        '''
+        limiter = copy.copy(self)
+        limiter._max_wait = max_wait
+        return limiter
+
+    def _bucket(self, host, now):
+        try:
+            bucket = self._buckets[host]
+        except KeyError:
+            bucket = _HostBucket(
+                self._host_rates.get(host, self.INITIAL_RATE), self.BURST, now
+            )
+            self._buckets[host] = bucket
+
+        # Refill. The bucket's update time is in the future while a
+        # Retry-After delay is running.
+        elapsed = now - bucket.updated
+        if elapsed > 0:
+            bucket.tokens = min(
+                self.BURST, bucket.tokens + elapsed * bucket.rate
+            )
+            bucket.updated = now
+        return bucket
+
+    def reserve(self, host):
+        '''
+        Takes a token for a query to host, and returns the number of seconds
+        the caller has to wait before sending it. If that's longer than the
+        maximum wait, no token is taken and QueryDeferredException is raised.
+        '''
+        with self._lock:
+            now = self._clock()
+            bucket = self._bucket(host, now)
+            delay = max(0.0, bucket.updated - now)
+            if bucket.tokens < 1:
+                delay += (1 - bucket.tokens) / bucket.rate
+            if self._max_wait is not None and delay > self._max_wait:
+                raise QueryDeferredException(host, delay)
+            bucket.tokens -= 1
+            return delay
+
+    def wait(self, host):
+        '''
+        Blocks until we're allowed to send a query to host.
+        '''
+        delay = self.reserve(host)
+        if delay > 0:
+            log.debug("Waiting %.2fs before querying %s", delay, host)
+            self._sleep(delay)
+
+    async def wait_async(self, host):
+        '''
+        Coroutine flavour of wait(), which lets other coroutines run while
+        it waits.
+        '''
+        delay = self.reserve(host)
+        if delay > 0:
+            log.debug("Waiting %.2fs before querying %s", delay, host)
+            await asyncio.sleep(delay)
+
+    def succeeded(self, host):
+        '''
+        Records a successful query to host.
+        '''
+        with self._lock:
+            bucket = self._bucket(host, self._clock())
+            bucket.rate = min(self.MAX_RATE, bucket.rate + self.RATE_INCREASE)
+
+    def throttle(self, host, retry_after=None):
+        '''
+        Records that host complained about our query rate. If it told us how
+        long to back off for, no query is sent before retry_after seconds.
+        '''
+        with self._lock:
+            now = self._clock()
+            bucket = self._bucket(host, now)
+            bucket.rate = max(
+                self.MIN_RATE, bucket.rate * self.RATE_DECREASE_FACTOR
+            )
+            if retry_after:
+                bucket.tokens = 1
+                bucket.updated = max(bucket.updated, now + retry_after)
+            else:
+                bucket.tokens = min(bucket.tokens, 0)
+            log.warning(
+                "Slowing down to %.3f queries/s for %s", bucket.rate, host
+            )
+
+    def rate(self, host):
+        '''
+        Returns the rate, in queries per second, we currently allow for host.
+        '''
+        with self._lock:
+            return self._bucket(host, self._clock()).rate
@@ -0,0 +1,168 @@
+'''
+On-disk record of the address ranges for which the RIR IANA delegated the /8
+to redirected us to another RIR's RDAP service, or referred us to another
+whois server, so that later queries for those ranges can go straight to the
+right one.
+'''
+
+from ..tools.logger import ModuleLogger
+from ..net.IPv4 import range_to_subnets
+from ..net.radix import RadixTree
+from .sqlite_store import SQLiteStore
+
+import time
+
+log = ModuleLogger(__name__)
+
+# RDAP URLs for IPv4 addresses are of the form <base URL>/ip/<address>
+RDAP_IP_PATH = '/ip/'
+
+
+def RDAP_base_URL(rdap_url):
+    '''
+    Returns the base URL of the RDAP service rdap_url belongs to, or None if
+    rdap_url isn't an IP lookup.
+    '''
+    base_url, sep, _ = rdap_url.rpartition(RDAP_IP_PATH)
+    if not sep or not base_url:
+        return None
+    return base_url
+
+
+class RedirectMap(SQLiteStore):
+    '''
+    A SQLite store that maps address ranges to the base URL of the RDAP
+    service that's authoritative for them. Learned redirects are only trusted
+    for ttl seconds, since address space keeps being transferred.
+
+    Lookups are answered from a RadixTree of the CIDR subnets that make up
+    every learned range, which is loaded from the database the first time
+    it's needed. Every subnet maps (first, last) tuples for the ranges it's
+    part of to (target, learned) tuples.
+    '''
+
+    DEFAULT_TTL = 30 * 24 * 3600
+    # Where ranges and what they map to are kept
+    TABLE = 'rdap_redirects'
+    TARGET = 'base_url'
+
+    def __init__(self, path, ttl=DEFAULT_TTL, clock=time.time):
+        super().__init__(path, clock)
+        self.ttl = ttl
+        self._ranges = None
+
+    def _schema(self):
+        return (
+            'CREATE TABLE IF NOT EXISTS {0} ('
+            ' first INTEGER NOT NULL,'
+            ' last INTEGER NOT NULL,'
+            ' {1} TEXT NOT NULL,'
+            ' learned REAL NOT NULL,'
+            ' PRIMARY KEY (first, last)'
+            ');'
+        ).format(self.TABLE, self.TARGET)
+
+    def _index(self):
+        if self._ranges is None:
+            self._ranges = RadixTree()
+            rows = self._db().execute(
+                'SELECT first, last, {1}, learned FROM {0}'.format(
+                    self.TABLE, self.TARGET
+                )
+            )
+            for first, last, target, learned in rows:
+                self._index_range(first, last, target, learned)
+        return self._ranges
+
+    def _index_range(self, first, last, target, learned):
+        for subnet in range_to_subnets(first, last):
+            try:
+                entries = self._ranges[subnet]
+            except KeyError:
+                entries = {}
+                self._ranges.insert(subnet, entries)
+            entries[(first, last)] = (target, learned)
+
+    def _unindex_range(self, first, last):
+        for subnet in range_to_subnets(first, last):
+            entries = self._ranges[subnet]
+            del entries[(first, last)]
+            if not entries:
+                self._ranges.delete(subnet)
+
+    def learn(self, first, last, base_url):
+        '''
+        Records that RDAP queries for addresses from first to last should go
+        to base_url.
+        '''
+        first, last = int(first), int(last)
+        learned = self._clock()
+        with self._lock:
+            self._index()
+            db = self._db()
+            db.execute(
+                'INSERT OR REPLACE INTO {0} (first, last, {1}, learned)'
+                ' VALUES (?, ?, ?, ?)'.format(self.TABLE, self.TARGET),
+                (first, last, base_url, learned)
+            )
+            db.commit()
+            self._index_range(first, last, base_url, learned)
+        log.debug(
+            "Learned that %s-%s redirects to %s", first, last, base_url
+        )
+
+    def lookup(self, address):
+        '''
+        Returns the base URL of the RDAP service for address, or None. The
+        narrowest of the learned ranges that include address wins.
+        '''
+        oldest = self._clock() - self.ttl
+        best = None
+        with self._lock:
+            for _, entries in self._index().covering(int(address)):
+                for (first, last), (target, learned) in entries.items():
+                    if learned > oldest and \
+                            (best is None or last - first < best[0]):
+                        best = (last - first, target)
+        if best is None:
+            return None
+        return best[1]
+
+    def forget(self, address):
+        '''
+        Forgets every learned range that includes address.
+        '''
+        with self._lock:
+            ranges = self._index()
+            doomed = [
+                first_last
+                for _, entries in ranges.covering(int(address))
+                for first_last in entries
+            ]
+            if not doomed:
+                return
+            db = self._db()
+            db.executemany(
+                'DELETE FROM {0} WHERE first = ? AND last = ?'.format(
+                    self.TABLE
+                ),
+                doomed
+            )
+            db.commit()
+            for first, last in doomed:
+                self._unindex_range(first, last)
+
+    def close(self):
+        super().close()
+        with self._lock:
+            self._ranges = None
+
+
+class WhoisReferralMap(RedirectMap):
+    '''
+    A RedirectMap of the address ranges whois servers referred us elsewhere
+    for, to the whois host the chain of referrals ended at.
+    '''
+
+    TABLE = 'whois_referrals'
+    TARGET = 'whois_host'
@@ -1,21 +1,89 @@
 from ..tools.logger import ModuleLogger
+from ..net.radix import RadixTree
 from .IANA_IPv4_assignments import populate_IANA_IPv4_assignments
 from .RDAP import RDAP_Resolver
+from .async_RDAP import AsyncRDAP_Resolver
+from .ratelimit import HostRateLimiter
+from .redirects import RDAP_IP_PATH, RDAP_base_URL
 from .whois import Whois_Resolver
 from .constants import reserved_networks
 from . import (
-    ResolutionException, RDAPResolutionException, RDAPRedirectException
+    ResolutionException, RDAPResolutionException, RDAPRedirectException,
+    QueryDeferredException, RateLimitationException, WhoisConnectionException
 )
 
+import asyncio
+
 log = ModuleLogger(__name__)
 
 
 class DelegationResolver(object):
 
-    def __init__(self):
-        self._iana_top_level = populate_IANA_IPv4_assignments()
-        self._rdap_resolver = RDAP_Resolver(self)
-        self._whois_resolver = Whois_Resolver(self)
+    def __init__(self, iana_top_level=None, rate_limiter=None,
+                 rdap_cache=None, failure_cache=None, local_store=None,
+                 max_age=None, redirect_map=None, rdap_bootstrap=None,
+                 whois_referrals=None):
+        '''
+        If local_store isn't None, networks are first looked up in it with
+        its longest_match() method, e.g. a DataManager. Only assignments
+        fetched less than max_age seconds ago are used, if max_age isn't
+        None.
+
+        If redirect_map isn't None, the RDAP redirects we follow are recorded
+        in it and later queries for the same ranges skip the redirect.
+
+        rdap_bootstrap is the RDAP bootstrap registry, as returned by
+        populate_RDAP_bootstrap(). RDAP queries go to the services IANA lists
+        for each /8 if it's None.
+
+        If whois_referrals isn't None, the ranges whois servers refer us
+        elsewhere for are recorded in it, e.g. a WhoisReferralMap.
+        '''
+        if iana_top_level is None:
+            iana_top_level = populate_IANA_IPv4_assignments()
+        self._iana_top_level = iana_top_level
+        # RDAP and whois hosts are paced together, since some RIRs count
+        # queries to both against the same limit
+        if rate_limiter is None:
+            rate_limiter = HostRateLimiter()
+        self._rate_limiter = rate_limiter
+        self._rdap_cache = rdap_cache
+        # Addresses and endpoints that failed recently are skipped
+        self._failure_cache = failure_cache
+        self._local_store = local_store
+        self._max_age = max_age
+        self._redirect_map = redirect_map
+        self._rdap_bootstrap = rdap_bootstrap
+        self._whois_referrals = whois_referrals
+        self._rdap_resolver = RDAP_Resolver(
+            self, rate_limiter, rdap_cache, failure_cache, rdap_bootstrap
+        )
+        self._whois_resolver = Whois_Resolver(
+            self, rate_limiter, failure_cache, referral_map=whois_referrals
+        )
+        self._reserved_tree = RadixTree(
+            (reserved_net, reserved_net) for reserved_net in reserved_networks
+        )
+
+    def clone(self, max_wait=None):
+        '''
+        Returns a new resolver that shares this one's IANA registries, rate
+        limiter, caches, redirect maps and local store but none of its network
+        state, e.g. for use in another thread. If max_wait isn't None, the new
+        resolver raises QueryDeferredException rather than wait longer than
+        max_wait seconds for a throttled host.
+        '''
+        rate_limiter = self._rate_limiter
+        if max_wait is not None:
+            rate_limiter = rate_limiter.with_max_wait(max_wait)
+        return self.__class__(
+            self._iana_top_level, rate_limiter, self._rdap_cache,
+            self._failure_cache, self._local_store, self._max_age,
+            self._redirect_map, self._rdap_bootstrap, self._whois_referrals
+        )
+
+    def top_level_delegations(self):
+        return self._iana_top_level
 
     def validate_assignment(self, assignment):
         if 0 == assignment.prefix_length:
@@ -23,21 +91,171 @@ class DelegationResolver(object):
         if 8 > assignment.prefix_length:
             raise ResolutionException("Unreasonably large subnet")
 
+    def _valid_ranges(self, ranges):
+        '''
+        Returns the range_subnets tuples in ranges that only hold sensible
+        assignments.
+        '''
+        valid_ranges = []
+        for range_subnets in ranges:
+            try:
+                for assignment in range_subnets:
+                    self.validate_assignment(assignment)
+            except ResolutionException as ex:
+                log.debug("Ignoring %r: %s", range_subnets, ex)
+            else:
+                valid_ranges.append(range_subnets)
+        return tuple(valid_ranges)
+
     def _resolve_reserved_networks(self, network):
-        for reserved_net in reserved_networks:
-            if network in reserved_net:
-                return reserved_net
+        try:
+            _, reserved_net = self._reserved_tree.longest_match(network)
+        except KeyError:
+            return None
+        return reserved_net
 
     def resolve(self, network):
         # We need to keep track of potentially multiple candidates for the
         # given network and eventually return the best one of the bunch
 
+        local_assignment = self.resolve_locally(network)
+        if local_assignment is not None:
+            return local_assignment
+
+        queries = self._RDAP_queries(network)
+        outcome = failure = None
+        try:
+            while True:
+                done, result = self._next_RDAP_query(
+                    queries, outcome, failure
+                )
+                if done:
+                    return result
+                method, arg = result
+                try:
+                    outcome = getattr(self._rdap_resolver, method)(arg)
+                    failure = None
+                except ResolutionException as ex:
+                    outcome, failure = None, ex
+
+        except QueryDeferredException:
+            # The mapper retries these later, which beats falling back on whois
+            raise
+
+        except ResolutionException as rdap_ex:
+            return self.resolve_whois(network, rdap_ex)
+
+    async def resolve_async(self, network, rdap_resolver, whois=None):
+        '''
+        Coroutine flavour of resolve() whose RDAP queries are sent with
+        rdap_resolver, e.g. the AsyncRDAP_Resolver async_RDAP_resolver()
+        returns, so that many can be in flight at once. The rest of the chain
+        blocks on the local store, the SQLite caches and whois, so it runs in
+        the event loop's default executor. Like resolve(), it must not be
+        running more than once at a time.
+
+        If whois isn't None, the whois fallback is left to it instead, e.g.
+        the resolve() coroutine of a WhoisBatcher. It's called with the
+        network and the RDAP failure.
+        '''
+        loop = asyncio.get_running_loop()
+        local_assignment = await loop.run_in_executor(
+            None, self.resolve_locally, network
+        )
+        if local_assignment is not None:
+            return local_assignment
+
+        queries = self._RDAP_queries(network)
+        outcome = failure = None
+        try:
+            while True:
+                done, result = await loop.run_in_executor(
+                    None, self._next_RDAP_query, queries, outcome, failure
+                )
+                if done:
+                    return result
+                method, arg = result
+                try:
+                    outcome = await getattr(rdap_resolver, method)(arg)
+                    failure = None
+                except ResolutionException as ex:
+                    outcome, failure = None, ex
+
+        except QueryDeferredException:
+            raise
+
+        except ResolutionException as rdap_ex:
+            if whois is not None:
+                return await whois(network, rdap_ex)
+            return await loop.run_in_executor(
+                None, self.resolve_whois, network, rdap_ex
+            )
+
+    def async_RDAP_resolver(self, host_concurrency=None):
+        '''
+        Returns an AsyncRDAP_Resolver that shares this resolver's rate
+        limiter, RDAP cache, failure cache and bootstrap registry, for use
+        with resolve_async().
+        '''
+        return AsyncRDAP_Resolver(
+            self, host_concurrency, self._rate_limiter, self._rdap_cache,
+            self._failure_cache, self._rdap_bootstrap
+        )
+
+    def resolve_locally(self, network):
+        '''
+        Returns the reserved network or the assignment in the local store
+        network belongs to, or None if it takes a registry query to find out.
+        Raises ResolutionException if network failed to resolve recently.
+        '''
         reserved_assignment = self._resolve_reserved_networks(network)
         if reserved_assignment:
             return reserved_assignment
 
+        if self._local_store is not None:
+            local_assignment = self._local_store.longest_match(
+                network, self._max_age
+            )
+            if local_assignment is not None:
+                log.debug("Found %r locally", local_assignment)
+                return local_assignment
+
+        if self._failure_cache is not None:
+            failure = self._failure_cache.range_failure(network.floor())
+            if failure is not None:
+                raise ResolutionException(
+                    "Skipping {0}, it failed {1} time(s): {2}",
+                    network, failure.failures, failure.reason
+                )
+        return None
+
+    @staticmethod
+    def _next_RDAP_query(queries, outcome, failure):
+        '''
+        Hands the outcome of the last query, or the failure it raised, over
+        to queries, an _RDAP_queries() generator. Returns (False, query) for
+        its next query, or (True, result) once it's done.
+        '''
         try:
-            rdap_assignment = self._rdap_resolver.resolve(network)
+            if failure is not None:
+                return False, queries.throw(failure)
+            return False, queries.send(outcome)
+        except StopIteration as done:
+            return True, done.value
+
+    def _RDAP_queries(self, network):
+        '''
+        Generator that yields the RDAP queries it takes to resolve network as
+        (RDAP_Resolver method name, argument) tuples, and is sent what they
+        return or thrown what they raise. Its result is the valid RDAP
+        assignment. The ResolutionException it raises otherwise is what
+        whois is tried after.
+
+        resolve() and resolve_async() share the chain this way, and only
+        differ in how they send the queries.
+        '''
+        try:
+            rdap_assignment = yield from self._RDAP_base_queries(network)
             # TODO Do some sanity checking!
             self.validate_assignment(rdap_assignment)
             return rdap_assignment
@@ -46,41 +264,145 @@ class DelegationResolver(object):
             provisional = redir_ex.provisional
             log.warning("Caught \"%s\".", redir_ex)
             try:
-                redirected_assignment = self._rdap_resolver.resolve_from_url(
-                    redir_ex.redir_url
+                redirected_assignment = yield (
+                    'resolve_from_url', redir_ex.redir_url
                 )
+            except QueryDeferredException:
+                raise
             except ResolutionException:
                 return provisional
             else:
+                self._learn_redirect(
+                    provisional or redirected_assignment, redir_ex.redir_url
+                )
                 return redirected_assignment
 
-        except ResolutionException as rdap_ex:
-            # Yes, but what if whois is even worse? We need to be able to fall
-            # back on any partial information RDAP gave us in that case.
-            log.warning("Caught \"%s\". Trying whois", rdap_ex)
-            if isinstance(rdap_ex, RDAPResolutionException):
-                whois = rdap_ex.whois_host  # pylint:disable=E1101
-            else:
-                # What if the RDAP query didn't include a port43 entry?
-                whois = None
+    @staticmethod
+    def whois_fallback_host(rdap_ex):
+        '''
+        Returns the whois host the RDAP failure rdap_ex points to, or None if
+        the one for the /8 will have to do.
+        '''
+        if isinstance(rdap_ex, RDAPResolutionException):
+            return rdap_ex.whois_host or None  # pylint:disable=E1101
+        # What if the RDAP query didn't include a port43 entry?
+        return None
 
-            try:
-                whois_assignment = self._whois_resolver.resolve(
-                    network,
-                    whois_host=whois
-                )
-                self.validate_assignment(whois_assignment)
-                return whois_assignment
-            except ResolutionException as re:
-                log.error(re)
-                raise
+    def resolve_whois(self, network, rdap_ex):
+        '''
+        Falls back on whois for network after RDAP failed with rdap_ex.
+        Failures that would happen again are recorded in the failure cache.
+        '''
+        # Yes, but what if whois is even worse? We need to be able to fall
+        # back on any partial information RDAP gave us in that case.
+        log.warning("Caught \"%s\". Trying whois", rdap_ex)
+        try:
+            return self._valid_whois_assignment(self._whois_resolver.resolve(
+                network,
+                whois_host=self.whois_fallback_host(rdap_ex)
+            ))
+        except ResolutionException as re:
+            log.error(re)
+            self._record_failure(network, re)
+            raise
+
+    def resolve_whois_many(self, networks, whois_host=None):
+        '''
+        Does what resolve_whois() does for several networks, whose RDAP
+        failures all pointed to whois_host. The queries to any given whois
+        host are pipelined. Returns a list with either the assignment or the
+        ResolutionException for each network.
+        '''
+        results = []
+        for network, result in zip(
+                networks,
+                self._whois_resolver.resolve_many(networks, whois_host)):
+            if not isinstance(result, ResolutionException):
+                try:
+                    result = self._valid_whois_assignment(result)
+                except ResolutionException as ex:
+                    result = ex
+            if isinstance(result, ResolutionException):
+                log.error(result)
+                self._record_failure(network, result)
+            results.append(result)
+        return results
+
+    def _valid_whois_assignment(self, whois_assignment):
+        self.validate_assignment(whois_assignment)
+        whois_assignment.related_ranges = self._valid_ranges(
+            whois_assignment.related_ranges
+        )
+        return whois_assignment
+
+    def _RDAP_base_queries(self, network):
+        '''
+        Queries the RDAP service we were redirected to for network in the
+        past, if any, or the one for its /8. See _RDAP_queries().
+        '''
+        if self._redirect_map is not None:
+            base_url = self._redirect_map.lookup(network.floor())
+            if base_url is not None:
+                log.debug("Going straight to %s for %r", base_url, network)
+                try:
+                    return (yield (
+                        'resolve_from_url',
+                        base_url + RDAP_IP_PATH + str(network.floor())
+                    ))
+                except (QueryDeferredException, RDAPRedirectException):
+                    raise
+                except ResolutionException as ex:
+                    # The space may have moved again
+                    log.warning(
+                        "Learned redirect to %s failed: %s", base_url, ex
+                    )
+                    self._redirect_map.forget(network.floor())
+        return (yield ('resolve', network))
+
+    def _learn_redirect(self, assignment, redir_url):
+        '''
+        Records that the range assignment belongs to is served by the RDAP
+        service at redir_url.
+        '''
+        if self._redirect_map is None:
+            return
+        base_url = RDAP_base_URL(redir_url)
+        if base_url is None:
+            return
+        self._redirect_map.learn(
+            assignment.range_subnets[0].floor(),
+            assignment.range_subnets[-1].ceiling(),
+            base_url
+        )
+
+    def _record_failure(self, network, failure):
+        # Only failures that would happen again are worth remembering. The
+        # mapper retries the others.
+        if isinstance(failure, (
+                RateLimitationException, QueryDeferredException,
+                WhoisConnectionException)):
+            return
+        self.record_failure(network, failure)
+
+    def record_failure(self, network, failure):
+        '''
+        Records that network couldn't be resolved, so that it isn't queried
+        again until the failure expires. resolve() records the failures that
+        would happen again itself. Callers that retry the transient ones,
+        e.g. WhoisConnectionException, record them when they give up.
+        '''
+        if self._failure_cache is None:
+            return
+        self._failure_cache.record_range_failure(
+            network.floor(), network.ceiling(), str(failure)
+        )
 
     def get_top_level_assignment(self, slash_eight):
-        try:
-            return self._iana_top_level[slash_eight]
-        except KeyError:
+        tld = self._iana_top_level[slash_eight._floor_uint >> 24]
+        if tld is None:
             raise ResolutionException(
                 "Couldn't find top-level delegation for {0}".format(
                     slash_eight
                 )
             )
+        return tld
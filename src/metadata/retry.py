@@ -0,0 +1,83 @@
+'''
+A queue of work items that become eligible at different times.
+'''
+
+from heapq import heappush, heappop
+from itertools import count
+import threading
+import time
+
+
+class RetryQueue(object):
+    '''
+    A thread-safe heap of work items keyed by the time at which they become
+    eligible. get() hands out the item that's been eligible the longest, so
+    items that have to wait for a throttled host don't hold up the others.
+
+    Every item taken with get() must be followed by a call to task_done(),
+    once any follow-up items have been pushed. get() returns None when the
+    queue is empty and no item taken from it is still being processed.
+    '''
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._heap = []
+        # Breaks ties between items that are eligible at the same time, in
+        # the order they were pushed
+        self._sequence = count()
+        self._in_progress = 0
+        self._condition = threading.Condition()
+
+    def push(self, item, delay=0):
+        '''
+        Adds item to the queue. It won't be handed out before delay seconds.
+        '''
+        with self._condition:
+            heappush(
+                self._heap,
+                (self._clock() + delay, next(self._sequence), item)
+            )
+            self._condition.notify()
+
+    def get(self):
+        '''
+        Blocks until an item is eligible and returns it, or returns None once
+        there's no work left.
+        '''
+        with self._condition:
+            while True:
+                if self._heap:
+                    delay = self._heap[0][0] - self._clock()
+                    if delay <= 0:
+                        self._in_progress += 1
+                        return heappop(self._heap)[2]
+                    self._condition.wait(delay)
+                elif self._in_progress:
+                    self._condition.wait()
+                else:
+                    # Wake up the other consumers so that they finish too
+                    self._condition.notify_all()
+                    return None
+
+    def task_done(self):
+        '''
+        Records that an item returned by get() has been processed.
+        '''
+        with self._condition:
+            self._in_progress -= 1
+            if not self._in_progress and not self._heap:
+                self._condition.notify_all()
+
+    def next_eligible(self):
+        '''
+        Returns the number of seconds until the next item is eligible, or
+        None if the queue is empty.
+        '''
+        with self._condition:
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - self._clock())
+
+    def __len__(self):
+        with self._condition:
+            return len(self._heap)
@@ -0,0 +1,170 @@
+'''
+Parser for RPSL, the format of whois replies and of the database dumps RIRs
+publish, e.g. ripe.db.inetnum.gz.
+'''
+
+from ..net.IPv4 import Address, range_to_subnets
+from ..tools.logger import ModuleLogger
+
+from collections import defaultdict
+import gzip
+import re
+
+log = ModuleLogger(__name__)
+
+RPSL_ATTR_VALUE_RE = re.compile(r'^(\S+):\s+(.*)$')
+RPSL_ATTR_NOVALUE_RE = re.compile(r'^(\S+):$')
+
+# Lines starting with these are comments, in replies as well as in dumps
+RPSL_COMMENT_CHARS = ('%', '#')
+
+# Bulk-imported inetnums are tagged with this prefix and their source
+RPSL_SOURCE_PREFIX = 'rpsl-'
+
+
+class RPSLSyntaxError(ValueError):
+    def __init__(self, line):
+        super().__init__("Malformed RPSL: {0}".format(line))
+        self.line = line
+
+
+def _parse_line(rpsl_line, attributes, attribute):
+    '''
+    Adds the value on rpsl_line to attributes, a defaultdict(list). attribute
+    is the one the previous line was for, which continuation lines carry on.
+    Returns the attribute rpsl_line was for.
+    '''
+    matches = RPSL_ATTR_VALUE_RE.match(rpsl_line)
+    if matches:
+        attribute = matches.group(1)
+        attributes[attribute].append(matches.group(2))
+        return attribute
+
+    if rpsl_line[0] in (' ', '\t', '+'):
+        if attribute is None:
+            raise RPSLSyntaxError(rpsl_line)
+        continuation = rpsl_line[1:].strip()
+        if continuation:
+            values = attributes[attribute]
+            if values:
+                values[-1] = (values[-1] + ' ' + continuation).strip()
+            else:
+                values.append(continuation)
+        return attribute
+
+    matches = RPSL_ATTR_NOVALUE_RE.match(rpsl_line)
+    if matches:
+        return matches.group(1)
+    raise RPSLSyntaxError(rpsl_line)
+
+
+def parse_RPSL_attributes(lines):
+    '''
+    Returns a defaultdict mapping the attribute names in lines, e.g. the
+    lines of a whois reply, to lists of their values. Values that span
+    several lines are joined. Comments and blank lines are skipped and
+    attributes with no value are ignored. Raises RPSLSyntaxError for lines
+    that are neither.
+    '''
+    attributes = defaultdict(list)
+    attribute = None
+    for rpsl_line in lines:
+        if not rpsl_line.strip() or rpsl_line[0] in RPSL_COMMENT_CHARS:
+            continue
+        attribute = _parse_line(rpsl_line, attributes, attribute)
+    return attributes
+
+
+def iter_RPSL_objects(lines, object_classes=None, strict=False):
+    '''
+    Yields an attribute defaultdict, as parse_RPSL_attributes() returns it,
+    for every RPSL object in lines. Lines can be bytes, which are decoded as
+    Latin-1 like RIR dumps are. Only one object is held in memory at a time.
+
+    If object_classes isn't None, only the objects whose first attribute is
+    in it are parsed, the others are skipped. Unless strict is True, in which
+    case RPSLSyntaxError is raised, malformed objects are logged and skipped
+    too, so that one of them doesn't stop a whole dump from being read.
+    '''
+    attributes = attribute = None
+    skipping = False
+    for rpsl_line in lines:
+        if isinstance(rpsl_line, bytes):
+            rpsl_line = rpsl_line.decode('latin-1')
+        rpsl_line = rpsl_line.rstrip('\r\n')
+
+        # Objects are separated by blank lines
+        if not rpsl_line.strip():
+            if attributes:
+                yield attributes
+            attributes = attribute = None
+            skipping = False
+            continue
+        if skipping or rpsl_line[0] in RPSL_COMMENT_CHARS:
+            continue
+
+        if attributes is None:
+            object_class = rpsl_line.partition(':')[0]
+            if object_classes is not None and \
+                    object_class not in object_classes:
+                skipping = True
+                continue
+            attributes = defaultdict(list)
+
+        try:
+            attribute = _parse_line(rpsl_line, attributes, attribute)
+        except RPSLSyntaxError as ex:
+            if strict:
+                raise
+            log.warning("Skipping object: %s", ex)
+            attributes = attribute = None
+            skipping = True
+
+    if attributes:
+        yield attributes
+
+
+def inetnum_range(inetnum):
+    '''
+    Returns the first and last Addresses of an inetnum value, e.g.
+    "45.0.0.0 - 45.255.255.255". Raises ValueError if it's malformed.
+    '''
+    start, end = [s.strip() for s in inetnum.split('-')]
+    return Address(start), Address(end)
+
+
+def open_RPSL_dump(path):
+    '''
+    Opens an RPSL dump for reading in binary mode, decompressing it on the
+    fly if it's gzipped as RIRs publish them.
+    '''
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def inetnum_rows(objects):
+    '''
+    Yields a (subnet, name, source) row, as DataManager.bulk_upsert() expects
+    them, for every subnet of every inetnum object in objects. Objects
+    without exactly one well-formed range and one netname are skipped.
+    '''
+    for attributes in objects:
+        inetnums = attributes['inetnum']
+        netnames = attributes['netname']
+        if 1 != len(inetnums) or 1 != len(netnames) or not netnames[0]:
+            log.debug("Skipping inetnum object %r", inetnums)
+            continue
+        try:
+            first, last = inetnum_range(inetnums[0])
+            subnets = list(range_to_subnets(first, last))
+        except ValueError as ex:
+            log.warning("Skipping inetnum %s: %s", inetnums[0], ex)
+            continue
+
+        # e.g. "RIPE # Filtered"
+        source = RPSL_SOURCE_PREFIX + ''.join(
+            attributes['source'][:1]
+        ).partition('#')[0].strip().lower()
+        for subnet in subnets:
+            yield subnet, netnames[0], source
@@ -0,0 +1,47 @@
+'''
+Common ground for the small SQLite databases the resolvers keep on disk next
+to the address-space DB.
+'''
+
+from ..tools.logger import ModuleLogger
+
+import sqlite3
+import threading
+import time
+
+log = ModuleLogger(__name__)
+
+
+class SQLiteStore(object):
+    '''
+    A SQLite database at path whose tables are created by SCHEMA, a SQL
+    script. The database is only opened when it's first needed. A single
+    instance can be shared by resolvers in several threads: subclasses hold
+    _lock whenever they use the connection _db() returns.
+    '''
+
+    SCHEMA = ''
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self._clock = clock
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _schema(self):
+        return self.SCHEMA
+
+    def _db(self):
+        if self._connection is None:
+            log.debug('Opening %s %s', self.__class__.__name__, self.path)
+            self._connection = sqlite3.connect(
+                self.path, check_same_thread=False
+            )
+            self._connection.executescript(self._schema())
+        return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -1,6 +1,8 @@
 from collections import defaultdict
 from decimal import Decimal
 
+from ..net.IPv4 import Address
+from ..net.intervals import IntervalSet
 from ..tools.logger import ModuleLogger
 
 log = ModuleLogger(__name__)
@@ -23,18 +25,19 @@ class StatsProcessor(object):
         return (subnet_count, prefix_lengths)
 
     def coverage(self):
-        contiguous_coverage = self.data_mgr.group_contiguous_subnets()
+        # The same space GapFinder doesn't report as gaps
+        covered = IntervalSet(
+            self.data_mgr.address_ranges(complete_only=True)
+        )
 
         whole_unicast_address_space = 1 << 32
-        total_unicast_coverage = 0
+        total_unicast_coverage = covered.address_count()
 
-        for contig_block in contiguous_coverage:
-            contig_start = contig_block[0].floor()
-            contig_end = contig_block[-1].ceiling()
-            contig_length = sum(len(subnet) for subnet in contig_block)
-            total_unicast_coverage += contig_length
-
-            log.debug("%r → %r: %r", contig_start, contig_end, contig_length)
+        for contig_start, contig_end in covered:
+            log.debug(
+                "%r → %r: %r", Address(contig_start), Address(contig_end),
+                contig_end - contig_start + 1
+            )
 
         coverage = round(100 * (Decimal(total_unicast_coverage) /
                                 Decimal(whole_unicast_address_space)), 3)
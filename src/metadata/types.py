@@ -8,6 +8,8 @@ log = ModuleLogger(__name__)
 
 class SQLAddress(types.TypeDecorator):  # pylint:disable=W0223
     impl = types.Integer
+    # Stateless, so queries involving it can be compiled once and cached
+    cache_ok = True
 
     def process_bind_param(self, value, dialect):
         int_addr = int(value)
@@ -1,15 +1,25 @@
-from . import ResolutionException
-from ..net.IPv4 import Address
+from . import (
+    constants, ResolutionException, RateLimitationException,
+    QueryDeferredException, WhoisConnectionException
+)
 from ..tools.logger import ModuleLogger
 from .assigned import AssignedSubnet
+from .ratelimit import HostRateLimiter
+from .rpsl import iter_RPSL_objects, inetnum_range, RPSLSyntaxError
+from .whois_client import WhoisClient
 
-from collections import defaultdict
+from urllib.parse import urlsplit
 import re
-from socket import socket, getaddrinfo, AF_INET, SOCK_STREAM
 
+# RIPE, APNIC and AFRINIC deny access with error 201 when they think we're
+# querying too much
+WHOIS_RATE_LIMITATION_RE = re.compile(
+    r'^%ERROR:201:|query rate limit exceeded', re.IGNORECASE | re.MULTILINE
+)
 
-RPSL_ATTR_VALUE_RE = re.compile(r'^(\S+):\s+(.*)$')
-RPSL_ATTR_NOVALUE_RE = re.compile(r'^(\S+):$')
+# Inetnums that enclose the one a query was for are stored with this source.
+# They're incomplete, since we only know one of the ranges carved out of them.
+WHOIS_PARENT_SOURCE = 'whois-parent'
 
 log = ModuleLogger(__name__)
 
@@ -17,89 +27,373 @@ log = ModuleLogger(__name__)
 # TODO Use whois-specific exceptions!!!
 # TODO Use whois:// URLs
 class Whois_Resolver(object):
+    # Chains of referrals longer than this are given up on
+    MAX_REFERRALS = 4
 
-    def __init__(self, ipv4_resolver):
+    def __init__(self, ipv4_resolver, rate_limiter=None, failure_cache=None,
+                 client=None, referral_map=None):
+        '''
+        If referral_map isn't None, e.g. a WhoisReferralMap, the ranges
+        whois servers refer us elsewhere for are recorded in it and later
+        queries for them go straight to the server the referrals led to.
+        '''
         self._resolver = ipv4_resolver
+        if rate_limiter is None:
+            rate_limiter = HostRateLimiter()
+        self._rate_limiter = rate_limiter
+        self._failure_cache = failure_cache
+        if client is None:
+            client = WhoisClient()
+        self._client = client
+        self._referral_map = referral_map
 
-    def get_whois_entry(self, net_address, whois_host=None):
-        whois_PDU = "-V Md5.1 {0}\n".format(net_address.floor())
-        whois_PDU = whois_PDU.encode("ASCII")
+    def _whois_host(self, net_address, whois_host=None):
+        if whois_host:
+            return whois_host
+
+        network_slash_eight = net_address % 8
+        slash_eight_delegation = self._resolver.\
+            get_top_level_assignment(network_slash_eight)
 
+        whois_host = slash_eight_delegation.whois_host
         if not whois_host:
-            network_slash_eight = net_address % 8
-            slash_eight_delegation = self._resolver.\
-                get_top_level_assignment(network_slash_eight)
+            raise ResolutionException(
+                "No whois host set on the top-level delegation"
+            )
+        return whois_host
 
-            whois_host = slash_eight_delegation.whois_host
-            if not whois_host:
-                raise ResolutionException(
-                    "No whois host set on the top-level delegation"
-                )
+    @staticmethod
+    def _whois_query(net_address):
+        return "-V Md5.1 {0}".format(net_address.floor())
+
+    def _check_past_failure(self, whois_host):
+        if self._failure_cache is None:
+            return
+        failure = self._failure_cache.endpoint_failure(whois_host)
+        if failure is not None:
+            # There's no other whois host to try, this query will have to
+            # wait until the host is worth trying again
+            log.warning(
+                "Whois host %s failed %d time(s): %s",
+                whois_host, failure.failures, failure.reason
+            )
+            raise QueryDeferredException(
+                whois_host, self._failure_cache.time_left(failure)
+            )
+
+    def _record_failure(self, whois_host, failure):
+        if self._failure_cache is not None:
+            self._failure_cache.record_endpoint_failure(
+                whois_host, repr(failure)
+            )
 
-        sockinfo = getaddrinfo(
-            whois_host,
-            # Surprisingly, "whois" isn't always present in the "services" DB.
-            # "nicname" appears to be the correct service name.
-            "nicname",
-            family=AF_INET
+    def _rate_limited(self, whois_host):
+        self._rate_limiter.throttle(whois_host)
+        # The server may not answer any more queries on this connection
+        self._client.disconnect(whois_host)
+        raise RateLimitationException(
+            "Whois rate limitation by {0}", whois_host
         )
-        sockaddr = sockinfo[0][-1]
-        log.debug("Resolved \"%s\" to %s", whois_host, sockaddr)
-        output = bytes()
-        with socket(family=AF_INET, type=SOCK_STREAM) as whois_socket:
-            whois_socket.connect(sockaddr)
-            whois_socket.send(whois_PDU)
-            while True:
-                data = whois_socket.recv(4096)
-                # TODO Should we have some sort of timeout here?
-                if not data:
-                    break
-                output += data
-
-        log.info(
-            "WHOIS query %s", whois_host
+
+    def _succeeded(self, whois_host):
+        self._rate_limiter.succeeded(whois_host)
+        if self._failure_cache is not None:
+            self._failure_cache.endpoint_succeeded(whois_host)
+
+    def get_whois_entry(self, net_address, whois_host=None):
+        return ''.join(self.iter_whois_lines(net_address, whois_host))
+
+    def iter_whois_lines(self, net_address, whois_host=None):
+        '''
+        Yields the lines of the whois entry for net_address as they're
+        received. Raises WhoisConnectionException if the whois host can't
+        be reached or takes too long to answer.
+        '''
+        whois_host = self._whois_host(net_address, whois_host)
+        self._check_past_failure(whois_host)
+        self._rate_limiter.wait(whois_host)
+        log.info("WHOIS query %s", whois_host)
+
+        lines = self._client.query_lines(
+            whois_host, self._whois_query(net_address)
         )
-        output = output.decode()
-        return output
+        try:
+            for line in lines:
+                line = line.decode('utf-8', 'replace')
+                if WHOIS_RATE_LIMITATION_RE.search(line):
+                    self._rate_limited(whois_host)
+                yield line
+        except OSError as ex:
+            # Timeouts are OSErrors too
+            self._record_failure(whois_host, ex)
+            raise WhoisConnectionException(
+                "Whois query to {0} failed: {1!r}", whois_host, ex
+            ) from ex
+        finally:
+            # The client hangs up on responses that weren't read in full
+            lines.close()
+        self._succeeded(whois_host)
 
-    def resolve(self, net_address, whois_host=None):
-        entry = self.get_whois_entry(net_address, whois_host)
-        entry_pairs = defaultdict(list)
+    def get_whois_entries(self, net_addresses, whois_host):
+        '''
+        Returns the whois entries for several networks from the same whois
+        host. The queries are pipelined over a persistent connection if the
+        host supports them.
+        '''
+        self._check_past_failure(whois_host)
+        whois_queries = []
+        for net_address in net_addresses:
+            self._rate_limiter.wait(whois_host)
+            whois_queries.append(self._whois_query(net_address))
+        log.info("WHOIS query %s (%d)", whois_host, len(whois_queries))
+        try:
+            outputs = self._client.query_many(whois_host, whois_queries)
+        except OSError as ex:
+            self._record_failure(whois_host, ex)
+            raise WhoisConnectionException(
+                "Whois query to {0} failed: {1!r}", whois_host, ex
+            ) from ex
 
-        attribute = None
-        for rpsl_line in entry.splitlines():
-            rpsl_line.strip()
-            if not rpsl_line or rpsl_line[0] in ('%', '#'):
-                continue
+        entries = [output.decode('utf-8', 'replace') for output in outputs]
+        if any(WHOIS_RATE_LIMITATION_RE.search(entry) for entry in entries):
+            self._rate_limited(whois_host)
+        self._succeeded(whois_host)
+        return entries
 
-            matches = RPSL_ATTR_VALUE_RE.match(rpsl_line)
-            if not matches:
-                if rpsl_line.startswith(16 * ' '):
-                    rpsl_line.strip()
-                    entry_pairs[attribute].append(rpsl_line)
-                elif RPSL_ATTR_NOVALUE_RE.match(rpsl_line):
-                    continue
+    def resolve_many(self, net_addresses, whois_host=None):
+        '''
+        Does what resolve() does for several networks, with the first query
+        for all those whose whois entries are on the same host pipelined.
+        Returns a list with either the assignment or the ResolutionException
+        for each network.
+        '''
+        results = [None] * len(net_addresses)
+        host_batches = {}
+        for index, net_address in enumerate(net_addresses):
+            try:
+                # Networks we learned a referral for go straight to where it
+                # led
+                if self._referral_map is not None and \
+                        self._referral_map.lookup(net_address.floor()):
+                    results[index] = self.resolve(net_address, whois_host)
                 else:
-                    raise ResolutionException(
-                        "Malformed Whois entry: {0}".format(rpsl_line)
+                    host_batches.setdefault(
+                        self._whois_host(net_address, whois_host), []
+                    ).append(index)
+            except ResolutionException as ex:
+                results[index] = ex
+
+        for batch_host, batch in host_batches.items():
+            try:
+                entries = self.get_whois_entries(
+                    [net_addresses[index] for index in batch], batch_host
+                )
+            except ResolutionException as ex:
+                for index in batch:
+                    results[index] = ex
+                continue
+
+            for index, entry in zip(batch, entries):
+                try:
+                    results[index] = self._follow_referrals(
+                        net_addresses[index], batch_host,
+                        self._parse_whois_entry(entry.splitlines(True))
                     )
-            else:
-                attribute = matches.group(1) or None
-                entry_pairs[attribute].append(matches.group(2))
+                except ResolutionException as ex:
+                    results[index] = ex
+        return results
 
-        if not 1 == len(entry_pairs['inetnum']):
+    def resolve(self, net_address, whois_host=None):
+        '''
+        Returns the assignment of the most specific inetnum in the whois
+        entry for net_address that contains it. The other inetnums in the
+        entry are in the related_ranges of that assignment. Those it was
+        carved out of have WHOIS_PARENT_SOURCE for a source.
+
+        Referrals to other whois servers are followed.
+        '''
+        if self._referral_map is not None:
+            referred_host = self._referral_map.lookup(net_address.floor())
+            if referred_host is not None:
+                try:
+                    return self._follow_referrals(net_address, referred_host)
+                except (QueryDeferredException, RateLimitationException,
+                        WhoisConnectionException):
+                    raise
+                except ResolutionException as ex:
+                    # The space may have moved again
+                    log.warning(
+                        "Referral to %s for %s failed: %s",
+                        referred_host, net_address, ex
+                    )
+                    self._referral_map.forget(net_address.floor())
+
+        return self._follow_referrals(
+            net_address, self._whois_host(net_address, whois_host)
+        )
+
+    def _follow_referrals(self, net_address, whois_host, rpsl_objects=None):
+        '''
+        Returns the assignment for net_address once the referrals from
+        whois_host are followed. rpsl_objects is what whois_host already
+        returned for net_address, if anything.
+        '''
+        visited_hosts = [whois_host.lower()]
+        referral_range = None
+        while True:
+            if rpsl_objects is None:
+                rpsl_objects = self._whois_objects(net_address, whois_host)
+            referral = self._referral(net_address, rpsl_objects, whois_host)
+            if referral is None:
+                break
+
+            referred_host, first, last = referral
+            if referred_host in visited_hosts:
+                raise ResolutionException(
+                    "Whois referral loop: {0}",
+                    ' -> '.join(visited_hosts + [referred_host])
+                )
+            if len(visited_hosts) > self.MAX_REFERRALS:
+                raise ResolutionException(
+                    "Too many whois referrals: {0}",
+                    ' -> '.join(visited_hosts)
+                )
+            log.info(
+                "Whois referral from %s to %s for %s-%s",
+                whois_host, referred_host, first, last
+            )
+            # The first server to refer us knows the widest range
+            if referral_range is None:
+                referral_range = (first, last)
+            visited_hosts.append(referred_host)
+            whois_host = referred_host
+            rpsl_objects = None
+
+        assigned = self._assignment(net_address, rpsl_objects)
+        if referral_range is not None and self._referral_map is not None:
+            self._referral_map.learn(*referral_range, whois_host)
+        return assigned
+
+    def _whois_objects(self, net_address, whois_host):
+        '''
+        Returns the attributes of the RPSL objects in the whois entry for
+        net_address.
+        '''
+        # Objects are parsed as their lines come in
+        whois_lines = self.iter_whois_lines(net_address, whois_host)
+        try:
+            return self._parse_whois_entry(whois_lines)
+        finally:
+            # We don't read the rest of malformed entries
+            whois_lines.close()
+
+    @staticmethod
+    def _parse_whois_entry(whois_lines):
+        try:
+            return list(iter_RPSL_objects(whois_lines, strict=True))
+        except RPSLSyntaxError as ex:
+            raise ResolutionException("Malformed Whois entry: {0}", ex.line)
+
+    @staticmethod
+    def _referral_host(referral):
+        '''
+        Returns the whois host a referral attribute points to, e.g.
+        "whois://whois.ripe.net:43" or "whois.ripe.net", or None if it isn't
+        a whois server, e.g. "rwhois://rwhois.example.net:4321".
+        '''
+        if '://' not in referral:
+            return referral.strip().lower() or None
+        url = urlsplit(referral.strip())
+        if 'whois' != url.scheme.lower():
+            return None
+        return url.hostname
+
+    def _referral(self, net_address, rpsl_objects, whois_host):
+        '''
+        Returns the (host, first, last) of the first referral to another
+        server in rpsl_objects. first and last are the bounds of the
+        referring object's range if it includes net_address, or those of
+        net_address. Returns None if there's no such referral.
+        '''
+        query_address = net_address.floor()
+        for attributes in rpsl_objects:
+            for attribute in constants.WHOIS_REFERRAL_ATTRIBUTES:
+                for referral in attributes[attribute]:
+                    referred_host = self._referral_host(referral)
+                    if referred_host in (None, whois_host.lower()):
+                        continue
+
+                    first, last = net_address.floor(), net_address.ceiling()
+                    ranges = attributes['inetnum'] or attributes['NetRange']
+                    if 1 == len(ranges):
+                        try:
+                            start, end = inetnum_range(ranges[0])
+                        except ValueError:
+                            pass
+                        else:
+                            if start <= query_address <= end:
+                                first, last = start, end
+                    return referred_host, first, last
+        return None
+
+    @staticmethod
+    def _assignment(net_address, rpsl_objects):
+        '''
+        Returns the assignment for net_address out of the inetnums in
+        rpsl_objects. See resolve().
+        '''
+        inetnum_objects = [
+            attributes for attributes in rpsl_objects
+            if 1 == len(attributes['inetnum'])
+        ]
+        if not inetnum_objects:
             raise ResolutionException("No inetnum in whois record")
 
-        if not 1 == len(entry_pairs['netname']):
+        inetnum_ranges = []
+        for attributes in inetnum_objects:
+            if not 1 == len(attributes['netname']):
+                log.debug("No netname for inetnum %s", attributes['inetnum'])
+                continue
+            try:
+                start, end = inetnum_range(attributes['inetnum'][0])
+                range_subnets = AssignedSubnet.from_range(
+                    start, end, attributes['netname'][0]
+                )
+            except ValueError as ex:
+                log.warning(
+                    "Skipping inetnum %s: %s", attributes['inetnum'][0], ex
+                )
+                continue
+            inetnum_ranges.append((int(end) - int(start), range_subnets))
+
+        if not inetnum_ranges:
             raise ResolutionException("No netname in whois record")
-        inet_range = entry_pairs['inetnum'].pop()
-        start, end = [s.strip() for s in inet_range.split('-')]
 
-        netname = entry_pairs['netname'].pop()
+        query_address = net_address.floor()
+        # The narrowest range that holds the address is the one we want
+        matching = [
+            (size, range_subnets) for size, range_subnets in inetnum_ranges
+            if range_subnets[0].floor() <= query_address
+            <= range_subnets[-1].ceiling()
+        ]
+        if not matching:
+            raise ResolutionException(
+                "No inetnum for {0} in whois record", query_address
+            )
+        _, best_range = min(matching, key=lambda match: match[0])
+
+        best_first, best_last = best_range[0].floor(), best_range[-1].ceiling()
+        for _, range_subnets in inetnum_ranges:
+            if range_subnets is best_range:
+                continue
+            if range_subnets[0].floor() <= best_first and \
+                    best_last <= range_subnets[-1].ceiling():
+                for subnet in range_subnets:
+                    subnet._source = WHOIS_PARENT_SOURCE
 
-        assigned = AssignedSubnet(
-            Address(start),
-            Address(end),
-            netname
+        assigned = best_range[0]
+        assigned.related_ranges = tuple(
+            range_subnets for _, range_subnets in inetnum_ranges
+            if range_subnets is not best_range
         )
         return assigned
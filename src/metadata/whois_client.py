@@ -0,0 +1,303 @@
+'''
+Whois client that reuses what it can from one query to the next: the
+addresses of whois servers and, for servers that support it, the TCP
+connection itself.
+'''
+
+from ..tools.logger import ModuleLogger
+from . import constants, ResolutionException
+
+from socket import socket, getaddrinfo, AF_INET, SOCK_STREAM
+import time
+
+log = ModuleLogger(__name__)
+
+# Persistent connections are closed on a query line with just this flag
+KEEPALIVE_FLAG = '-k'
+
+
+class LineReader(object):
+    '''
+    Reads lines off a socket with recv_into() into a buffer of a fixed
+    size, so that memory use doesn't depend on the size of the response and
+    no byte is copied more than a couple of times. Lines longer than the
+    buffer are rejected.
+
+    Every read waits for at most read_timeout seconds, and none of them
+    goes past the deadline readline() is given.
+    '''
+
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, whois_socket, read_timeout, buffer_size=BUFFER_SIZE,
+                 clock=time.monotonic):
+        self._socket = whois_socket
+        self._read_timeout = read_timeout
+        self._clock = clock
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        # Unread data is in _buffer[_start:_end]. There's no line terminator
+        # in _buffer[_start:_scanned].
+        self._start = self._scanned = self._end = 0
+        self._eof = False
+
+    def readline(self, deadline):
+        '''
+        Returns the next line, with its terminator. The last line may not
+        have one. Returns b'' once the server has closed the connection.
+        Raises TimeoutError if the line isn't there by the deadline, a
+        clock() value.
+        '''
+        while True:
+            newline = self._buffer.find(b'\n', self._scanned, self._end)
+            if newline >= 0:
+                return self._consume(newline + 1)
+            self._scanned = self._end
+            if self._eof:
+                return self._consume(self._end)
+            self._fill(deadline)
+
+    def _consume(self, line_end):
+        line = bytes(self._view[self._start:line_end])
+        self._start = self._scanned = line_end
+        return line
+
+    def _fill(self, deadline):
+        if self._start == self._end:
+            self._start = self._scanned = self._end = 0
+        elif self._end == len(self._buffer):
+            if 0 == self._start:
+                raise ResolutionException(
+                    "Whois line longer than {0} bytes", len(self._buffer)
+                )
+            # Move the start of the current line to the front
+            pending = self._end - self._start
+            self._view[:pending] = self._view[self._start:self._end]
+            self._scanned -= self._start
+            self._start, self._end = 0, pending
+
+        time_left = deadline - self._clock()
+        if time_left <= 0:
+            raise TimeoutError("Whois response took too long")
+        self._socket.settimeout(min(self._read_timeout, time_left))
+        byte_count = self._socket.recv_into(self._view[self._end:])
+        if not byte_count:
+            self._eof = True
+        self._end += byte_count
+
+
+class WhoisSession(object):
+    '''
+    A persistent connection to a whois server. Queries can be pipelined, i.e.
+    several of them sent before the first response is read.
+    '''
+
+    def __init__(self, whois_socket, read_timeout, clock=time.monotonic):
+        self._socket = whois_socket
+        self._clock = clock
+        self._reader = LineReader(whois_socket, read_timeout, clock=clock)
+        # The server is asked to keep the connection open with the first query
+        self._started = False
+        self.last_used = clock()
+
+    def send(self, queries):
+        lines = []
+        for query in queries:
+            if not self._started:
+                query = KEEPALIVE_FLAG + ' ' + query
+                self._started = True
+            lines.append(query + '\n')
+        self._socket.sendall(''.join(lines).encode('ASCII'))
+        self.last_used = self._clock()
+
+    def response_lines(self, deadline):
+        '''
+        Yields the lines of the next response. In persistent mode, the end of
+        every response is marked by two empty lines, which aren't part of
+        it. Raises ConnectionError if the server closes the connection
+        first.
+        '''
+        empty_line = None
+        while True:
+            line = self._reader.readline(deadline)
+            if not line:
+                raise ConnectionError("Whois server closed the connection")
+            if line in (b'\n', b'\r\n'):
+                if empty_line is not None:
+                    self.last_used = self._clock()
+                    return
+                empty_line = line
+                continue
+            if empty_line is not None:
+                yield empty_line
+                empty_line = None
+            yield line
+
+    def close(self):
+        try:
+            self._socket.sendall((KEEPALIVE_FLAG + '\n').encode('ASCII'))
+        except OSError:
+            pass
+        self._socket.close()
+
+
+class WhoisClient(object):
+    '''
+    Sends whois queries. Server addresses are only looked up once, and
+    connections to keepalive_hosts are kept open between queries, unless
+    they're left idle for longer than IDLE_TIMEOUT seconds. Other servers get
+    a new connection for every query, which they close after replying.
+
+    No read waits for longer than TIMEOUT seconds, and no response takes
+    longer than RESPONSE_TIMEOUT seconds to read in full.
+
+    A client isn't meant to be shared between threads.
+    '''
+
+    TIMEOUT = 30
+    RESPONSE_TIMEOUT = 60
+    # Servers drop idle persistent connections after a while. We'd rather not
+    # find that out by sending queries down one of them.
+    IDLE_TIMEOUT = 60
+
+    def __init__(self, keepalive_hosts=constants.KEEPALIVE_WHOIS_HOSTS,
+                 clock=time.monotonic):
+        self._keepalive_hosts = frozenset(keepalive_hosts)
+        self._clock = clock
+        self._addresses = {}
+        self._sessions = {}
+
+    def _address(self, whois_host):
+        try:
+            return self._addresses[whois_host]
+        except KeyError:
+            pass
+        sockinfo = getaddrinfo(
+            whois_host,
+            # Surprisingly, "whois" isn't always present in the "services" DB.
+            # "nicname" appears to be the correct service name.
+            "nicname",
+            family=AF_INET
+        )
+        sockaddr = sockinfo[0][-1]
+        log.debug("Resolved \"%s\" to %s", whois_host, sockaddr)
+        self._addresses[whois_host] = sockaddr
+        return sockaddr
+
+    def _connect(self, whois_host):
+        whois_socket = socket(family=AF_INET, type=SOCK_STREAM)
+        whois_socket.settimeout(self.TIMEOUT)
+        try:
+            whois_socket.connect(self._address(whois_host))
+        except OSError:
+            whois_socket.close()
+            # The server may well have moved
+            self._addresses.pop(whois_host, None)
+            raise
+        return whois_socket
+
+    def _deadline(self):
+        return self._clock() + self.RESPONSE_TIMEOUT
+
+    def query(self, whois_host, query):
+        '''
+        Sends a single query line, without its line terminator, and returns
+        the raw response.
+        '''
+        return b''.join(self.query_lines(whois_host, query))
+
+    def query_lines(self, whois_host, query):
+        '''
+        Sends a single query line and yields the lines of the response as
+        they come in.
+        '''
+        if whois_host not in self._keepalive_hosts:
+            return self._one_shot_lines(whois_host, query)
+        return self._session_lines(whois_host, query)
+
+    def _one_shot_lines(self, whois_host, query):
+        with self._connect(whois_host) as whois_socket:
+            whois_socket.sendall((query + '\n').encode('ASCII'))
+            reader = LineReader(whois_socket, self.TIMEOUT, clock=self._clock)
+            deadline = self._deadline()
+            while True:
+                line = reader.readline(deadline)
+                if not line:
+                    return
+                yield line
+
+    def _session_lines(self, whois_host, query):
+        for attempt in range(2):
+            session, reused = self._session(whois_host)
+            complete = started = False
+            try:
+                session.send([query])
+                for line in session.response_lines(self._deadline()):
+                    started = True
+                    yield line
+                complete = True
+                return
+            except OSError as ex:
+                # A connection that was idle may have been closed by the
+                # server. We try a fresh one unless we're halfway through.
+                if attempt or started or not reused:
+                    raise
+                log.debug("Reconnecting to %s: %r", whois_host, ex)
+            finally:
+                # Unread responses would get mixed up with the next ones
+                if not complete:
+                    self.disconnect(whois_host)
+
+    def query_many(self, whois_host, queries):
+        '''
+        Returns the raw responses to several queries. They're pipelined over
+        a single connection if whois_host supports persistent connections.
+        '''
+        if whois_host not in self._keepalive_hosts:
+            return [self.query(whois_host, query) for query in queries]
+
+        responses = []
+        # If the server hung up on us, the rest of the queries get another
+        # chance on a fresh connection
+        for attempt in range(2):
+            session, _ = self._session(whois_host)
+            try:
+                session.send(queries[len(responses):])
+                while len(responses) < len(queries):
+                    responses.append(b''.join(
+                        session.response_lines(self._deadline())
+                    ))
+                return responses
+            except OSError as ex:
+                self.disconnect(whois_host)
+                if attempt:
+                    raise
+                log.debug("Reconnecting to %s: %r", whois_host, ex)
+
+    def _session(self, whois_host):
+        '''
+        Returns an open session to whois_host and whether it was used before.
+        '''
+        session = self._sessions.get(whois_host)
+        if session is not None and \
+                self._clock() - session.last_used > self.IDLE_TIMEOUT:
+            self.disconnect(whois_host)
+            session = None
+        if session is not None:
+            return session, True
+
+        log.debug("Opening persistent connection to %s", whois_host)
+        session = WhoisSession(
+            self._connect(whois_host), self.TIMEOUT, self._clock
+        )
+        self._sessions[whois_host] = session
+        return session, False
+
+    def disconnect(self, whois_host):
+        session = self._sessions.pop(whois_host, None)
+        if session is not None:
+            session.close()
+
+    def close(self):
+        for whois_host in list(self._sessions):
+            self.disconnect(whois_host)
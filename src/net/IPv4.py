@@ -3,18 +3,28 @@ IPv4 address space entities
 '''
 
 
+MAX_UINT32 = 0xFFFFFFFF
+
+# Netmasks and host masks are interned here for every possible prefix length,
+# so that building a subnet doesn't involve any shifting.
+_NETMASKS = tuple(
+    (MAX_UINT32 << (32 - length)) & MAX_UINT32 for length in range(33)
+)
+_HOSTMASKS = tuple(mask ^ MAX_UINT32 for mask in _NETMASKS)
+
+
 class Address(object):
     '''
-    Models a single IPv4 address.
+    Models a single IPv4 address. Instances are immutable.
     '''
 
-    def __init__(self, arg):
-        self._uint = None
+    __slots__ = ('_uint',)
 
+    def __init__(self, arg):
         if isinstance(arg, int):
             self._from_uint(arg)
         elif isinstance(arg, Address):
-            self._from_uint(int(arg))
+            object.__setattr__(self, '_uint', arg._uint)
         elif isinstance(arg, str):
             self._from_string(arg)
         else:
@@ -32,11 +42,11 @@ class Address(object):
                 )
 
     def _from_uint(self, address_uint):
-        if not (address_uint >= 0 and address_uint <= (2**32 - 1)):
+        if not (address_uint >= 0 and address_uint <= MAX_UINT32):
             raise ValueError("Invalid IPv4 address uint32")
 
         # All the other class methods lead here
-        self._uint = address_uint
+        object.__setattr__(self, '_uint', address_uint)
 
     def _from_string(self, dotted_quad):
         try:
@@ -81,10 +91,21 @@ class Address(object):
     def __str__(self):
         return ".".join(str(b) for b in bytes(self))
 
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            "{0} instances are immutable".format(self.__class__.__name__)
+        )
+
+    def __reduce__(self):
+        # The default protocol would restore _uint through __setattr__
+        return (self.__class__, (self._uint,))
+
     def __hash__(self):
-        return hash(int(self))
+        return hash(self._uint)
 
     def __eq__(self, other_IP):
+        if isinstance(other_IP, Address):
+            return self._uint == other_IP._uint
         try:
             return self._uint == int(other_IP)
         except ValueError:
@@ -93,6 +114,8 @@ class Address(object):
             ))
 
     def __ne__(self, other_IP):
+        if isinstance(other_IP, Address):
+            return self._uint != other_IP._uint
         try:
             return self._uint != int(other_IP)
         except ValueError:
@@ -101,24 +124,32 @@ class Address(object):
             ))
 
     def __lt__(self, other_IP):
+        if isinstance(other_IP, Address):
+            return self._uint < other_IP._uint
         try:
             return self._uint < int(other_IP)
         except ValueError:
             raise TypeError("Can only compare IPv4 to IPv4")
 
     def __le__(self, other_IP):
+        if isinstance(other_IP, Address):
+            return self._uint <= other_IP._uint
         try:
             return self._uint <= int(other_IP)
         except ValueError:
             raise TypeError("Can only compare IPv4 to IPv4")
 
     def __gt__(self, other_IP):
+        if isinstance(other_IP, Address):
+            return self._uint > other_IP._uint
         try:
             return self._uint > int(other_IP)
         except ValueError:
             raise TypeError("Can only compare IPv4 to IPv4")
 
     def __ge__(self, other_IP):
+        if isinstance(other_IP, Address):
+            return self._uint >= other_IP._uint
         try:
             return self._uint >= int(other_IP)
         except ValueError:
@@ -142,14 +173,16 @@ class Address(object):
 
 
 class Subnet(object):
-    '''Models a CIDR IPv4 subnet.'''
+    '''
+    Models a CIDR IPv4 subnet. The integer bounds of the subnet are computed
+    once, at construction time. The network and prefix length can't be
+    changed afterwards, since the bounds and the hash depend on them.
+    '''
+
+    __slots__ = ('_network', '_prefix_length', '_floor_uint', '_ceiling_uint')
 
     def __init__(self, arg1, arg2):
         # TODO We need a copy constructor!!!!
-        # Set private attributes in the constructor, just so they're there.
-        self._network = None
-        self._prefix_length = None
-
         if isinstance(arg1, Address) and isinstance(arg2, int):
             self._from_address_and_prefix_length(arg1, arg2)
         elif isinstance(arg1, Address) and isinstance(arg2, Address):
@@ -168,23 +201,56 @@ class Subnet(object):
         if not (prefix_length <= 32 and prefix_length >= 0):
             raise ValueError("Prefix length has to be between 0 and 32")
 
-        self._prefix_length = prefix_length
-
-        network_address = Address(address)
-        network_address &= Subnet._mask_uint32(prefix_length)
-        self._network = network_address
+        network_uint = address._uint & _NETMASKS[prefix_length]
+        if network_uint != address._uint:
+            address = Address(network_uint)
+        # Addresses are immutable, so the one we were given can be shared
+        self._set_network(address, prefix_length)
+
+    def _set_network(self, network, prefix_length):
+        '''
+        Sets the network and prefix length, which nothing can change
+        afterwards, and the bounds that depend on them.
+        '''
+        _set_network(self, network)
+        _set_prefix_length(self, prefix_length)
+        _set_floor_uint(self, network._uint)
+        _set_ceiling_uint(self, network._uint | _HOSTMASKS[prefix_length])
 
     def _from_start_and_end(self, network, broadcast):
         # start is the network address, end is the broadcast address
         host_bits = int(network) ^ int(broadcast)
 
-        prefix_length = 32
-        while host_bits:
-            host_bits >>= 1
-            prefix_length -= 1
-
+        prefix_length = 32 - host_bits.bit_length()
         self._from_address_and_prefix_length(network, prefix_length)
 
+    def _cache_bounds(self):
+        '''
+        Computes the integer network and broadcast addresses from _network and
+        _prefix_length.
+        '''
+        network_uint = int(self._network)
+        _set_floor_uint(self, network_uint)
+        _set_ceiling_uint(
+            self, network_uint | _HOSTMASKS[self._prefix_length]
+        )
+
+    def __setattr__(self, name, value):
+        # Subclasses, e.g. AssignedSubnet, have attributes of their own
+        if name in Subnet.__slots__:
+            raise AttributeError(
+                "{0} instances are immutable".format(self.__class__.__name__)
+            )
+        object.__setattr__(self, name, value)
+
+    def __setstate__(self, state):
+        # The default protocol would restore the slots through __setattr__
+        instance_dict, slots = state
+        if instance_dict:
+            self.__dict__.update(instance_dict)
+        for name, value in slots.items():
+            object.__setattr__(self, name, value)
+
     def __rshift__(self, prefix_increment):
         rval = Subnet(self._network, self._prefix_length + prefix_increment)
         return rval
@@ -198,18 +264,21 @@ class Subnet(object):
         return rval
 
     def __eq__(self, other):
+        if isinstance(other, Subnet):
+            return (self._floor_uint == other._floor_uint) and \
+                (self._prefix_length == other._prefix_length)
         try:
             return (self._network == other.network) and \
-                    (self._prefix_length == other.prefix_length)
+                (self._prefix_length == other.prefix_length)
         except AttributeError:
             raise TypeError("Can only compare {0} to {0}".format(
                 self.__class__.__name__
             ))
 
     def __hash__(self):
-        return hash(
-            (int(self._network), self._prefix_length)
-        )
+        # Unique for every (network, prefix length) pair. This is cheaper than
+        # hashing a tuple and, unlike a cached hash, costs no memory.
+        return self._floor_uint | (self._prefix_length << 32)
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -222,18 +291,15 @@ class Subnet(object):
     def __len__(self):
         # We care about all addresses in the subnet, including the network and
         # broadcast address
-        return 2 ** (32 - self._prefix_length)
+        return self._ceiling_uint - self._floor_uint + 1
 
     @property
     def netmask(self):
-        return Subnet._mask_uint32(self._prefix_length)
+        return _NETMASKS[self._prefix_length]
 
     @staticmethod
     def _mask_uint32(mask_length):
-        mask = 0xFFFFFFFF
-        mask = mask >> (32 - mask_length)
-        mask = mask << (32 - mask_length)
-        return mask
+        return _NETMASKS[mask_length]
 
     @property
     def network(self):
@@ -244,20 +310,174 @@ class Subnet(object):
         return self._prefix_length
 
     def floor(self):
-        return Address(int(self._network))
+        return self._network
 
     def ceiling(self):
-        return Address(
-            int(self._network) | (self.netmask ^ 0xFFFFFFFF)
-        )
+        return Address(self._ceiling_uint)
 
     def __contains__(self, other):
         if isinstance(other, Address):
-            return self.floor() <= other and self.ceiling() >= other
+            return self._floor_uint <= other._uint <= self._ceiling_uint
         elif isinstance(other, Subnet):
-            return self.floor() <= other.floor() and \
-                    self.ceiling() >= other.ceiling()
+            return self._floor_uint <= other._floor_uint and \
+                other._ceiling_uint <= self._ceiling_uint
         else:
             raise TypeError()
 
-    # TODO Would it make sense to implement an iterator?
+    def addresses(self):
+        '''
+        Lazily iterates over every address in the subnet, including the network
+        and broadcast addresses.
+        '''
+        return address_range(self._floor_uint, self._ceiling_uint)
+
+    def hosts(self):
+        '''
+        Lazily iterates over the usable host addresses in the subnet. /31 and
+        /32 subnets don't have a network or broadcast address, see RFC 3021.
+        '''
+        if self._prefix_length >= 31:
+            return address_range(self._floor_uint, self._ceiling_uint)
+        return address_range(self._floor_uint + 1, self._ceiling_uint - 1)
+
+    def subnets(self, new_prefix_length):
+        '''
+        Lazily iterates over the subnets of this subnet with the given prefix
+        length, in ascending order.
+        '''
+        if not (self._prefix_length <= new_prefix_length <= 32):
+            raise ValueError(
+                "Prefix length has to be between {0} and 32".format(
+                    self._prefix_length
+                )
+            )
+
+        step = 1 << (32 - new_prefix_length)
+        for network_uint in range(
+                self._floor_uint, self._ceiling_uint + 1, step):
+            yield _aligned_subnet(network_uint, new_prefix_length)
+
+    def supernet(self, new_prefix_length=None):
+        '''
+        Returns the subnet with the given prefix length (by default, one bit
+        shorter than this subnet's) that contains this subnet.
+        '''
+        if new_prefix_length is None:
+            new_prefix_length = self._prefix_length - 1
+        if not (0 <= new_prefix_length <= self._prefix_length):
+            raise ValueError(
+                "Prefix length has to be between 0 and {0}".format(
+                    self._prefix_length
+                )
+            )
+        return _aligned_subnet(
+            self._floor_uint & _NETMASKS[new_prefix_length], new_prefix_length
+        )
+
+    def supernets(self):
+        '''
+        Lazily iterates over the subnets that contain this subnet, from the
+        immediate supernet up to the whole address space.
+        '''
+        for new_prefix_length in range(self._prefix_length - 1, -1, -1):
+            yield _aligned_subnet(
+                self._floor_uint & _NETMASKS[new_prefix_length],
+                new_prefix_length
+            )
+
+
+# The descriptors of Subnet's slots set them without going through
+# Subnet.__setattr__
+_set_network = Subnet._network.__set__
+_set_prefix_length = Subnet._prefix_length.__set__
+_set_floor_uint = Subnet._floor_uint.__set__
+_set_ceiling_uint = Subnet._ceiling_uint.__set__
+
+
+def _aligned_subnet(network_uint, prefix_length):
+    '''
+    Builds a Subnet out of a network address uint32 that's known to be aligned
+    on the prefix length, bypassing the constructor's checks.
+    '''
+    subnet = Subnet.__new__(Subnet)
+    _set_network(subnet, Address(network_uint))
+    _set_prefix_length(subnet, prefix_length)
+    _set_floor_uint(subnet, network_uint)
+    _set_ceiling_uint(subnet, network_uint | _HOSTMASKS[prefix_length])
+    return subnet
+
+
+def range_to_subnets(first, last):
+    '''
+    Lazily iterates over the smallest set of CIDR subnets that exactly covers
+    the addresses from first to last, inclusive, in ascending order. first and
+    last can be Address instances or uint32s. No range needs more than 62
+    subnets.
+    '''
+    first_uint = int(first)
+    last_uint = int(last)
+    if first_uint > last_uint:
+        raise ValueError("Range start {0} is after range end {1}".format(
+            Address(first_uint), Address(last_uint)
+        ))
+
+    while first_uint <= last_uint:
+        # The largest block that's aligned on first_uint and doesn't go past
+        # last_uint
+        if first_uint:
+            alignment_bits = (first_uint & -first_uint).bit_length() - 1
+        else:
+            alignment_bits = 32
+        remaining_bits = (last_uint - first_uint + 1).bit_length() - 1
+        host_bits = min(alignment_bits, remaining_bits)
+
+        yield _aligned_subnet(first_uint, 32 - host_bits)
+        first_uint += 1 << host_bits
+
+
+def address_range(first, last):
+    '''
+    Lazily iterates over the addresses from first to last, inclusive. first
+    and last can be Address instances or uint32s.
+    '''
+    for address_uint in range(int(first), int(last) + 1):
+        yield Address(address_uint)
+
+
+def collapse_ranges(ranges):
+    '''
+    Lazily iterates over the smallest set of CIDR subnets that exactly covers
+    an iterable of (first, last) address ranges, in ascending order. The
+    ranges can overlap or be adjacent, but they must be sorted by their first
+    address. This is a single pass that only holds one range in memory.
+    '''
+    run_first = run_last = None
+    for first, last in ranges:
+        first = int(first)
+        last = int(last)
+        if run_last is not None:
+            if first < run_first:
+                raise ValueError(
+                    "Ranges aren't sorted: {0} comes after {1}".format(
+                        Address(first), Address(run_first)
+                    )
+                )
+            if first <= run_last + 1:
+                run_last = max(run_last, last)
+                continue
+            yield from range_to_subnets(run_first, run_last)
+        run_first, run_last = first, last
+
+    if run_last is not None:
+        yield from range_to_subnets(run_first, run_last)
+
+
+def collapse_subnets(subnets):
+    '''
+    Lazily iterates over the smallest set of CIDR subnets that covers the same
+    addresses as subnets, which must be sorted by network address. Nested
+    subnets are dropped and adjacent ones merged into their supernets.
+    '''
+    return collapse_ranges(
+        (subnet._floor_uint, subnet._ceiling_uint) for subnet in subnets
+    )
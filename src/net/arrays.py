@@ -0,0 +1,417 @@
+'''
+Vectorised containers for large numbers of IPv4 addresses and subnets.
+
+These are backed by NumPy arrays, so that batch operations (parsing,
+formatting, masking, sorting, lookups) run as a handful of array operations
+instead of one Python-level operation per Address or Subnet.
+'''
+
+import numpy as np
+
+from .IPv4 import Address, Subnet, MAX_UINT32, _NETMASKS, _HOSTMASKS
+
+NETMASKS = np.array(_NETMASKS, dtype=np.uint32)
+HOSTMASKS = np.array(_HOSTMASKS, dtype=np.uint32)
+
+_OCTET_STRINGS = np.array([str(octet) for octet in range(256)])
+
+_DOT = ord('.')
+_ZERO = ord('0')
+_NINE = ord('9')
+
+
+def _char_matrix(strings):
+    '''
+    Returns a 2D array of character codes for a sequence of str or bytes, one
+    row per string. Every row is terminated by at least one NUL.
+    '''
+    as_array = np.array(list(strings))
+    if as_array.dtype.kind == 'S':
+        code_dtype = np.uint8
+    elif as_array.dtype.kind == 'U':
+        code_dtype = np.uint32
+    elif not len(as_array):
+        return np.zeros((0, 1), dtype=np.uint32)
+    else:
+        raise TypeError(
+            "Can only parse sequences of str or bytes, not {0}".format(
+                as_array.dtype
+            )
+        )
+
+    chars = as_array.view(code_dtype).reshape(len(as_array), -1)
+    terminator = np.zeros((len(as_array), 1), dtype=np.uint32)
+    return np.hstack((chars.astype(np.uint32), terminator))
+
+
+def parse_dotted_quads(strings):
+    '''
+    Parses a sequence of dotted quads (str or bytes) into uint32 addresses.
+    Returns a tuple of two arrays: the addresses and a boolean array telling
+    which of the strings were valid. Invalid strings yield address 0.
+
+    The parser accepts the same strings as Address does: four groups of
+    decimal digits, each no greater than 255, separated by dots.
+    '''
+    chars = _char_matrix(strings)
+    count = chars.shape[0]
+
+    addresses = np.zeros(count, dtype=np.uint32)
+    # Octets with leading zeros can have many digits, so they're accumulated
+    # in 64 bits to rule out wrapping around
+    octet = np.zeros(count, dtype=np.uint64)
+    digits = np.zeros(count, dtype=np.uint8)
+    dots = np.zeros(count, dtype=np.uint8)
+    valid = np.ones(count, dtype=bool)
+    ended = np.zeros(count, dtype=bool)
+
+    for column in chars.T:
+        is_nul = column == 0
+        is_digit = (column >= _ZERO) & (column <= _NINE) & ~ended
+        is_dot = (column == _DOT) & ~ended
+
+        # Anything after the end of the string has to be NUL, and anything
+        # before it has to be a digit or a dot
+        valid &= ~(ended & ~is_nul)
+        valid &= is_nul | is_digit | is_dot
+
+        octet = np.where(
+            is_digit, octet * 10 + (column - _ZERO).astype(np.uint64), octet
+        )
+        digits += is_digit
+
+        # A dot or the end of the string closes the current octet
+        closing = is_dot | (is_nul & ~ended)
+        valid &= ~closing | ((digits > 0) & (octet <= 255))
+        addresses = np.where(
+            closing, (addresses << 8) | (octet & 0xFF).astype(np.uint32),
+            addresses
+        )
+        octet = np.where(closing, 0, octet)
+        digits = np.where(closing, 0, digits)
+        dots += is_dot
+
+        ended |= is_nul
+
+    valid &= dots == 3
+
+    return np.where(valid, addresses, 0).astype(np.uint32), valid
+
+
+def format_dotted_quads(uints):
+    '''
+    Formats an array of uint32 addresses as a list of dotted quads.
+    '''
+    uints = np.asarray(uints, dtype=np.uint32)
+    formatted = _OCTET_STRINGS[(uints >> 24) & 0xFF]
+    for shift in (16, 8, 0):
+        formatted = np.char.add(
+            np.char.add(formatted, '.'),
+            _OCTET_STRINGS[(uints >> shift) & 0xFF]
+        )
+    return formatted.tolist()
+
+
+def _bit_lengths(values):
+    '''
+    Vectorised int.bit_length() for non-negative integers below 2**53
+    '''
+    _, exponents = np.frexp(values.astype(np.float64))
+    return exponents.astype(np.int64)
+
+
+def decompose_ranges(starts, ends):
+    '''
+    Vectorised equivalent of IPv4.range_to_subnets(). Returns three arrays: the
+    index of the range each subnet belongs to, the subnets' network addresses
+    and their prefix lengths. Subnets are ordered by range, then by address.
+    '''
+    starts = _as_uint32_array(starts).ravel().astype(np.int64)
+    ends = _as_uint32_array(ends).ravel().astype(np.int64)
+    if starts.shape != ends.shape:
+        raise ValueError("There must be as many range ends as range starts")
+    if (starts > ends).any():
+        bad_range = int(np.argmax(starts > ends))
+        raise ValueError("Range start {0} is after range end {1}".format(
+            Address(int(starts[bad_range])), Address(int(ends[bad_range]))
+        ))
+
+    range_indices = []
+    networks = []
+    prefix_lengths = []
+
+    active = np.arange(len(starts))
+    current = starts.copy()
+    # Every iteration carves the largest possible block off the front of
+    # every range that isn't fully covered yet
+    while len(active):
+        first = current[active]
+        last = ends[active]
+
+        alignment_bits = np.where(
+            first == 0, 32, _bit_lengths(first & -first) - 1
+        )
+        remaining_bits = _bit_lengths(last - first + 1) - 1
+        host_bits = np.minimum(alignment_bits, remaining_bits)
+
+        range_indices.append(active)
+        networks.append(first)
+        prefix_lengths.append(32 - host_bits)
+
+        current[active] = first + (np.int64(1) << host_bits)
+        active = active[current[active] <= last]
+
+    if not range_indices:
+        return (
+            np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint32),
+            np.zeros(0, dtype=np.uint8)
+        )
+
+    range_indices = np.concatenate(range_indices)
+    networks = np.concatenate(networks)
+    prefix_lengths = np.concatenate(prefix_lengths)
+    # Within a range, subnets were carved off in ascending order, so a stable
+    # sort on the range index is enough
+    order = np.argsort(range_indices, kind='stable')
+    return (
+        range_indices[order],
+        networks[order].astype(np.uint32),
+        prefix_lengths[order].astype(np.uint8),
+    )
+
+
+def _as_uint32_array(values):
+    values = np.asarray(values)
+    if values.dtype == np.uint32:
+        return values
+    if values.size and (values.min() < 0 or values.max() > MAX_UINT32):
+        raise ValueError("Invalid IPv4 address uint32")
+    return values.astype(np.uint32)
+
+
+def _as_prefix_array(prefix_lengths, count):
+    prefix_lengths = np.asarray(prefix_lengths)
+    if prefix_lengths.size and \
+            (prefix_lengths.min() < 0 or prefix_lengths.max() > 32):
+        raise ValueError("Prefix length has to be between 0 and 32")
+    return np.broadcast_to(prefix_lengths.astype(np.uint8), (count,)).copy()
+
+
+class AddressArray(object):
+    '''
+    Models a sequence of IPv4 addresses, held in a uint32 array.
+    '''
+
+    def __init__(self, uints=()):
+        self._uints = _as_uint32_array(uints).ravel()
+
+    @classmethod
+    def from_strings(clazz, strings):
+        strings = list(strings)
+        uints, valid = parse_dotted_quads(strings)
+        if not valid.all():
+            raise ValueError("Invalid IPv4 address: \"{0}\"".format(
+                strings[int(np.argmin(valid))]
+            ))
+        return clazz(uints)
+
+    @classmethod
+    def from_addresses(clazz, addresses):
+        return clazz(np.fromiter(
+            (int(address) for address in addresses), dtype=np.uint32
+        ))
+
+    @property
+    def uints(self):
+        return self._uints
+
+    def to_strings(self):
+        return format_dotted_quads(self._uints)
+
+    def mask(self, prefix_lengths):
+        '''
+        Returns the network addresses of these addresses for the given prefix
+        length(s). prefix_lengths is either a single int or an array with one
+        prefix length per address.
+        '''
+        prefix_lengths = _as_prefix_array(prefix_lengths, len(self))
+        return AddressArray(self._uints & NETMASKS[prefix_lengths])
+
+    def argsort(self):
+        return np.argsort(self._uints, kind='stable')
+
+    def sorted(self):
+        return AddressArray(np.sort(self._uints))
+
+    def __len__(self):
+        return len(self._uints)
+
+    def __iter__(self):
+        for address_uint in self._uints.tolist():
+            yield Address(address_uint)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return Address(int(self._uints[key]))
+        return AddressArray(self._uints[key])
+
+    def __repr__(self):
+        return "<{0} of {1} IPv4 addresses>".format(
+            self.__class__.__name__, len(self)
+        )
+
+
+class SubnetArray(object):
+    '''
+    Models a sequence of CIDR IPv4 subnets, held in uint32 arrays of network
+    and broadcast addresses and a uint8 array of prefix lengths.
+    '''
+
+    def __init__(self, networks=(), prefix_lengths=()):
+        networks = _as_uint32_array(networks).ravel()
+        self._prefix_lengths = _as_prefix_array(prefix_lengths, len(networks))
+        self._start = networks & NETMASKS[self._prefix_lengths]
+        self._end = self._start | HOSTMASKS[self._prefix_lengths]
+
+    @classmethod
+    def from_subnets(clazz, subnets):
+        subnets = list(subnets)
+        return clazz(
+            np.fromiter(
+                (int(sub.floor()) for sub in subnets), dtype=np.uint32,
+                count=len(subnets)
+            ),
+            np.fromiter(
+                (sub.prefix_length for sub in subnets), dtype=np.uint8,
+                count=len(subnets)
+            ),
+        )
+
+    @classmethod
+    def from_ranges(clazz, starts, ends):
+        '''
+        Builds a SubnetArray holding the minimal CIDR cover of every range
+        from starts[i] to ends[i], inclusive.
+        '''
+        _, networks, prefix_lengths = decompose_ranges(starts, ends)
+        return clazz(networks, prefix_lengths)
+
+    @classmethod
+    def from_strings(clazz, strings):
+        '''
+        Builds a SubnetArray out of "a.b.c.d/nn" strings
+        '''
+        strings = list(strings)
+        if strings and isinstance(strings[0], (bytes, bytearray)):
+            strings = [s.decode('ascii', 'replace') for s in strings]
+
+        split = np.char.partition(np.array(strings, dtype=str), '/')
+        if not len(split):
+            return clazz()
+
+        uints, valid = parse_dotted_quads(split[:, 0])
+        lengths = split[:, 2]
+        valid &= split[:, 1] == '/'
+        valid &= np.char.str_len(lengths) > 0
+        valid &= np.char.str_len(lengths) <= 2
+        valid &= np.char.isdecimal(lengths)
+        prefix_lengths = np.where(valid, lengths, '0').astype(np.uint8)
+        valid &= prefix_lengths <= 32
+
+        if not valid.all():
+            raise ValueError("Invalid IPv4 subnet: \"{0}\"".format(
+                strings[int(np.argmin(valid))]
+            ))
+        return clazz(uints, prefix_lengths)
+
+    @property
+    def start(self):
+        return self._start
+
+    @property
+    def end(self):
+        return self._end
+
+    @property
+    def prefix_lengths(self):
+        return self._prefix_lengths
+
+    def sizes(self):
+        return self._end.astype(np.uint64) - self._start + 1
+
+    def to_strings(self):
+        return [
+            "{0}/{1}".format(network, length) for network, length in zip(
+                format_dotted_quads(self._start),
+                self._prefix_lengths.tolist()
+            )
+        ]
+
+    def argsort(self):
+        '''
+        Indices that sort subnets by network address, then by prefix length.
+        '''
+        return np.lexsort((self._prefix_lengths, self._start))
+
+    def sorted(self):
+        return self[self.argsort()]
+
+    def locate(self, addresses):
+        '''
+        Returns, for each of the addresses, the index of the most specific
+        subnet that contains it, or -1 if no subnet does.
+        '''
+        if isinstance(addresses, AddressArray):
+            address_uints = addresses.uints
+        else:
+            address_uints = _as_uint32_array(addresses).ravel()
+
+        located = np.full(len(address_uints), -1, dtype=np.int64)
+        unresolved = np.ones(len(address_uints), dtype=bool)
+
+        # One exact-match pass per prefix length, from the longest down
+        for length in np.unique(self._prefix_lengths)[::-1]:
+            candidates = np.flatnonzero(self._prefix_lengths == length)
+            order = np.argsort(self._start[candidates], kind='stable')
+            candidates = candidates[order]
+            starts = self._start[candidates]
+
+            masked = address_uints & NETMASKS[length]
+            positions = np.searchsorted(starts, masked)
+            positions = np.minimum(positions, len(starts) - 1)
+            found = unresolved & (starts[positions] == masked)
+
+            located[found] = candidates[positions[found]]
+            unresolved &= ~found
+            if not unresolved.any():
+                break
+
+        return located
+
+    def contains(self, addresses):
+        '''
+        Returns a boolean array telling which of the addresses fall within at
+        least one of the subnets.
+        '''
+        return self.locate(addresses) >= 0
+
+    def __len__(self):
+        return len(self._start)
+
+    def __iter__(self):
+        for start, length in zip(
+                self._start.tolist(), self._prefix_lengths.tolist()):
+            yield Subnet(Address(start), length)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return Subnet(
+                Address(int(self._start[key])),
+                int(self._prefix_lengths[key])
+            )
+        return SubnetArray(self._start[key], self._prefix_lengths[key])
+
+    def __repr__(self):
+        return "<{0} of {1} IPv4 subnets>".format(
+            self.__class__.__name__, len(self)
+        )
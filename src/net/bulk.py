@@ -0,0 +1,187 @@
+'''
+Bulk parsing of newline-separated dotted quads.
+
+Addresses are returned as uint32 values packed in an array.array, so that
+hundreds of millions of them can be parsed without an Address instance (or
+even a Python int) per line. Input is processed one chunk at a time.
+'''
+
+from array import array
+from collections import namedtuple
+from itertools import islice, repeat
+from socket import inet_pton, AF_INET
+import sys
+
+CHUNK_SIZE = 1 << 20
+LINE_BATCH_SIZE = 1 << 16
+
+UINT32_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+
+BadLine = namedtuple('BadLine', ('line_number', 'line'))
+
+
+def _parse_line(line):
+    '''
+    Strict, line-at-a-time parser for the lines the fast path rejects. It
+    accepts the same dotted quads as Address, with surrounding whitespace.
+    Returns None for blank lines and raises ValueError for invalid ones.
+    '''
+    line = line.strip()
+    if not line:
+        return None
+
+    octets = line.split(b'.' if isinstance(line, bytes) else '.')
+    if 4 != len(octets):
+        raise ValueError
+    address_uint = 0
+    for octet in octets:
+        # We don't want int() to accept signs, whitespace or underscores
+        if not (octet.isdigit() and octet.isascii()):
+            raise ValueError
+        octet = int(octet)
+        if octet > 255:
+            raise ValueError
+        address_uint = (address_uint << 8) | octet
+    return address_uint
+
+
+def _parse_lines(lines, first_line_number, errors):
+    '''
+    Parses a list of lines (str or bytes, without line terminators) into an
+    array of uint32s.
+    '''
+    parsed = array(UINT32_TYPECODE)
+
+    # Fast path: inet_pton only accepts canonical dotted quads, and these mean
+    # the same thing to inet_pton and to Address
+    try:
+        if lines and isinstance(lines[0], bytes):
+            text_lines = b'\n'.join(lines).decode('ascii').split('\n')
+        else:
+            text_lines = lines
+        packed = b''.join(
+            map(inet_pton, repeat(AF_INET), filter(None, text_lines))
+        )
+    except (OSError, UnicodeDecodeError, TypeError):
+        pass
+    else:
+        parsed.frombytes(packed)
+        if sys.byteorder == 'little':
+            parsed.byteswap()
+        return parsed
+
+    # Slow path: at least one line in this batch is blank, has whitespace or
+    # leading zeros, or is invalid
+    for line_number, line in enumerate(lines, first_line_number):
+        try:
+            address_uint = _parse_line(line)
+        except ValueError:
+            if errors is None:
+                raise ValueError(
+                    "Invalid IPv4 address on line {0}: {1!r}".format(
+                        line_number, line
+                    )
+                )
+            errors.append(BadLine(line_number, line))
+        else:
+            if address_uint is not None:
+                parsed.append(address_uint)
+    return parsed
+
+
+def _line_batches_from_chunks(chunks):
+    '''
+    Splits a sequence of str or bytes chunks into lists of lines, carrying
+    partial lines over to the next chunk.
+    '''
+    remainder = None
+    for chunk in chunks:
+        if remainder:
+            chunk = remainder + chunk
+        newline = '\n' if isinstance(chunk, str) else b'\n'
+        last_newline = chunk.rfind(newline)
+        if last_newline < 0:
+            remainder = chunk
+            continue
+        remainder = chunk[last_newline + 1:]
+        complete_lines = chunk[:last_newline]
+        carriage_return = '\r' if isinstance(chunk, str) else b'\r'
+        if carriage_return in complete_lines:
+            complete_lines = complete_lines.replace(
+                carriage_return + newline, newline
+            )
+        yield complete_lines.split(newline)
+
+    if remainder:
+        yield [remainder]
+
+
+def _buffer_chunks(buf, chunk_size):
+    view = memoryview(buf).cast('B')
+    for offset in range(0, len(view), chunk_size):
+        yield bytes(view[offset:offset + chunk_size])
+
+
+def _file_chunks(file_obj, chunk_size):
+    while True:
+        chunk = file_obj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _line_batches_from_lines(lines):
+    lines = iter(lines)
+    while True:
+        batch = list(islice(lines, LINE_BATCH_SIZE))
+        if not batch:
+            break
+        yield list(map(type(batch[0]).rstrip, batch))
+
+
+def iter_address_arrays(source, errors=None, chunk_size=CHUNK_SIZE):
+    '''
+    Parses dotted quads, one per line, and yields arrays of uint32 addresses
+    as they're parsed.
+
+    source is a bytes, bytearray or memoryview object, a file object (opened
+    in binary or text mode) or mmap, or an iterable of lines as str or bytes.
+    Blank lines are skipped.
+
+    If errors is None, a ValueError is raised on the first invalid line.
+    Otherwise, errors should be a list, to which a BadLine is appended for
+    every invalid line.
+    '''
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        batches = _line_batches_from_chunks(
+            _buffer_chunks(source, chunk_size)
+        )
+    elif hasattr(source, 'read'):
+        batches = _line_batches_from_chunks(
+            _file_chunks(source, chunk_size)
+        )
+    else:
+        batches = _line_batches_from_lines(source)
+
+    line_number = 1
+    for lines in batches:
+        yield _parse_lines(lines, line_number, errors)
+        line_number += len(lines)
+
+
+def iter_addresses(source, errors=None, chunk_size=CHUNK_SIZE):
+    '''
+    Like iter_address_arrays, but yields individual uint32 addresses.
+    '''
+    for parsed in iter_address_arrays(source, errors, chunk_size):
+        yield from parsed
+
+
+def read_addresses(source, errors=None, chunk_size=CHUNK_SIZE):
+    '''
+    Like iter_address_arrays, but returns a single array of uint32 addresses.
+    '''
+    parsed = array(UINT32_TYPECODE)
+    for parsed_chunk in iter_address_arrays(source, errors, chunk_size):
+        parsed.extend(parsed_chunk)
+    return parsed
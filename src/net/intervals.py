@@ -0,0 +1,211 @@
+'''
+Sets of IPv4 addresses, stored as sorted and coalesced ranges of uint32s.
+'''
+
+from bisect import bisect_left, bisect_right
+from heapq import merge
+
+from .IPv4 import Address, Subnet, MAX_UINT32, range_to_subnets
+
+
+def _bounds(item):
+    '''
+    Returns the first and last uint32 of an Address, a Subnet, a uint32 or a
+    (first, last) pair of Addresses or uint32s.
+    '''
+    if isinstance(item, Subnet):
+        return item._floor_uint, item._ceiling_uint
+    if isinstance(item, (Address, int)):
+        item = int(item)
+        return item, item
+    first, last = item
+    first = int(first)
+    last = int(last)
+    if not 0 <= first <= last <= MAX_UINT32:
+        raise ValueError(
+            "Invalid address range: {0!r} to {1!r}".format(first, last)
+        )
+    return first, last
+
+
+def _coalesce(sorted_ranges):
+    '''
+    Merges overlapping or adjacent ranges in a sorted iterable of (first,
+    last) tuples, and returns the firsts and the lasts as two lists.
+    '''
+    firsts = []
+    lasts = []
+    for first, last in sorted_ranges:
+        if lasts and first <= lasts[-1] + 1:
+            if last > lasts[-1]:
+                lasts[-1] = last
+        else:
+            firsts.append(first)
+            lasts.append(last)
+    return firsts, lasts
+
+
+class IntervalSet(object):
+    '''
+    A set of IPv4 addresses. Adding, removing and testing membership of an
+    address, subnet or range takes O(log n) comparisons, where n is the number
+    of disjoint ranges in the set. Set operations between two IntervalSets are
+    a single linear merge.
+
+    Iterating over an IntervalSet yields its disjoint ranges as (first, last)
+    uint32 tuples, in ascending order. Its length is the number of ranges, see
+    address_count() for the number of addresses.
+    '''
+
+    __slots__ = ('_firsts', '_lasts')
+
+    def __init__(self, items=()):
+        '''
+        items is an iterable of Addresses, Subnets, uint32s or (first, last)
+        pairs, in any order.
+        '''
+        self._firsts, self._lasts = _coalesce(sorted(map(_bounds, items)))
+
+    @classmethod
+    def _from_lists(cls, firsts, lasts):
+        interval_set = cls.__new__(cls)
+        interval_set._firsts = firsts
+        interval_set._lasts = lasts
+        return interval_set
+
+    @classmethod
+    def _from_sorted(cls, sorted_ranges):
+        return cls._from_lists(*_coalesce(sorted_ranges))
+
+    def add(self, item):
+        '''
+        Adds an Address, Subnet, uint32 or (first, last) range to the set.
+        '''
+        first, last = _bounds(item)
+        firsts, lasts = self._firsts, self._lasts
+        # Ranges that overlap with or are adjacent to the new one are merged
+        low = bisect_left(lasts, first - 1)
+        high = bisect_right(firsts, last + 1)
+        if low < high:
+            first = min(first, firsts[low])
+            last = max(last, lasts[high - 1])
+        firsts[low:high] = [first]
+        lasts[low:high] = [last]
+
+    def discard(self, item):
+        '''
+        Removes an Address, Subnet, uint32 or (first, last) range from the set.
+        '''
+        first, last = _bounds(item)
+        firsts, lasts = self._firsts, self._lasts
+        low = bisect_left(lasts, first)
+        high = bisect_right(firsts, last)
+        if low >= high:
+            return
+        new_firsts = []
+        new_lasts = []
+        if firsts[low] < first:
+            new_firsts.append(firsts[low])
+            new_lasts.append(first - 1)
+        if lasts[high - 1] > last:
+            new_firsts.append(last + 1)
+            new_lasts.append(lasts[high - 1])
+        firsts[low:high] = new_firsts
+        lasts[low:high] = new_lasts
+
+    def overlaps(self, item):
+        '''
+        Whether any address of item is in the set.
+        '''
+        first, last = _bounds(item)
+        index = bisect_left(self._lasts, first)
+        return index < len(self._firsts) and self._firsts[index] <= last
+
+    def __contains__(self, item):
+        '''
+        Whether every address of item is in the set.
+        '''
+        first, last = _bounds(item)
+        index = bisect_right(self._firsts, first) - 1
+        return index >= 0 and self._lasts[index] >= last
+
+    def union(self, other):
+        return self._from_sorted(merge(self, other))
+
+    def intersection(self, other):
+        firsts = []
+        lasts = []
+        ranges = iter(other)
+        other_range = next(ranges, None)
+        for first, last in self:
+            while other_range is not None and other_range[0] <= last:
+                other_first, other_last = other_range
+                if other_last >= first:
+                    firsts.append(max(first, other_first))
+                    lasts.append(min(last, other_last))
+                if other_last > last:
+                    break
+                other_range = next(ranges, None)
+        return self._from_lists(firsts, lasts)
+
+    def complement(self):
+        firsts = []
+        lasts = []
+        next_first = 0
+        for first, last in self:
+            if first > next_first:
+                firsts.append(next_first)
+                lasts.append(first - 1)
+            next_first = last + 1
+        if next_first <= MAX_UINT32:
+            firsts.append(next_first)
+            lasts.append(MAX_UINT32)
+        return self._from_lists(firsts, lasts)
+
+    def difference(self, other):
+        return self.intersection(other.complement())
+
+    def symmetric_difference(self, other):
+        return self.union(other).difference(self.intersection(other))
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __xor__ = symmetric_difference
+    __invert__ = complement
+
+    def address_count(self):
+        '''
+        Returns the number of addresses in the set.
+        '''
+        return sum(self._lasts) - sum(self._firsts) + len(self._firsts)
+
+    def subnets(self):
+        '''
+        Iterates over the smallest set of CIDR subnets that exactly cover the
+        set, in ascending order.
+        '''
+        for first, last in self:
+            yield from range_to_subnets(first, last)
+
+    def copy(self):
+        return self._from_lists(list(self._firsts), list(self._lasts))
+
+    def __iter__(self):
+        return zip(self._firsts, self._lasts)
+
+    def __len__(self):
+        return len(self._firsts)
+
+    def __bool__(self):
+        return bool(self._firsts)
+
+    def __eq__(self, other):
+        if not isinstance(other, IntervalSet):
+            return NotImplemented
+        return self._firsts == other._firsts and self._lasts == other._lasts
+
+    def __repr__(self):
+        return "<IPv4 interval set: {0} ranges, {1} addresses>".format(
+            len(self), self.address_count()
+        )
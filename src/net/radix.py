@@ -0,0 +1,418 @@
+'''
+Path-compressed binary radix tree (a.k.a. Patricia trie) of IPv4 subnets.
+'''
+
+from array import array
+from bisect import bisect_right
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .IPv4 import Address, Subnet, MAX_UINT32, _NETMASKS, _HOSTMASKS
+
+
+class _RadixNode(object):
+    '''
+    A node in the tree. Nodes whose subnet is None are glue nodes: they only
+    exist because two or more subnets below them diverge at their prefix
+    length.
+    '''
+
+    __slots__ = (
+        'network', 'prefix_length', 'subnet', 'payload', 'zero', 'one'
+    )
+
+    def __init__(self, network, prefix_length, subnet=None, payload=None):
+        self.network = network
+        self.prefix_length = prefix_length
+        self.subnet = subnet
+        self.payload = payload
+        self.zero = None
+        self.one = None
+
+    def child(self, bit):
+        return self.one if bit else self.zero
+
+    def set_child(self, bit, node):
+        if bit:
+            self.one = node
+        else:
+            self.zero = node
+
+    def child_count(self):
+        return (self.zero is not None) + (self.one is not None)
+
+
+def _bit(uint, index):
+    '''
+    Returns bit number index of a uint32, counting from the most significant
+    bit.
+    '''
+    return (uint >> (31 - index)) & 1
+
+
+def _key(key):
+    '''
+    Returns the network uint32 and the prefix length for a Subnet, an Address
+    or a uint32. Addresses are treated as /32 subnets.
+    '''
+    if isinstance(key, Subnet):
+        return key._floor_uint, key._prefix_length
+    if isinstance(key, Address):
+        return key._uint, 32
+    if isinstance(key, int):
+        return int(Address(key)), 32
+    raise TypeError(
+        "Can't use {0} as a radix tree key".format(type(key).__name__)
+    )
+
+
+class RadixTree(object):
+    '''
+    Maps IPv4 subnets to arbitrary payloads and supports longest-prefix
+    matching. Lookups only visit the nodes where stored subnets branch off,
+    which is at most 33 nodes.
+
+    Longest-prefix matches for addresses are answered from a flat table of
+    non-overlapping address ranges once enough of them have been made since
+    the tree last changed, so that the table is only rebuilt when that pays
+    for itself.
+    '''
+
+    def __init__(self, items=()):
+        self._root = None
+        self._len = 0
+        # Start addresses of the ranges in the flat table, and the
+        # (subnet, payload) tuple for the most specific subnet containing each
+        # range (None if there isn't one)
+        self._range_starts = None
+        self._range_matches = None
+        self._range_arrays = None
+        self._stale_lookups = 0
+        for subnet, payload in items:
+            self.insert(subnet, payload)
+
+    def insert(self, subnet, payload=None):
+        '''
+        Adds subnet to the tree, replacing the payload if it's already there.
+        '''
+        if not isinstance(subnet, Subnet):
+            raise TypeError("Only subnets can be inserted in a radix tree")
+        network, length = _key(subnet)
+        self._invalidate()
+
+        parent = None
+        parent_bit = 0
+        node = self._root
+        common = 0
+        while node is not None:
+            common = min(
+                32 - (node.network ^ network).bit_length(),
+                node.prefix_length,
+                length
+            )
+            if common < node.prefix_length:
+                # This node isn't a supernet of the new subnet
+                break
+            if node.prefix_length == length:
+                if node.subnet is None:
+                    self._len += 1
+                node.subnet = subnet
+                node.payload = payload
+                return
+            parent = node
+            parent_bit = _bit(network, node.prefix_length)
+            node = node.child(parent_bit)
+
+        leaf = _RadixNode(network, length, subnet, payload)
+        self._len += 1
+
+        if node is None:
+            new_node = leaf
+        elif common == length:
+            # The new subnet is a supernet of the node
+            leaf.set_child(_bit(node.network, length), node)
+            new_node = leaf
+        else:
+            # The new subnet and the node diverge, glue them together
+            new_node = _RadixNode(network & _NETMASKS[common], common)
+            new_node.set_child(_bit(network, common), leaf)
+            new_node.set_child(_bit(node.network, common), node)
+
+        if parent is None:
+            self._root = new_node
+        else:
+            parent.set_child(parent_bit, new_node)
+
+    def _find(self, network, length):
+        '''
+        Returns the path of (node, bit) pairs from the root to the node with
+        exactly the given network and prefix length, or None.
+        '''
+        path = []
+        node = self._root
+        while node is not None:
+            node_length = node.prefix_length
+            if node_length > length or \
+                    (network & _NETMASKS[node_length]) != node.network:
+                return None
+            if node_length == length:
+                path.append((node, None))
+                return path
+            bit = _bit(network, node_length)
+            path.append((node, bit))
+            node = node.child(bit)
+        return None
+
+    def delete(self, subnet):
+        '''
+        Removes subnet from the tree. Raises KeyError if it's not there.
+        '''
+        path = self._find(*_key(subnet))
+        if not path or path[-1][0].subnet is None:
+            raise KeyError(subnet)
+
+        self._invalidate()
+        node, _ = path.pop()
+        node.subnet = None
+        node.payload = None
+        self._len -= 1
+
+        # Prune the node and its parent if they're no longer needed
+        while node is not None and node.subnet is None and \
+                node.child_count() < 2:
+            replacement = node.zero if node.zero is not None else node.one
+            if path:
+                parent, bit = path.pop()
+                parent.set_child(bit, replacement)
+                if replacement is not None:
+                    break
+                node = parent
+            else:
+                self._root = replacement
+                break
+
+    def _invalidate(self):
+        self._range_starts = None
+        self._range_matches = None
+        self._range_arrays = None
+        self._stale_lookups = 0
+
+    def _build_ranges(self):
+        '''
+        Flattens the tree into a sorted list of address ranges, each mapped to
+        the most specific node that contains it.
+        '''
+        starts = [0]
+        nodes = [None]
+
+        def add_range(start, node):
+            if starts and starts[-1] == start:
+                nodes[-1] = node
+                if len(nodes) > 1 and nodes[-2] is node:
+                    starts.pop()
+                    nodes.pop()
+            elif not nodes or nodes[-1] is not node:
+                starts.append(start)
+                nodes.append(node)
+
+        # Nodes containing the current address, least specific first
+        enclosing = []
+        for node in self._nodes():
+            while enclosing and enclosing[-1][1] < node.network:
+                _, ceiling = enclosing.pop()
+                add_range(
+                    ceiling + 1, enclosing[-1][0] if enclosing else None
+                )
+            add_range(node.network, node)
+            enclosing.append(
+                (node, node.network | _HOSTMASKS[node.prefix_length])
+            )
+        while enclosing:
+            _, ceiling = enclosing.pop()
+            if ceiling < MAX_UINT32:
+                add_range(
+                    ceiling + 1, enclosing[-1][0] if enclosing else None
+                )
+
+        self._range_starts = starts
+        self._range_matches = [
+            None if node is None else (node.subnet, node.payload)
+            for node in nodes
+        ]
+
+    def build(self):
+        '''
+        Builds the flat table of address ranges now, rather than when enough
+        lookups have been made. Until the tree changes again, lookups don't
+        modify it, so a built tree can be shared by threads.
+        '''
+        if self._range_starts is None:
+            self._build_ranges()
+        if numpy is not None and self._range_arrays is None:
+            match_array = numpy.empty(len(self._range_matches), dtype=object)
+            match_array[:] = self._range_matches
+            self._range_arrays = (
+                numpy.array(self._range_starts, dtype=numpy.uint32),
+                match_array,
+            )
+
+    def longest_match(self, key):
+        '''
+        Returns a (subnet, payload) tuple for the most specific subnet in the
+        tree that contains key, which can be a Subnet or an Address. Raises
+        KeyError if there's no such subnet.
+        '''
+        network, length = _key(key)
+
+        if 32 == length:
+            if self._range_starts is None:
+                self._stale_lookups += 1
+                if self._stale_lookups > (self._len >> 4) + 16:
+                    self._build_ranges()
+            if self._range_starts is not None:
+                match = self._range_matches[
+                    bisect_right(self._range_starts, network) - 1
+                ]
+                if match is None:
+                    raise KeyError(key)
+                return match
+
+        best = None
+        node = self._root
+        while node is not None:
+            node_length = node.prefix_length
+            if node_length > length or \
+                    (network & _NETMASKS[node_length]) != node.network:
+                break
+            if node.subnet is not None:
+                best = node
+            if node_length == 32:
+                break
+            if (network >> (31 - node_length)) & 1:
+                node = node.one
+            else:
+                node = node.zero
+
+        if best is None:
+            raise KeyError(key)
+        return best.subnet, best.payload
+
+    def longest_matches(self, addresses):
+        '''
+        Finds the longest-prefix match for many addresses at once. addresses
+        is an AddressArray, an array of uint32s or an iterable of Address
+        instances or uint32s. Returns a list with a (subnet, payload) tuple,
+        or None, for every address.
+        '''
+        self.build()
+
+        addresses = getattr(addresses, 'uints', addresses)
+        if numpy is None:
+            starts = self._range_starts
+            matches = self._range_matches
+            return [
+                matches[bisect_right(starts, int(address)) - 1]
+                for address in addresses
+            ]
+
+        if not isinstance(addresses, (numpy.ndarray, array)):
+            addresses = [int(address) for address in addresses]
+        start_array, match_array = self._range_arrays
+        indices = numpy.searchsorted(
+            start_array, numpy.asarray(addresses, dtype=numpy.uint32),
+            side='right'
+        ) - 1
+        return match_array[indices].tolist()
+
+    def covering(self, key):
+        '''
+        Iterates over (subnet, payload) tuples for every subnet in the tree
+        that contains key, from the least specific to the most specific.
+        '''
+        network, length = _key(key)
+        node = self._root
+        while node is not None:
+            node_length = node.prefix_length
+            if node_length > length or \
+                    (network & _NETMASKS[node_length]) != node.network:
+                break
+            if node.subnet is not None:
+                yield node.subnet, node.payload
+            if node_length == 32:
+                break
+            node = node.child(_bit(network, node_length))
+
+    def subtree(self, key=None):
+        '''
+        Iterates over (subnet, payload) tuples for every subnet in the tree
+        that's contained in key (all subnets if key is None), ordered by
+        network address, then prefix length.
+        '''
+        if key is None:
+            node = self._root
+        else:
+            network, length = _key(key)
+            node = self._root
+            # Find the topmost node within key
+            while node is not None and node.prefix_length < length:
+                if (network & _NETMASKS[node.prefix_length]) != node.network:
+                    return
+                node = node.child(_bit(network, node.prefix_length))
+            if node is None or \
+                    (node.network & _NETMASKS[length]) != network:
+                return
+
+        for node in self._nodes(node):
+            yield node.subnet, node.payload
+
+    def _nodes(self, node=None):
+        '''
+        Iterates over the non-glue nodes under node (or the root) in
+        pre-order, which is the same as ordering them by network address, then
+        prefix length.
+        '''
+        if node is None:
+            node = self._root
+        stack = [node] if node is not None else []
+        while stack:
+            node = stack.pop()
+            if node.subnet is not None:
+                yield node
+            if node.one is not None:
+                stack.append(node.one)
+            if node.zero is not None:
+                stack.append(node.zero)
+
+    def items(self):
+        return self.subtree()
+
+    def __iter__(self):
+        for subnet, _ in self.subtree():
+            yield subnet
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, subnet):
+        path = self._find(*_key(subnet))
+        return bool(path) and path[-1][0].subnet is not None
+
+    def __getitem__(self, subnet):
+        path = self._find(*_key(subnet))
+        if not path or path[-1][0].subnet is None:
+            raise KeyError(subnet)
+        return path[-1][0].payload
+
+    def __setitem__(self, subnet, payload):
+        self.insert(subnet, payload)
+
+    def __delitem__(self, subnet):
+        self.delete(subnet)
+
+    def __repr__(self):
+        return "<{0} of {1} IPv4 subnets>".format(
+            self.__class__.__name__, len(self)
+        )
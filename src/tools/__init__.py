@@ -5,7 +5,8 @@ COMMAND_REGISTRY = {}
 
 def register():
     # TODO Make this dynamic, somehow
-    for mod in ('mapper', 'stats', 'version', 'link'):
+    for mod in ('mapper', 'stats', 'version', 'link', 'gaps', 'export',
+                'delegated', 'rpsl'):
         importlib.import_module('.' + mod, package=__name__)
 
 
@@ -0,0 +1,50 @@
+from . import Command, CLI_subcmd
+from ..metadata.delegated import (
+    open_delegated, iter_delegated_IPv4, delegated_rows
+)
+from ..metadata.orm import DataManager
+
+
+@CLI_subcmd('import-delegated')
+class ImportDelegatedCmd(Command):
+    '''
+    Imports the IPv4 space listed in RIR delegated statistics files
+    '''
+
+    @classmethod
+    def configure_parser(clazz, parser):
+        parser.add_argument(
+            'paths',
+            type=str,
+            nargs='+',
+            metavar='path',
+            help='A delegated-<registry>-extended-latest file, optionally '
+            'compressed with gzip or bzip2',
+        )
+        parser.add_argument(
+            '-b', '--batch-size',
+            type=int,
+            default=10000,
+            help='Write this many subnets to the database at a time',
+        )
+
+    def __init__(self):
+        self.data_mgr = None
+
+    def run(self, arg_ns):
+        self.data_mgr = DataManager()
+
+        total = 0
+        for path in arg_ns.paths:
+            with open_delegated(path) as delegated_file:
+                subnet_count = self.data_mgr.bulk_upsert(
+                    delegated_rows(iter_delegated_IPv4(delegated_file)),
+                    batch_size=arg_ns.batch_size
+                )
+            print("{0}: {1} subnets".format(path, subnet_count))
+            total += subnet_count
+
+        print(
+            "\n{0} subnets imported. Run 'vast map --local-first' to name "
+            "them with RDAP.".format(total)
+        )
@@ -0,0 +1,55 @@
+import sys
+
+from . import Command, CLI_subcmd
+from ..metadata.assigned import AssignedSubnet
+from ..metadata.orm import DataManager
+from ..net.IPv4 import collapse_ranges
+
+
+@CLI_subcmd('export')
+class ExportCmd(Command):
+    '''
+    Exports assigned subnets in CIDR notation, one per line
+    '''
+
+    @classmethod
+    def configure_parser(clazz, parser):
+        parser.add_argument(
+            '-a', '--aggregate',
+            action='store_true',
+            help='Export the smallest set of subnets covering the same '
+            'addresses, merging adjacent and nested subnets',
+        )
+        parser.add_argument(
+            '-o', '--output',
+            type=str,
+            default=None,
+            help='Write to this file instead of stdout',
+        )
+
+    def __init__(self):
+        self.data_mgr = None
+
+    def run(self, arg_ns):
+        self.data_mgr = DataManager()
+
+        if arg_ns.aggregate:
+            subnets = collapse_ranges(self.data_mgr.address_ranges())
+        else:
+            subnets = self.data_mgr.all_records().order_by(
+                AssignedSubnet.mapped_network,
+                AssignedSubnet.mapped_prefix_length,
+            )
+
+        if arg_ns.output is None:
+            self._write(subnets, sys.stdout)
+        else:
+            with open(arg_ns.output, 'w') as output_file:
+                self._write(subnets, output_file)
+
+    @staticmethod
+    def _write(subnets, output_file):
+        for subnet in subnets:
+            output_file.write(
+                "{0}/{1}\n".format(subnet.network, subnet.prefix_length)
+            )
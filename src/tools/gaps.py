@@ -0,0 +1,63 @@
+from . import Command, CLI_subcmd
+from ..metadata.orm import DataManager
+from ..metadata.gaps import GapFinder
+from ..metadata.IANA_IPv4_assignments import populate_IANA_IPv4_assignments
+
+
+@CLI_subcmd('gaps')
+class GapsCmd(Command):
+    '''
+    Lists allocated IPv4 address ranges that haven't been mapped yet
+    '''
+
+    @classmethod
+    def configure_parser(clazz, parser):
+        parser.add_argument(
+            '-r', '--by-registry',
+            action='store_true',
+            help='Group unmapped ranges by regional registry',
+        )
+        parser.add_argument(
+            '-s', '--by-size',
+            action='store_true',
+            help='List the largest unmapped ranges first',
+        )
+
+    def __init__(self):
+        self.data_mgr = None
+        self.finder = None
+
+    def run(self, arg_ns):
+        self.data_mgr = DataManager()
+        self.finder = GapFinder(
+            self.data_mgr, populate_IANA_IPv4_assignments()
+        )
+
+        gaps = self.finder.gaps(
+            by_registry=arg_ns.by_registry, by_size=arg_ns.by_size
+        )
+        if arg_ns.by_registry:
+            self._print_gaps_by_registry(gaps)
+        else:
+            self._print_gaps(gaps)
+
+    def _print_gaps(self, gaps):
+        gap_count = 0
+        total_size = 0
+        for gap in gaps:
+            print("{0:<33} {1:>10} addresses".format(str(gap), gap.size))
+            gap_count += 1
+            total_size += gap.size
+        print("\n{0} unmapped ranges, {1} IPv4 addresses".format(
+            gap_count, total_size
+        ))
+
+    def _print_gaps_by_registry(self, gaps):
+        registry_gaps = {}
+        for gap in gaps:
+            registry_gaps.setdefault(gap.registry, []).append(gap)
+
+        for registry in sorted(registry_gaps, key=str):
+            print("{0}:".format(registry))
+            self._print_gaps(registry_gaps[registry])
+            print()
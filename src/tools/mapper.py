@@ -1,6 +1,11 @@
 from . import Command, CLI_subcmd
+from .. import RDAP_CACHE_PATH, FAILURE_CACHE_PATH, REDIRECT_MAP_PATH
+from ..metadata.failures import FailureCache
+from ..metadata.http_cache import RDAPCache
+from ..metadata.redirects import RedirectMap, WhoisReferralMap
 from ..metadata.orm import DataManager
 from ..metadata.mapper import SubnetMapper
+from ..metadata.RDAP_bootstrap import populate_RDAP_bootstrap
 from ..net.IPv4 import Address
 
 
@@ -17,6 +22,52 @@ class MapCmd(Command):
             type=str,
             help='Start scanning from this IPv4 address',
         )
+        parser.add_argument(
+            '-e', '--end',
+            type=str,
+            default=None,
+            help='Stop scanning after this IPv4 address',
+        )
+        parser.add_argument(
+            '-w', '--workers',
+            type=int,
+            default=1,
+            help='Map each allocated /8 separately, using this many '
+            'concurrent workers',
+        )
+        parser.add_argument(
+            '--async',
+            dest='async_io',
+            action='store_true',
+            help='Run the --workers concurrent scans in a single thread with '
+            'asyncio, so that more RDAP queries can be in flight at once',
+        )
+        parser.add_argument(
+            '-n', '--no-cache',
+            action='store_true',
+            help="Don't use or update the on-disk caches of RDAP responses, "
+            "RDAP redirects, whois referrals and past failures",
+        )
+        parser.add_argument(
+            '-l', '--local-first',
+            action='store_true',
+            help='Use assignments that are already in the database instead '
+            'of querying registries for them',
+        )
+        parser.add_argument(
+            '-a', '--max-age',
+            type=float,
+            default=None,
+            help='With --local-first, query registries again for '
+            'assignments fetched more than this many days ago',
+        )
+        parser.add_argument(
+            '-t', '--cache-ttl',
+            type=float,
+            default=RDAPCache.DEFAULT_TTL / 86400,
+            help='Revalidate cached RDAP responses older than this many '
+            'days',
+        )
 
     def __init__(self):
         self.data_mgr = None
@@ -24,7 +75,35 @@ class MapCmd(Command):
 
     def run(self, arg_ns):
         self.data_mgr = DataManager()
-        self.mapper = SubnetMapper(self.data_mgr)
+        rdap_cache = failure_cache = redirect_map = whois_referrals = None
+        if not arg_ns.no_cache:
+            rdap_cache = RDAPCache(
+                RDAP_CACHE_PATH, ttl=arg_ns.cache_ttl * 86400
+            )
+            failure_cache = FailureCache(FAILURE_CACHE_PATH)
+            redirect_map = RedirectMap(REDIRECT_MAP_PATH)
+            whois_referrals = WhoisReferralMap(REDIRECT_MAP_PATH)
+        max_age = None
+        if arg_ns.max_age is not None:
+            max_age = arg_ns.max_age * 86400
+        self.mapper = SubnetMapper(
+            self.data_mgr, rdap_cache, failure_cache,
+            local_first=arg_ns.local_first, max_age=max_age,
+            redirect_map=redirect_map, whois_referrals=whois_referrals,
+            rdap_bootstrap=populate_RDAP_bootstrap()
+        )
 
         start_address = Address(arg_ns.start)
-        self.mapper.scan_up(start_address)
+        end_address = None
+        if arg_ns.end is not None:
+            end_address = Address(arg_ns.end)
+        if arg_ns.async_io:
+            self.mapper.map_async(
+                start_address, end_address, scans=arg_ns.workers
+            )
+        elif arg_ns.workers > 1:
+            self.mapper.map_parallel(
+                start_address, end_address, workers=arg_ns.workers
+            )
+        else:
+            self.mapper.scan_up(start_address, end_address)
@@ -0,0 +1,45 @@
+from . import Command, CLI_subcmd
+from ..metadata.rpsl import open_RPSL_dump, iter_RPSL_objects, inetnum_rows
+from ..metadata.orm import DataManager
+
+
+@CLI_subcmd('import-rpsl')
+class ImportRPSLCmd(Command):
+    '''
+    Imports the inetnum objects in RPSL database dumps
+    '''
+
+    @classmethod
+    def configure_parser(clazz, parser):
+        parser.add_argument(
+            'paths',
+            type=str,
+            nargs='+',
+            metavar='path',
+            help='An RPSL dump, e.g. ripe.db.inetnum.gz, optionally '
+            'compressed with gzip',
+        )
+        parser.add_argument(
+            '-b', '--batch-size',
+            type=int,
+            default=50000,
+            help='Write this many subnets to the database at a time',
+        )
+
+    def __init__(self):
+        self.data_mgr = None
+
+    def run(self, arg_ns):
+        self.data_mgr = DataManager()
+
+        total = 0
+        for path in arg_ns.paths:
+            with open_RPSL_dump(path) as dump:
+                objects = iter_RPSL_objects(dump, object_classes=('inetnum',))
+                subnet_count = self.data_mgr.bulk_upsert(
+                    inetnum_rows(objects), batch_size=arg_ns.batch_size
+                )
+            print("{0}: {1} subnets".format(path, subnet_count))
+            total += subnet_count
+
+        print("\n{0} subnets imported".format(total))
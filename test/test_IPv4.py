@@ -1,6 +1,11 @@
 from unittest import TestCase
+import pickle
+import random
 
-from src.net.IPv4 import Address, Subnet
+from src.net.IPv4 import (
+    Address, Subnet, address_range, range_to_subnets, collapse_ranges,
+    collapse_subnets
+)
 
 class test_IPv4_Address(TestCase):
 
@@ -166,6 +171,21 @@ class test_IPv4_Address(TestCase):
             a += 10**12
         self.assertEqual(Address("192.168.1.1"), a)
 
+    def test_immutable(self):
+        a = Address(self.unicast_str)
+        with self.assertRaises(AttributeError):
+            a._uint = 0
+        with self.assertRaises(AttributeError):
+            a.foo = 0
+        self.assertFalse(hasattr(a, '__dict__'))
+        self.assertEqual(self.unicast_uint, int(a))
+
+    def test_pickle(self):
+        a = Address(self.unicast_str)
+        b = pickle.loads(pickle.dumps(a))
+        self.assertEqual(a, b)
+        self.assertFalse(a is b)
+
 class test_IPv4_subnet(TestCase):
     net_address_bytes = (192, 168, 1, 1)
     broadcast_address_bytes = (192, 168, 255, 255)
@@ -300,6 +320,51 @@ class test_IPv4_subnet(TestCase):
         self.assertIn(t, s)
         self.assertNotIn(s, t)
 
+    def test_inclusion_edges(self):
+        whole = Subnet(Address(0), 0)
+        self.assertIn(Address(0), whole)
+        self.assertIn(Address([255, 255, 255, 255]), whole)
+        self.assertIn(Subnet(Address([255, 255, 255, 255]), 32), whole)
+        self.assertEqual(2 ** 32, len(whole))
+
+        host = Subnet(Address([10, 0, 0, 1]), 32)
+        self.assertIn(Address([10, 0, 0, 1]), host)
+        self.assertNotIn(Address([10, 0, 0, 2]), host)
+        self.assertEqual(1, len(host))
+
+    def test_slots(self):
+        s = Subnet(Address([10, 0, 0, 0]), 8)
+        self.assertFalse(hasattr(s, '__dict__'))
+
+    def test_immutable(self):
+        s = Subnet(Address([10, 0, 0, 0]), 8)
+        for name in ('_network', '_prefix_length', '_floor_uint', '_ceiling_uint'):
+            with self.assertRaises(AttributeError):
+                setattr(s, name, 0)
+        with self.assertRaises(AttributeError):
+            s.foo = 0
+        self.assertEqual(Subnet(Address([10, 0, 0, 0]), 8), s)
+        self.assertEqual(Address([10, 255, 255, 255]), s.ceiling())
+
+    def test_pickle(self):
+        s = Subnet(Address([10, 1, 0, 0]), 16)
+        t = pickle.loads(pickle.dumps(s))
+        self.assertEqual(s, t)
+        self.assertEqual(hash(s), hash(t))
+        self.assertEqual(s.ceiling(), t.ceiling())
+
+    def test_hash_distinguishes_prefix_lengths(self):
+        a = Address([10, 0, 0, 0])
+        subnets = set(Subnet(a, length) for length in range(8, 33))
+        self.assertEqual(25, len(subnets))
+        self.assertEqual(hash(Subnet(a, 8)), hash(Subnet(a, 8)))
+
+    def test_floor_is_shared(self):
+        a = Address([10, 0, 0, 0])
+        self.assertTrue(Subnet(a, 8).floor() is a)
+        s = Subnet(Address([10, 1, 2, 3]), 8)
+        self.assertEqual(a, s.floor())
+
     def test_contains_bad_type(self):
         a=Address([192,168,42,0])
         s=Subnet(a, 24)
@@ -327,3 +392,230 @@ class test_IPv4_subnet(TestCase):
         with self.assertRaises(ValueError) as ex:
             s >> 9
         self.assertEqual("Prefix length has to be between 0 and 32", str(ex.exception))
+
+    def test_addresses(self):
+        s = Subnet(Address([192, 168, 42, 0]), 30)
+        self.assertEqual(
+            [Address([192, 168, 42, i]) for i in range(4)],
+            list(s.addresses())
+        )
+
+        whole = Subnet(Address(0), 0)
+        first_three = [a for a, _ in zip(whole.addresses(), range(3))]
+        self.assertEqual([Address(0), Address(1), Address(2)], first_three)
+
+    def test_hosts(self):
+        s = Subnet(Address([192, 168, 42, 0]), 29)
+        self.assertEqual(
+            [Address([192, 168, 42, i]) for i in range(1, 7)],
+            list(s.hosts())
+        )
+
+        point_to_point = Subnet(Address([192, 168, 42, 0]), 31)
+        self.assertEqual(
+            [Address([192, 168, 42, 0]), Address([192, 168, 42, 1])],
+            list(point_to_point.hosts())
+        )
+
+        host = Subnet(Address([192, 168, 42, 7]), 32)
+        self.assertEqual([Address([192, 168, 42, 7])], list(host.hosts()))
+
+    def test_subnets(self):
+        s = Subnet(Address([192, 168, 42, 0]), 24)
+        self.assertEqual(
+            [
+                Subnet(Address([192, 168, 42, 0]), 26),
+                Subnet(Address([192, 168, 42, 64]), 26),
+                Subnet(Address([192, 168, 42, 128]), 26),
+                Subnet(Address([192, 168, 42, 192]), 26),
+            ],
+            list(s.subnets(26))
+        )
+        self.assertEqual([s], list(s.subnets(24)))
+        self.assertEqual(256, sum(1 for _ in s.subnets(32)))
+
+        ten_dot = Subnet(Address([10, 0, 0, 0]), 8)
+        slash_24s = ten_dot.subnets(24)
+        self.assertEqual(Subnet(Address([10, 0, 0, 0]), 24), next(slash_24s))
+        self.assertEqual(Subnet(Address([10, 0, 1, 0]), 24), next(slash_24s))
+
+        last = Subnet(Address([255, 255, 255, 255]), 31)
+        self.assertEqual(
+            [Subnet(Address([255, 255, 255, 254]), 32), Subnet(Address([255, 255, 255, 255]), 32)],
+            list(last.subnets(32))
+        )
+
+        with self.assertRaises(ValueError) as ex:
+            list(s.subnets(23))
+        self.assertEqual("Prefix length has to be between 24 and 32", str(ex.exception))
+        with self.assertRaises(ValueError):
+            list(s.subnets(33))
+
+    def test_subnets_are_well_formed(self):
+        for sub in Subnet(Address([10, 0, 0, 0]), 28).subnets(30):
+            self.assertEqual(sub, Subnet(sub.network, 30))
+            self.assertEqual(hash(sub), hash(Subnet(sub.network, 30)))
+            self.assertEqual(sub.ceiling(), Subnet(sub.network, 30).ceiling())
+
+    def test_supernet(self):
+        s = Subnet(Address([192, 168, 42, 0]), 24)
+        self.assertEqual(Subnet(Address([192, 168, 42, 0]), 23), s.supernet())
+        self.assertEqual(Subnet(Address([192, 0, 0, 0]), 8), s.supernet(8))
+        self.assertEqual(s, s.supernet(24))
+        self.assertIn(s, Subnet(Address([192, 168, 43, 0]), 24).supernet())
+
+        with self.assertRaises(ValueError) as ex:
+            s.supernet(25)
+        self.assertEqual("Prefix length has to be between 0 and 24", str(ex.exception))
+        with self.assertRaises(ValueError):
+            Subnet(Address(0), 0).supernet()
+
+    def test_supernets(self):
+        s = Subnet(Address([192, 168, 42, 0]), 24)
+        supernets = list(s.supernets())
+        self.assertEqual(24, len(supernets))
+        self.assertEqual(Subnet(Address([192, 168, 42, 0]), 23), supernets[0])
+        self.assertEqual(Subnet(Address(0), 0), supernets[-1])
+        self.assertTrue(all(s in sup for sup in supernets))
+        self.assertEqual([], list(Subnet(Address(0), 0).supernets()))
+
+class test_IPv4_address_range(TestCase):
+
+    def test_range(self):
+        self.assertEqual(
+            [
+                Address([10, 0, 0, 255]),
+                Address([10, 0, 1, 0]),
+                Address([10, 0, 1, 1]),
+            ],
+            list(address_range(Address([10, 0, 0, 255]), Address([10, 0, 1, 1])))
+        )
+
+    def test_single_and_empty_range(self):
+        a = Address([10, 0, 0, 1])
+        self.assertEqual([a], list(address_range(a, a)))
+        self.assertEqual([], list(address_range(a, a + (-1))))
+
+    def test_uint_bounds(self):
+        self.assertEqual(
+            [Address(4294967294), Address(4294967295)],
+            list(address_range(4294967294, 4294967295))
+        )
+
+class test_IPv4_range_to_subnets(TestCase):
+
+    def test_aligned_range(self):
+        self.assertEqual(
+            [Subnet(Address('10.0.0.0'), 8)],
+            list(range_to_subnets(Address('10.0.0.0'), Address('10.255.255.255')))
+        )
+
+    def test_misaligned_range(self):
+        self.assertEqual(
+            [Subnet(Address('1.2.3.0'), 24), Subnet(Address('1.2.4.0'), 23)],
+            list(range_to_subnets(Address('1.2.3.0'), Address('1.2.5.255')))
+        )
+        self.assertEqual(
+            [
+                Subnet(Address('10.0.0.1'), 32),
+                Subnet(Address('10.0.0.2'), 31),
+                Subnet(Address('10.0.0.4'), 30),
+                Subnet(Address('10.0.0.8'), 32),
+            ],
+            list(range_to_subnets(Address('10.0.0.1'), Address('10.0.0.8')))
+        )
+
+    def test_whole_and_almost_whole_address_space(self):
+        self.assertEqual(
+            [Subnet(Address(0), 0)],
+            list(range_to_subnets(0, 2 ** 32 - 1))
+        )
+        almost_whole = list(range_to_subnets(1, 2 ** 32 - 2))
+        self.assertEqual(62, len(almost_whole))
+        self.assertEqual(2 ** 32 - 2, sum(len(s) for s in almost_whole))
+
+    def test_single_address(self):
+        a = Address('192.168.1.1')
+        self.assertEqual([Subnet(a, 32)], list(range_to_subnets(a, a)))
+
+    def test_exact_cover(self):
+        first, last = Address('10.11.12.13'), Address('10.200.0.7')
+        subnets = list(range_to_subnets(first, last))
+        self.assertEqual(first, subnets[0].floor())
+        self.assertEqual(last, subnets[-1].ceiling())
+        for lower, upper in zip(subnets, subnets[1:]):
+            self.assertEqual(lower.ceiling() + 1, upper.floor())
+
+    def test_reversed_range(self):
+        with self.assertRaises(ValueError) as ex:
+            list(range_to_subnets(Address('10.0.0.1'), Address('10.0.0.0')))
+        self.assertEqual(
+            "Range start 10.0.0.1 is after range end 10.0.0.0",
+            str(ex.exception)
+        )
+
+class test_IPv4_collapse(TestCase):
+
+    @staticmethod
+    def _subnets(*cidrs):
+        return [Subnet(Address(c.split('/')[0]), int(c.split('/')[1])) for c in cidrs]
+
+    def test_adjacent(self):
+        self.assertEqual(
+            self._subnets('10.0.0.0/7'),
+            list(collapse_subnets(self._subnets(
+                '10.0.0.0/9', '10.128.0.0/9', '11.0.0.0/8'
+            )))
+        )
+
+    def test_nested_and_overlapping(self):
+        self.assertEqual(
+            self._subnets('10.0.0.0/8', '12.0.0.0/24', '12.0.1.0/32'),
+            list(collapse_subnets(self._subnets(
+                '10.0.0.0/8', '10.0.0.0/16', '10.1.2.0/24', '10.255.255.255/32',
+                '12.0.0.0/25', '12.0.0.0/24', '12.0.0.128/25', '12.0.1.0/32'
+            )))
+        )
+
+    def test_unaligned_run(self):
+        # 10.0.1.0/24 and 10.0.2.0/24 are adjacent but not siblings
+        self.assertEqual(
+            self._subnets('10.0.1.0/24', '10.0.2.0/24'),
+            list(collapse_subnets(self._subnets('10.0.1.0/24', '10.0.2.0/24')))
+        )
+
+    def test_whole_space(self):
+        self.assertEqual(
+            self._subnets('0.0.0.0/0'),
+            list(collapse_ranges([(0, 2 ** 31 - 1), (2 ** 31, 2 ** 32 - 1)]))
+        )
+
+    def test_empty(self):
+        self.assertEqual([], list(collapse_subnets([])))
+
+    def test_unsorted(self):
+        with self.assertRaises(ValueError) as ex:
+            list(collapse_subnets(self._subnets('11.0.0.0/8', '10.0.0.0/8')))
+        self.assertEqual(
+            "Ranges aren't sorted: 10.0.0.0 comes after 11.0.0.0",
+            str(ex.exception)
+        )
+
+    def test_covers_same_addresses(self):
+        rng = random.Random(5)
+        subnets = sorted(
+            (Subnet(Address(rng.getrandbits(12) << 20), rng.randint(4, 16))
+             for _ in range(200)),
+            key=lambda s: (s.floor(), s.prefix_length)
+        )
+        collapsed = list(collapse_subnets(subnets))
+        self.assertLessEqual(len(collapsed), len(subnets))
+        for probe in range(0, 2 ** 32, 2 ** 20):
+            address = Address(probe)
+            self.assertEqual(
+                any(address in s for s in subnets),
+                any(address in s for s in collapsed)
+            )
+        # No two output subnets could be merged
+        for lower, upper in zip(collapsed, collapsed[1:]):
+            self.assertLess(lower.ceiling(), upper.floor())
@@ -0,0 +1,245 @@
+from unittest import TestCase
+
+import numpy as np
+
+from src.net.IPv4 import Address, Subnet, range_to_subnets
+from src.net.arrays import (
+    AddressArray, SubnetArray, parse_dotted_quads, format_dotted_quads,
+    decompose_ranges
+)
+
+class test_parse_dotted_quads(TestCase):
+
+    def test_valid_strings(self):
+        uints, valid = parse_dotted_quads(
+            ['1.2.3.4', '0.0.0.0', '255.255.255.255', '010.0.0.1']
+        )
+        self.assertEqual([16909060, 0, 4294967295, 167772161], uints.tolist())
+        self.assertTrue(valid.all())
+        self.assertEqual(np.uint32, uints.dtype)
+
+    def test_valid_bytes(self):
+        uints, valid = parse_dotted_quads([b'1.2.3.4', b'192.168.1.1'])
+        self.assertEqual([16909060, 3232235777], uints.tolist())
+        self.assertTrue(valid.all())
+
+    def test_invalid_strings(self):
+        invalid = [
+            '', '1.2.3', '1.2.3.4.5', 'a.b.c.d', '256.0.0.0', '1..2.3',
+            '1.2.3.4 ', ' 1.2.3.4', '1.2.3.', '.1.2.3', '1.2.3.4' + 20 * '0',
+        ]
+        uints, valid = parse_dotted_quads(invalid)
+        self.assertFalse(valid.any())
+        self.assertEqual(len(invalid) * [0], uints.tolist())
+
+    def test_same_strings_as_address(self):
+        candidates = [
+            '1.2.3.4', '0001.2.3.4', '1.2.3.0255', '1.2.3.0256', '1.2.3.-4',
+            '99999999999999999999.0.0.0', '1.2.3.4/24',
+        ]
+        uints, valid = parse_dotted_quads(candidates)
+        for candidate, uint, is_valid in zip(candidates, uints, valid):
+            try:
+                expected = int(Address(candidate))
+            except ValueError:
+                self.assertFalse(is_valid, candidate)
+            else:
+                self.assertTrue(is_valid, candidate)
+                self.assertEqual(expected, uint)
+
+    def test_empty(self):
+        uints, valid = parse_dotted_quads([])
+        self.assertEqual(0, len(uints))
+        self.assertEqual(0, len(valid))
+
+    def test_format(self):
+        self.assertEqual(
+            ['1.2.3.4', '0.0.0.0', '255.255.255.255'],
+            format_dotted_quads([16909060, 0, 4294967295])
+        )
+
+class test_decompose_ranges(TestCase):
+
+    def test_decompose(self):
+        starts = [int(Address('1.2.3.0')), int(Address('10.0.0.0')), 0]
+        ends = [int(Address('1.2.5.255')), int(Address('10.255.255.255')), 0]
+        range_indices, networks, prefix_lengths = decompose_ranges(starts, ends)
+        self.assertEqual([0, 0, 1, 2], range_indices.tolist())
+        self.assertEqual(
+            ['1.2.3.0', '1.2.4.0', '10.0.0.0', '0.0.0.0'],
+            format_dotted_quads(networks)
+        )
+        self.assertEqual([24, 23, 8, 32], prefix_lengths.tolist())
+
+    def test_agrees_with_range_to_subnets(self):
+        rng = np.random.RandomState(7)
+        starts = rng.randint(0, 2 ** 32, size=300, dtype=np.uint64)
+        ends = np.minimum(
+            starts + rng.randint(0, 2 ** 20, size=300), 2 ** 32 - 1
+        )
+        starts = np.append(starts, [0, 1])
+        ends = np.append(ends, [2 ** 32 - 1, 2 ** 32 - 2])
+
+        range_indices, networks, prefix_lengths = decompose_ranges(starts, ends)
+        expected = [
+            (index, int(sub.floor()), sub.prefix_length)
+            for index, (start, end) in enumerate(zip(starts.tolist(), ends.tolist()))
+            for sub in range_to_subnets(start, end)
+        ]
+        self.assertEqual(
+            expected,
+            list(zip(range_indices.tolist(), networks.tolist(), prefix_lengths.tolist()))
+        )
+
+    def test_empty(self):
+        range_indices, networks, prefix_lengths = decompose_ranges([], [])
+        self.assertEqual(0, len(range_indices))
+        self.assertEqual(0, len(SubnetArray.from_ranges([], [])))
+
+    def test_invalid_ranges(self):
+        with self.assertRaises(ValueError):
+            decompose_ranges([2], [1])
+        with self.assertRaises(ValueError):
+            decompose_ranges([1, 2], [3])
+
+    def test_subnet_array_from_ranges(self):
+        subnets = SubnetArray.from_ranges(
+            [int(Address('1.2.3.0'))], [int(Address('1.2.5.255'))]
+        )
+        self.assertEqual(['1.2.3.0/24', '1.2.4.0/23'], subnets.to_strings())
+
+class test_address_array(TestCase):
+
+    def setUp(self):
+        self.dotted_quads = ['10.1.2.3', '192.168.0.1', '8.8.8.8']
+        self.addresses = AddressArray.from_strings(self.dotted_quads)
+
+    def test_from_strings(self):
+        self.assertEqual(3, len(self.addresses))
+        self.assertEqual(Address('192.168.0.1'), self.addresses[1])
+        self.assertEqual(
+            [Address(a) for a in self.dotted_quads], list(self.addresses)
+        )
+
+    def test_from_strings_invalid(self):
+        with self.assertRaises(ValueError) as ex:
+            AddressArray.from_strings(iter(['1.2.3.4', '1.2.3.400']))
+        self.assertEqual(
+            "Invalid IPv4 address: \"1.2.3.400\"", str(ex.exception)
+        )
+
+    def test_from_addresses(self):
+        addresses = AddressArray.from_addresses(
+            Address(a) for a in self.dotted_quads
+        )
+        self.assertEqual(self.addresses.uints.tolist(), addresses.uints.tolist())
+
+    def test_invalid_uints(self):
+        with self.assertRaises(ValueError):
+            AddressArray([-1])
+        with self.assertRaises(ValueError):
+            AddressArray([2 ** 32])
+
+    def test_to_strings(self):
+        self.assertEqual(self.dotted_quads, self.addresses.to_strings())
+
+    def test_mask(self):
+        self.assertEqual(
+            ['10.0.0.0', '192.0.0.0', '8.0.0.0'],
+            self.addresses.mask(8).to_strings()
+        )
+        self.assertEqual(
+            ['10.1.0.0', '192.168.0.0', '8.8.8.8'],
+            self.addresses.mask([16, 24, 32]).to_strings()
+        )
+        with self.assertRaises(ValueError):
+            self.addresses.mask(33)
+
+    def test_sorted(self):
+        self.assertEqual(
+            ['8.8.8.8', '10.1.2.3', '192.168.0.1'],
+            self.addresses.sorted().to_strings()
+        )
+        self.assertEqual([2, 0, 1], self.addresses.argsort().tolist())
+
+    def test_slice(self):
+        sliced = self.addresses[1:]
+        self.assertTrue(isinstance(sliced, AddressArray))
+        self.assertEqual(['192.168.0.1', '8.8.8.8'], sliced.to_strings())
+
+class test_subnet_array(TestCase):
+
+    def setUp(self):
+        self.cidrs = [
+            '10.0.0.0/8', '10.1.0.0/16', '192.168.0.0/16', '8.8.8.0/24'
+        ]
+        self.subnets = SubnetArray.from_strings(self.cidrs)
+
+    def test_from_strings(self):
+        self.assertEqual(4, len(self.subnets))
+        self.assertEqual(self.cidrs, self.subnets.to_strings())
+        self.assertEqual(Subnet(Address('10.1.0.0'), 16), self.subnets[1])
+
+    def test_from_strings_invalid(self):
+        for invalid in ('10.0.0.0', '10.0.0.0/', '10.0.0.0/33',
+                        '10.0.0/8', '10.0.0.0/a'):
+            with self.assertRaises(ValueError) as ex:
+                SubnetArray.from_strings(['1.0.0.0/8', invalid])
+            self.assertEqual(
+                "Invalid IPv4 subnet: \"{0}\"".format(invalid),
+                str(ex.exception)
+            )
+
+    def test_from_subnets(self):
+        subnets = SubnetArray.from_subnets(list(self.subnets))
+        self.assertEqual(self.cidrs, subnets.to_strings())
+
+    def test_networks_are_masked(self):
+        subnets = SubnetArray([int(Address('10.1.2.3'))], [8])
+        self.assertEqual(['10.0.0.0/8'], subnets.to_strings())
+        self.assertEqual([int(Address('10.255.255.255'))], subnets.end.tolist())
+
+    def test_sizes(self):
+        self.assertEqual(
+            [2 ** 24, 2 ** 16, 2 ** 16, 2 ** 8], self.subnets.sizes().tolist()
+        )
+        self.assertEqual([2 ** 32], SubnetArray([0], [0]).sizes().tolist())
+
+    def test_sorted(self):
+        subnets = SubnetArray.from_strings(
+            ['10.1.0.0/16', '10.0.0.0/16', '10.0.0.0/8']
+        )
+        self.assertEqual(
+            ['10.0.0.0/8', '10.0.0.0/16', '10.1.0.0/16'],
+            subnets.sorted().to_strings()
+        )
+
+    def test_locate(self):
+        addresses = AddressArray.from_strings(
+            ['10.1.2.3', '10.2.3.4', '8.8.8.8', '1.1.1.1', '192.168.255.255']
+        )
+        self.assertEqual([1, 0, 3, -1, 2], self.subnets.locate(addresses).tolist())
+
+    def test_contains(self):
+        addresses = AddressArray.from_strings(
+            ['10.1.2.3', '11.0.0.0', '8.8.8.255', '8.8.9.0']
+        )
+        self.assertEqual(
+            [True, False, True, False],
+            self.subnets.contains(addresses).tolist()
+        )
+
+    def test_contains_agrees_with_subnet(self):
+        rng = np.random.RandomState(42)
+        networks = rng.randint(0, 2 ** 32, size=200, dtype=np.uint64)
+        lengths = rng.randint(4, 33, size=200)
+        subnets = SubnetArray(networks, lengths)
+        addresses = AddressArray(
+            rng.randint(0, 2 ** 32, size=500, dtype=np.uint64)
+        )
+
+        contained = subnets.contains(addresses).tolist()
+        for address, is_contained in zip(addresses, contained):
+            self.assertEqual(
+                any(address in subnet for subnet in subnets), is_contained
+            )
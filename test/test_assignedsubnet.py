@@ -1,4 +1,5 @@
 from unittest import TestCase
+import pickle
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -36,6 +37,50 @@ class test_assigned_subnet(TestCase):
 
         self.assertEqual("AssignedSubnet name can't be empty", str(ex.exception))
 
+    def test_from_range(self):
+        start_address = Address('1.2.3.0')
+        end_address = Address('1.2.5.255')
+        assigned = AssignedSubnet.from_range(start_address, end_address, 'ODD')
+        self.assertEqual(
+            (
+                AssignedSubnet(Address('1.2.3.0'), 24, 'ODD'),
+                AssignedSubnet(Address('1.2.4.0'), 23, 'ODD'),
+            ),
+            assigned
+        )
+        self.assertTrue(all(isinstance(a, AssignedSubnet) for a in assigned))
+        self.assertTrue(all(a.name == 'ODD' for a in assigned))
+        self.assertTrue(all(a.range_subnets is assigned for a in assigned))
+
+    def test_immutable_network(self):
+        ass = AssignedSubnet(Address('10.0.0.0'), 8, 'IETF')
+        with self.assertRaises(AttributeError):
+            ass._network = Address('11.0.0.0')
+        with self.assertRaises(AttributeError):
+            ass._prefix_length = 16
+        # The rest of an assignment can change
+        ass.name = 'IANA'
+        ass._source = 'test'
+
+        self.session.add(ass)
+        self.session.commit()
+        self.session.expunge_all()
+        loaded = self.session.query(AssignedSubnet).one()
+        self.assertEqual(Subnet(Address('10.0.0.0'), 8), loaded)
+        self.assertEqual(Address('10.255.255.255'), loaded.ceiling())
+        self.assertEqual('IANA', loaded.name)
+
+    def test_pickle(self):
+        ass = AssignedSubnet(Address('10.0.0.0'), 8, 'IETF')
+        unpickled = pickle.loads(pickle.dumps(ass))
+        self.assertEqual(ass, unpickled)
+        self.assertEqual('IETF', unpickled.name)
+        self.assertEqual(Address('10.255.255.255'), unpickled.ceiling())
+
+    def test_single_subnet_range(self):
+        ass = AssignedSubnet(Address('10.0.0.0'), 8, 'IETF')
+        self.assertEqual((ass,), ass.range_subnets)
+
     def test_relationships_next(self):
 
         subnet_a = AssignedSubnet(Address('10.0.0.0'), 8, "alpha")
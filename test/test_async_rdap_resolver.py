@@ -0,0 +1,362 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from mock import Mock
+import asyncio
+import json
+import threading
+import time
+
+from src.net.IPv4 import Address, Subnet
+from src.metadata.assigned import AssignedSubnet
+from src.metadata.async_RDAP import AsyncRDAP_Resolver
+from src.metadata.failures import FailureCache
+from src.metadata.IANA_IPv4_assignments import TopLevelDelegation
+from src.metadata.redirects import RedirectMap
+from src.metadata.resolver import DelegationResolver
+from src.metadata.http_cache import RDAPCache
+from src.metadata.ratelimit import HostRateLimiter
+from src.metadata.RDAP import (
+    RDAPResolutionException, RDAPRedirectException
+)
+from src.metadata import ResolutionException
+
+def _rdap_json(start, end, name, notices=None):
+    rdap_json = {
+        'startAddress': start, 'endAddress': end, 'name': name,
+        'port43': 'whois.example.org',
+    }
+    if notices:
+        rdap_json['notices'] = notices
+    return rdap_json
+
+class _RDAPHandler(BaseHTTPRequestHandler):
+    '''
+    Stand-in RDAP server. The behaviour of each path is set by the test in
+    server.routes
+    '''
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.request_headers.append(dict(self.headers))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+            route = server.routes.get(self.path, (404, {}, b''))
+            if callable(route):
+                route = route()
+            status, headers, body = route
+            if isinstance(body, (dict, list)):
+                body = json.dumps(body).encode('utf-8')
+
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            if headers.get('Transfer-Encoding') == 'chunked':
+                self.end_headers()
+                for offset in range(0, len(body), 7):
+                    chunk = body[offset:offset + 7]
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                self.wfile.write(b'0\r\n\r\n')
+            else:
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+def _serve_RDAP(test):
+    '''
+    Starts a stand-in RDAP server for the duration of test
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _RDAPHandler)
+    server.daemon_threads = True
+    server.routes = {}
+    server.requests = []
+    server.request_headers = []
+    server.lock = threading.Lock()
+    server.in_flight = server.max_in_flight = 0
+    server.delay = 0
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={'poll_interval': 0.01}
+    )
+    thread.daemon = True
+    thread.start()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    return server, 'http://127.0.0.1:{0}'.format(server.server_port)
+
+class test_async_RDAP_resolver(TestCase):
+
+    def setUp(self):
+        self.server, self.base_url = _serve_RDAP(self)
+        delegation = Mock(rdap_URLs={self.base_url + '/'})
+        self._delegation_rslvr = Mock()
+        self._delegation_rslvr.get_top_level_assignment = Mock(
+            return_value=delegation
+        )
+        self.rate_limiter = HostRateLimiter(host_rates={'127.0.0.1': 1000.0})
+        self.rslvr = AsyncRDAP_Resolver(
+            self._delegation_rslvr, rate_limiter=self.rate_limiter
+        )
+
+    def test_resolve(self):
+        self.server.routes['/ip/10.11.12.0'] = (
+            200, {}, _rdap_json('10.11.0.0', '10.11.255.255', 'FOO')
+        )
+        assigned = asyncio.run(
+            self.rslvr.resolve(Subnet(Address('10.11.12.0'), 24))
+        )
+        self.assertEqual(Subnet(Address('10.11.0.0'), 16), assigned)
+        self.assertEqual('FOO', assigned.name)
+        self.assertEqual(['/ip/10.11.12.0'], self.server.requests)
+
+    def test_cache(self):
+        cache = RDAPCache(':memory:', ttl=60)
+        self.addCleanup(cache.close)
+        rslvr = AsyncRDAP_Resolver(
+            self._delegation_rslvr, rate_limiter=self.rate_limiter,
+            cache=cache
+        )
+        url = self.base_url + '/ip/10.11.12.0'
+        self.server.routes['/ip/10.11.12.0'] = (
+            200, {'ETag': '"v1"'},
+            _rdap_json('10.11.0.0', '10.11.255.255', 'FOO')
+        )
+        asyncio.run(rslvr.resolve_from_url(url))
+        # Fresh hits don't hit the server
+        assigned = asyncio.run(rslvr.resolve_from_url(url))
+        self.assertEqual('FOO', assigned.name)
+        self.assertEqual(1, len(self.server.requests))
+
+        # Stale ones are revalidated
+        cache.ttl = 0
+        self.server.routes['/ip/10.11.12.0'] = (304, {}, b'')
+        assigned = asyncio.run(rslvr.resolve_from_url(url))
+        self.assertEqual('FOO', assigned.name)
+        self.assertEqual(2, len(self.server.requests))
+        self.assertEqual('"v1"', self.server.request_headers[1]['If-None-Match'])
+
+    def test_chunked_response(self):
+        self.server.routes['/ip/10.11.12.0'] = (
+            200, {'Transfer-Encoding': 'chunked'},
+            _rdap_json('10.11.12.0', '10.11.12.255', 'CHUNKY')
+        )
+        assigned = asyncio.run(
+            self.rslvr.resolve_from_url(self.base_url + '/ip/10.11.12.0')
+        )
+        self.assertEqual('CHUNKY', assigned.name)
+
+    def test_not_found(self):
+        url = self.base_url + '/ip/10.11.12.0'
+        with self.assertRaises(RDAPResolutionException) as ex:
+            asyncio.run(self.rslvr.resolve_from_url(url))
+        self.assertEqual("RDAP resource not found: " + url, str(ex.exception))
+
+    def test_retries_server_errors(self):
+        responses = iter([
+            (500, {}, b''), (503, {}, b''),
+            (200, {}, _rdap_json('10.0.0.0', '10.0.0.255', 'BAR')),
+        ])
+        self.server.routes['/ip/10.0.0.0'] = lambda: next(responses)
+        assigned = asyncio.run(
+            self.rslvr.resolve_from_url(self.base_url + '/ip/10.0.0.0')
+        )
+        self.assertEqual('BAR', assigned.name)
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_malformed_JSON(self):
+        self.server.routes['/ip/10.0.0.0'] = (200, {}, b'{nope')
+        with self.assertRaises(RDAPResolutionException) as ex:
+            asyncio.run(
+                self.rslvr.resolve_from_url(self.base_url + '/ip/10.0.0.0')
+            )
+        self.assertEqual("Malformed JSON in RDAP output", str(ex.exception))
+
+    def test_redirect_without_JSON(self):
+        redir_url = 'http://rdap.example.com/ip/10.0.0.0'
+        self.server.routes['/ip/10.0.0.0'] = (302, {'Location': redir_url}, b'')
+        with self.assertRaises(RDAPRedirectException) as ex:
+            asyncio.run(
+                self.rslvr.resolve_from_url(self.base_url + '/ip/10.0.0.0')
+            )
+        self.assertEqual(redir_url, ex.exception.redir_url)
+        self.assertIsNone(ex.exception.provisional)
+        # Redirects aren't followed
+        self.assertEqual(['/ip/10.0.0.0'], self.server.requests)
+
+    def test_redirect_with_JSON(self):
+        redir_url = 'http://rdap.example.com/ip/10.0.0.0'
+        self.server.routes['/ip/10.0.0.0'] = (
+            301, {'Location': redir_url},
+            _rdap_json('10.0.0.0', '10.255.255.255', 'PROVISIONAL')
+        )
+        with self.assertRaises(RDAPRedirectException) as ex:
+            asyncio.run(
+                self.rslvr.resolve_from_url(self.base_url + '/ip/10.0.0.0')
+            )
+        self.assertEqual(redir_url, ex.exception.redir_url)
+        self.assertEqual('PROVISIONAL', ex.exception.provisional.name)
+
+    def test_rate_limitation(self):
+        notice = [{'title': 'Rate Limit Exceeded', 'description': []}]
+        responses = iter([
+            (200, {}, _rdap_json('10.0.0.0', '10.0.0.255', 'X', notice)),
+            (200, {}, _rdap_json('10.0.0.0', '10.0.0.255', 'BAZ')),
+        ])
+        self.server.routes['/ip/10.0.0.0'] = lambda: next(responses)
+        rate_limiter = HostRateLimiter(host_rates={'127.0.0.1': 40.0})
+        self.rslvr = AsyncRDAP_Resolver(
+            self._delegation_rslvr, rate_limiter=rate_limiter
+        )
+        assigned = asyncio.run(
+            self.rslvr.resolve_from_url(self.base_url + '/ip/10.0.0.0')
+        )
+        self.assertEqual('BAZ', assigned.name)
+        # Halved, then increased after the successful query
+        self.assertAlmostEqual(20.1, rate_limiter.rate('127.0.0.1'))
+
+    def test_too_many_requests(self):
+        responses = iter([
+            (429, {'Retry-After': '0'}, b''),
+            (200, {}, _rdap_json('10.0.0.0', '10.0.0.255', 'QUX')),
+        ])
+        self.server.routes['/ip/10.0.0.0'] = lambda: next(responses)
+        assigned = asyncio.run(
+            self.rslvr.resolve_from_url(self.base_url + '/ip/10.0.0.0')
+        )
+        self.assertEqual('QUX', assigned.name)
+        self.assertEqual(2, len(self.server.requests))
+
+    def test_rate_limitation_out_of_retries(self):
+        notice = [{'title': 'Rate Limit Exceeded', 'description': []}]
+        self.server.routes['/ip/10.0.0.0'] = (
+            200, {}, _rdap_json('10.0.0.0', '10.0.0.255', 'X', notice)
+        )
+        with self.assertRaises(RDAPResolutionException):
+            asyncio.run(
+                self.rslvr.resolve_from_url(self.base_url + '/ip/10.0.0.0')
+            )
+        self.assertEqual(
+            AsyncRDAP_Resolver.RATE_LIMITATION_RETRIES,
+            len(self.server.requests)
+        )
+
+    def test_connection_refused(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertRaises(RDAPResolutionException):
+            asyncio.run(
+                self.rslvr.resolve_from_url(self.base_url + '/ip/10.0.0.0')
+            )
+
+    def test_resolve_many_bounded_concurrency(self):
+        self.server.delay = 0.05
+        networks = [Subnet(Address((10, i, 0, 0)), 16) for i in range(12)]
+        for i in range(12):
+            self.server.routes['/ip/10.{0}.0.0'.format(i)] = (
+                200, {}, _rdap_json(
+                    '10.{0}.0.0'.format(i), '10.{0}.255.255'.format(i),
+                    'NET{0}'.format(i)
+                )
+            )
+        # 10.11/16 isn't found
+        del self.server.routes['/ip/10.11.0.0']
+
+        self.rslvr = AsyncRDAP_Resolver(
+            self._delegation_rslvr, host_concurrency={'127.0.0.1': 3},
+            rate_limiter=self.rate_limiter
+        )
+        results = asyncio.run(self.rslvr.resolve_many(networks))
+
+        self.assertEqual(
+            ['NET{0}'.format(i) for i in range(11)],
+            [assigned.name for assigned in results[:11]]
+        )
+        self.assertTrue(isinstance(results[11], RDAPResolutionException))
+        self.assertEqual(3, self.server.max_in_flight)
+
+class test_async_delegation_resolver(TestCase):
+
+    def setUp(self):
+        self.server, self.base_url = _serve_RDAP(self)
+        eleven_dot_delegation = TopLevelDelegation(11)
+        eleven_dot_delegation.rdap_URLs = [self.base_url + '/']
+        top_level = [None] * 256
+        top_level[11] = eleven_dot_delegation
+
+        self.redirects = RedirectMap(':memory:')
+        self.addCleanup(self.redirects.close)
+        self.failures = FailureCache(':memory:')
+        self.addCleanup(self.failures.close)
+        self.local_store = Mock()
+        self.local_store.longest_match = Mock(return_value=None)
+        self.resolver = DelegationResolver(
+            top_level,
+            rate_limiter=HostRateLimiter(host_rates={'127.0.0.1': 1000.0}),
+            failure_cache=self.failures, local_store=self.local_store,
+            redirect_map=self.redirects
+        )
+        self.rdap = self.resolver.async_RDAP_resolver()
+
+    def _resolve(self, network):
+        return asyncio.run(self.resolver.resolve_async(network, self.rdap))
+
+    def test_local_store(self):
+        local = AssignedSubnet(Address('11.12.0.0'), 16, 'LOCAL')
+        self.local_store.longest_match.return_value = local
+        self.assertIs(local, self._resolve(Subnet(Address('11.12.13.0'), 32)))
+        self.assertEqual([], self.server.requests)
+
+    def test_redirect(self):
+        self.server.routes['/ip/11.12.13.0'] = (
+            302, {'Location': self.base_url + '/other/ip/11.12.13.0'}, b''
+        )
+        self.server.routes['/other/ip/11.12.13.0'] = (
+            200, {}, _rdap_json('11.12.0.0', '11.12.255.255', 'ELSEWHERE')
+        )
+        self.server.routes['/other/ip/11.12.200.0'] = (
+            200, {}, _rdap_json('11.12.0.0', '11.12.255.255', 'ELSEWHERE')
+        )
+
+        assigned = self._resolve(Subnet(Address('11.12.13.0'), 32))
+        self.assertEqual('ELSEWHERE', assigned.name)
+        # The redirect is learned, and later queries go straight to it
+        assigned = self._resolve(Subnet(Address('11.12.200.0'), 32))
+        self.assertEqual('ELSEWHERE', assigned.name)
+        self.assertEqual(
+            ['/ip/11.12.13.0', '/other/ip/11.12.13.0', '/other/ip/11.12.200.0'],
+            self.server.requests
+        )
+
+    def test_whois_fallback(self):
+        whois_assignment = AssignedSubnet(Address('11.12.13.0'), 24, 'WHOIS')
+        self.resolver._whois_resolver.resolve = Mock(
+            return_value=whois_assignment
+        )
+        network = Subnet(Address('11.12.13.0'), 32)
+        self.assertIs(whois_assignment, self._resolve(network))
+        self.assertEqual(['/ip/11.12.13.0'], self.server.requests)
+        self.resolver._whois_resolver.resolve.assert_called_once_with(
+            network, whois_host=None
+        )
+
+    def test_failure_recorded(self):
+        self.resolver._whois_resolver.resolve = Mock(
+            side_effect=ResolutionException("No inetnum in whois record")
+        )
+        network = Subnet(Address('11.12.13.0'), 32)
+        with self.assertRaises(ResolutionException):
+            self._resolve(network)
+
+        # The network isn't queried again
+        with self.assertRaises(ResolutionException):
+            self._resolve(network)
+        self.assertEqual(['/ip/11.12.13.0'], self.server.requests)
+        self.assertEqual(1, self.resolver._whois_resolver.resolve.call_count)
@@ -0,0 +1,116 @@
+from unittest import TestCase
+from mock import Mock
+import asyncio
+import threading
+
+from src.net.IPv4 import Address, Subnet
+from src.metadata import ResolutionException, RDAPResolutionException
+from src.metadata.assigned import AssignedSubnet
+from src.metadata.async_whois import WhoisBatcher
+from src.metadata.resolver import DelegationResolver
+
+
+class test_whois_batcher(TestCase):
+
+    def setUp(self):
+        self.batches = []
+        # The first batch is held up until the test lets it go
+        self.first_batch_sent = threading.Event()
+        self.release_first_batch = threading.Event()
+
+        def resolve_whois_many(networks, whois_host):
+            self.batches.append((whois_host, list(networks)))
+            if 1 == len(self.batches):
+                self.first_batch_sent.set()
+                self.release_first_batch.wait(5)
+            return [
+                ResolutionException("Nope") if 5 == int(network.floor()) & 0xff
+                else AssignedSubnet(network.floor(), 32, 'NET')
+                for network in networks
+            ]
+
+        self.clones = []
+
+        def clone():
+            resolver = Mock()
+            resolver.resolve_whois_many = Mock(side_effect=resolve_whois_many)
+            self.clones.append(resolver)
+            return resolver
+
+        self.resolver = Mock()
+        self.resolver.whois_fallback_host = DelegationResolver.whois_fallback_host
+        self.resolver.clone = Mock(side_effect=clone)
+
+    @staticmethod
+    def _rdap_failure(whois_host=None):
+        return RDAPResolutionException("RDAP failed", whois_host=whois_host)
+
+    def test_batches(self):
+        batcher = WhoisBatcher(self.resolver, max_batch=3)
+        networks = [Subnet(Address((11, 0, 0, i)), 32) for i in range(7)]
+
+        async def resolve_all():
+            loop = asyncio.get_running_loop()
+            first = asyncio.ensure_future(
+                batcher.resolve(networks[0], self._rdap_failure('whois.ripe.net'))
+            )
+            await loop.run_in_executor(None, self.first_batch_sent.wait, 5)
+            # These queue up while the first batch is in flight
+            others = [
+                asyncio.ensure_future(batcher.resolve(
+                    network, self._rdap_failure('whois.ripe.net')
+                ))
+                for network in networks[1:]
+            ]
+            await asyncio.sleep(0)
+            self.release_first_batch.set()
+            return await asyncio.gather(first, *others, return_exceptions=True)
+
+        results = asyncio.run(resolve_all())
+
+        self.assertEqual(
+            [
+                ('whois.ripe.net', networks[:1]),
+                ('whois.ripe.net', networks[1:4]),
+                ('whois.ripe.net', networks[4:]),
+            ],
+            self.batches
+        )
+        self.assertEqual(
+            [
+                AssignedSubnet(network.floor(), 32, 'NET')
+                for network in networks[:5] + networks[6:]
+            ],
+            results[:5] + results[6:]
+        )
+        self.assertEqual("Nope", str(results[5]))
+        # The batches were sent one after the other, with the same resolver
+        self.assertEqual(1, len(self.clones))
+
+    def test_hosts_batched_separately(self):
+        self.release_first_batch.set()
+        batcher = WhoisBatcher(self.resolver)
+        ripe_net = Subnet(Address('11.0.0.1'), 32)
+        other_net = Subnet(Address('11.0.0.2'), 32)
+
+        async def resolve_all():
+            return await asyncio.gather(
+                batcher.resolve(ripe_net, self._rdap_failure('whois.ripe.net')),
+                batcher.resolve(other_net, ResolutionException("No RDAP")),
+            )
+
+        asyncio.run(resolve_all())
+        self.assertCountEqual(
+            [('whois.ripe.net', [ripe_net]), (None, [other_net])],
+            self.batches
+        )
+
+    def test_batch_failure(self):
+        self.resolver.clone = Mock(return_value=Mock(
+            resolve_whois_many=Mock(side_effect=RuntimeError("Bug"))
+        ))
+        batcher = WhoisBatcher(self.resolver)
+        with self.assertRaises(RuntimeError):
+            asyncio.run(batcher.resolve(
+                Subnet(Address('11.0.0.1'), 32), self._rdap_failure()
+            ))
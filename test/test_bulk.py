@@ -0,0 +1,101 @@
+from unittest import TestCase
+import io
+import mmap
+import tempfile
+
+from src.net.IPv4 import Address
+from src.net.bulk import (
+    BadLine, iter_address_arrays, iter_addresses, read_addresses
+)
+
+class test_bulk_parser(TestCase):
+
+    dotted_quads = ['1.2.3.4', '192.168.1.1', '0.0.0.0', '255.255.255.255']
+
+    def setUp(self):
+        self.expected = [int(Address(a)) for a in self.dotted_quads]
+        self.buffer = ('\n'.join(self.dotted_quads) + '\n').encode('ascii')
+
+    def test_bytes(self):
+        self.assertEqual(self.expected, list(read_addresses(self.buffer)))
+
+    def test_bytearray_and_memoryview(self):
+        self.assertEqual(
+            self.expected, list(read_addresses(bytearray(self.buffer)))
+        )
+        self.assertEqual(
+            self.expected, list(read_addresses(memoryview(self.buffer)))
+        )
+
+    def test_binary_file(self):
+        self.assertEqual(
+            self.expected, list(read_addresses(io.BytesIO(self.buffer)))
+        )
+
+    def test_text_file(self):
+        text_file = io.StringIO(self.buffer.decode('ascii'))
+        self.assertEqual(self.expected, list(read_addresses(text_file)))
+
+    def test_mmap(self):
+        with tempfile.TemporaryFile() as backing_file:
+            backing_file.write(self.buffer)
+            backing_file.flush()
+            with mmap.mmap(backing_file.fileno(), 0) as mapped:
+                self.assertEqual(self.expected, list(read_addresses(mapped)))
+
+    def test_iterable_of_lines(self):
+        self.assertEqual(
+            self.expected, list(read_addresses(self.dotted_quads))
+        )
+        self.assertEqual(
+            self.expected,
+            list(read_addresses(self.buffer.splitlines(keepends=True)))
+        )
+
+    def test_no_trailing_newline(self):
+        self.assertEqual(
+            self.expected, list(read_addresses(self.buffer.rstrip()))
+        )
+
+    def test_small_chunks(self):
+        # Lines straddle chunk boundaries
+        for chunk_size in range(1, 20):
+            self.assertEqual(
+                self.expected,
+                list(read_addresses(self.buffer, chunk_size=chunk_size))
+            )
+
+    def test_lenient_lines(self):
+        lenient = b'1.2.3.4\r\n\n  192.168.1.1 \n000.0.0.0\r\n255.255.255.255'
+        self.assertEqual(self.expected, list(read_addresses(lenient)))
+
+    def test_invalid_line_raises(self):
+        with self.assertRaises(ValueError) as ex:
+            read_addresses(b'1.2.3.4\n1.2.3.256\n')
+        self.assertEqual(
+            "Invalid IPv4 address on line 2: b'1.2.3.256'", str(ex.exception)
+        )
+
+    def test_invalid_lines_recorded(self):
+        errors = []
+        invalid = b'1.2.3\nfoo\n1.2.3.4\n+1.2.3.4\n1.2.3.4.5\n\xff\n1_0.0.0.0\n'
+        parsed = read_addresses(invalid, errors, chunk_size=7)
+        self.assertEqual([int(Address('1.2.3.4'))], list(parsed))
+        self.assertEqual(
+            [
+                BadLine(1, b'1.2.3'),
+                BadLine(2, b'foo'),
+                BadLine(4, b'+1.2.3.4'),
+                BadLine(5, b'1.2.3.4.5'),
+                BadLine(6, b'\xff'),
+                BadLine(7, b'1_0.0.0.0'),
+            ],
+            errors
+        )
+
+    def test_iterators(self):
+        self.assertEqual(self.expected, list(iter_addresses(self.buffer)))
+        arrays = list(iter_address_arrays(self.buffer, chunk_size=16))
+        self.assertTrue(len(arrays) > 1)
+        self.assertEqual(self.expected, [a for arr in arrays for a in arr])
+        self.assertEqual(4, arrays[0].itemsize)
@@ -4,6 +4,7 @@ from mock import patch, Mock, call
 from src.metadata.assigned import AssignedSubnet
 from src.net.IPv4 import Subnet, Address
 from src.metadata.orm import get_dec_base, DataManager
+from src.metadata.whois import WHOIS_PARENT_SOURCE
 
 class test_data_mgr(TestCase):
 
@@ -62,3 +63,129 @@ class test_data_mgr(TestCase):
             [[subnet_a, subnet_b], [subnet_d], [subnet_e, subnet_f]],
             contig
         )
+
+    def test_loaded_records_have_bounds(self):
+        subnet_a = AssignedSubnet(Address('10.0.0.0'), 8, "alpha")
+        self.data_mgr.update_records((subnet_a,))
+        # Force the record to be reloaded from the DB
+        self.data_mgr._sa_session.expunge_all()
+
+        loaded = self.data_mgr.all_records().first()
+        ten_dot = Subnet(Address('10.0.0.0'), 8)
+        self.assertFalse(loaded is subnet_a)
+        self.assertEqual(ten_dot, loaded)
+        self.assertEqual(hash(ten_dot), hash(loaded))
+        self.assertIn(Address('10.11.12.13'), loaded)
+        self.assertEqual(Address('10.255.255.255'), loaded.ceiling())
+
+    def test_radix_tree(self):
+        subnet_a = AssignedSubnet(Address('10.0.0.0'), 8, "alpha")
+        subnet_b = AssignedSubnet(Address('10.1.0.0'), 16, "bravo")
+        self.data_mgr.update_records((subnet_a, subnet_b))
+
+        tree = self.data_mgr.radix_tree()
+        self.assertEqual(2, len(tree))
+        _, payload = tree.longest_match(Address('10.1.2.3'))
+        self.assertTrue(payload is subnet_b)
+        _, payload = tree.longest_match(Address('10.2.3.4'))
+        self.assertTrue(payload is subnet_a)
+
+    def test_address_ranges(self):
+        subnet_a = AssignedSubnet(Address('11.0.0.0'), 8, "alpha")
+        subnet_b = AssignedSubnet(Address('10.1.0.0'), 16, "bravo")
+        self.data_mgr.update_records((subnet_a, subnet_b))
+
+        self.assertEqual(
+            [
+                (int(Address('10.1.0.0')), int(Address('10.1.255.255'))),
+                (int(Address('11.0.0.0')), int(Address('11.255.255.255'))),
+            ],
+            list(self.data_mgr.address_ranges())
+        )
+
+    def test_address_ranges_complete_only(self):
+        leaf = AssignedSubnet(Address('11.0.0.0'), 24, "leaf")
+        parent = AssignedSubnet(Address('11.0.0.0'), 8, "parent")
+        parent._source = WHOIS_PARENT_SOURCE
+        self.data_mgr.update_records((leaf, parent))
+        self.data_mgr.bulk_upsert([
+            (Subnet(Address('10.0.0.0'), 8), 'placeholder', 'delegated-arin'),
+            (Subnet(Address('12.0.0.0'), 8), 'dump', 'rpsl-ripe'),
+        ])
+
+        self.assertEqual(4, len(list(self.data_mgr.address_ranges())))
+        self.assertEqual(
+            [
+                (int(Address('11.0.0.0')), int(Address('11.0.0.255'))),
+                (int(Address('12.0.0.0')), int(Address('12.255.255.255'))),
+            ],
+            list(self.data_mgr.address_ranges(complete_only=True))
+        )
+
+    def test_longest_match(self):
+        subnet_a = AssignedSubnet(Address('10.0.0.0'), 8, "alpha")
+        subnet_b = AssignedSubnet(Address('10.1.0.0'), 16, "bravo")
+        self.data_mgr.update_records((subnet_a, subnet_b))
+
+        match = self.data_mgr.longest_match(Subnet(Address('10.1.2.0'), 24))
+        self.assertEqual(subnet_b, match)
+        self.assertEqual("bravo", match.name)
+        # Callers get a copy that isn't bound to the session
+        self.assertFalse(match is subnet_b)
+
+        match = self.data_mgr.longest_match(Subnet(Address('10.2.3.4'), 32))
+        self.assertEqual(subnet_a, match)
+        self.assertIsNone(
+            self.data_mgr.longest_match(Subnet(Address('11.0.0.0'), 24))
+        )
+
+    def test_longest_match_whois_parent(self):
+        # A leaf and the parent inetnum whois returned along with it
+        leaf = AssignedSubnet(Address('11.0.0.0'), 24, "leaf")
+        parent = AssignedSubnet(Address('11.0.0.0'), 16, "parent")
+        parent._source = WHOIS_PARENT_SOURCE
+        self.data_mgr.update_records((leaf, parent))
+
+        self.assertEqual(
+            leaf, self.data_mgr.longest_match(Subnet(Address('11.0.0.7'), 32))
+        )
+        # Other leaves in the parent still need fetching
+        self.assertIsNone(
+            self.data_mgr.longest_match(Subnet(Address('11.0.1.0'), 32))
+        )
+
+    @patch('src.metadata.orm.time.time')
+    def test_longest_match_max_age(self, mock_time):
+        mock_time.return_value = 1000.0
+        subnet_a = AssignedSubnet(Address('10.0.0.0'), 8, "alpha")
+        self.data_mgr.update_records((subnet_a,))
+        self.assertEqual(1000.0, subnet_a.updated)
+
+        mock_time.return_value = 1500.0
+        network = Subnet(Address('10.1.0.0'), 16)
+        self.assertEqual(subnet_a, self.data_mgr.longest_match(network, 600))
+        self.assertIsNone(self.data_mgr.longest_match(network, 300))
+        self.assertEqual(subnet_a, self.data_mgr.longest_match(network))
+
+        # Writing a local match back doesn't make it look any fresher
+        match = self.data_mgr.longest_match(network)
+        self.data_mgr.update_records((match,))
+        self.assertEqual(1000.0, self.data_mgr.longest_match(network).updated)
+
+    def test_longest_match_keeps_source(self):
+        self.data_mgr.bulk_upsert([
+            (Subnet(Address('10.0.0.0'), 8), 'alpha', 'rpsl-ripe'),
+        ])
+        network = Subnet(Address('10.1.0.0'), 16)
+        match = self.data_mgr.longest_match(network)
+        self.assertEqual('rpsl-ripe', match.source)
+
+        # A local hit written back by the mapper is still bulk-imported, so a
+        # newer dump still replaces it
+        self.data_mgr.update_records((match,))
+        self.data_mgr.bulk_upsert([
+            (Subnet(Address('10.0.0.0'), 8), 'bravo', 'rpsl-ripe'),
+        ])
+        match = self.data_mgr.longest_match(network)
+        self.assertEqual('bravo', match.name)
+        self.assertEqual('rpsl-ripe', match.source)
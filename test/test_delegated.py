@@ -0,0 +1,141 @@
+from unittest import TestCase
+from mock import patch
+import gzip
+import io
+import os
+import shutil
+import tempfile
+
+from src.metadata.assigned import AssignedSubnet
+from src.metadata.delegated import (
+    DelegatedRecord, iter_delegated_IPv4, delegated_rows, open_delegated
+)
+from src.metadata.orm import DataManager
+from src.net.IPv4 import Subnet, Address
+
+class test_delegated_parser(TestCase):
+
+    delegated = b'''2|ripencc|1700000000|4|19830705|20231114|+0100
+# A comment
+ripencc|*|ipv4|*|3|summary
+ripencc|*|asn|*|1|summary
+ripencc|FR|ipv4|2.0.0.0|1048576|20100712|allocated|a1b2c3
+ripencc|EU|ipv4|2.16.0.0|768|20100910|assigned|d4e5f6
+ripencc||ipv4|2.20.0.0|256||available|
+ripencc|NL|asn|3333|1|19930901|allocated|a1b2c3
+ripencc|DE|ipv4|2.21.0.0|256|20100910|allocated
+'''
+
+    def test_records(self):
+        records = list(iter_delegated_IPv4(io.BytesIO(self.delegated)))
+        self.assertEqual(
+            [
+                DelegatedRecord('ripencc', 'FR', Address('2.0.0.0'), 1048576, '20100712', 'allocated', 'a1b2c3'),
+                DelegatedRecord('ripencc', 'EU', Address('2.16.0.0'), 768, '20100910', 'assigned', 'd4e5f6'),
+                DelegatedRecord('ripencc', 'DE', Address('2.21.0.0'), 256, '20100910', 'allocated', None),
+            ],
+            records
+        )
+        self.assertEqual('RIPENCC-FR-a1b2c3', records[0].name)
+        self.assertEqual('RIPENCC-DE', records[2].name)
+        self.assertEqual('delegated-ripencc', records[0].source)
+
+    def test_rows(self):
+        rows = list(delegated_rows(
+            iter_delegated_IPv4(self.delegated.decode('ascii').splitlines())
+        ))
+        self.assertEqual(
+            [
+                (Subnet(Address('2.0.0.0'), 12), 'RIPENCC-FR-a1b2c3', 'delegated-ripencc'),
+                # 768 addresses aren't a CIDR subnet
+                (Subnet(Address('2.16.0.0'), 23), 'RIPENCC-EU-d4e5f6', 'delegated-ripencc'),
+                (Subnet(Address('2.16.2.0'), 24), 'RIPENCC-EU-d4e5f6', 'delegated-ripencc'),
+                (Subnet(Address('2.21.0.0'), 24), 'RIPENCC-DE', 'delegated-ripencc'),
+            ],
+            rows
+        )
+
+    def test_malformed(self):
+        for line in (
+                b'arin|US|ipv4|1.2.3|256|20100910|allocated',
+                b'arin|US|ipv4|1.2.3.0|many|20100910|allocated',
+                b'arin|US|ipv4|255.255.255.0|512|20100910|allocated'):
+            with self.assertRaises(ValueError):
+                list(iter_delegated_IPv4([line]))
+
+    def test_gzipped(self):
+        gzip_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, gzip_dir)
+        gzip_path = os.path.join(gzip_dir, 'delegated-ripencc-extended-latest.gz')
+        with gzip.open(gzip_path, 'wb') as gzip_file:
+            gzip_file.write(self.delegated)
+
+        with open_delegated(gzip_path) as delegated_file:
+            self.assertEqual(3, len(list(iter_delegated_IPv4(delegated_file))))
+
+
+class test_bulk_upsert(TestCase):
+
+    def setUp(self):
+        self._data_mgr_sqlite_patch = patch('src.metadata.orm.SQLITE_PATH', ':memory:')
+        self._data_mgr_sqlite_patch.start()
+        self.addCleanup(self._data_mgr_sqlite_patch.stop)
+        self.data_mgr = DataManager()
+
+    def _records(self):
+        return dict(
+            ((record.network, record.prefix_length), (record.name, record.source))
+            for record in self.data_mgr.all_records()
+        )
+
+    def test_insert(self):
+        rows = [
+            (Subnet(Address('2.0.0.0'), 12), 'RIPENCC-FR', 'delegated-ripencc'),
+            (Subnet(Address('3.0.0.0'), 8), 'ARIN-US', 'delegated-arin'),
+            (Subnet(Address('4.0.0.0'), 9), 'ARIN-US', 'delegated-arin'),
+        ]
+        self.assertEqual(3, self.data_mgr.bulk_upsert(iter(rows), batch_size=2))
+        self.assertEqual(
+            {
+                (Address('2.0.0.0'), 12): ('RIPENCC-FR', 'delegated-ripencc'),
+                (Address('3.0.0.0'), 8): ('ARIN-US', 'delegated-arin'),
+                (Address('4.0.0.0'), 9): ('ARIN-US', 'delegated-arin'),
+            },
+            self._records()
+        )
+
+    def test_resolved_names_kept(self):
+        self.data_mgr.update_records(
+            (AssignedSubnet(Address('3.0.0.0'), 8, 'AMAZON'),)
+        )
+        self.data_mgr.bulk_upsert([
+            (Subnet(Address('2.0.0.0'), 12), 'RIPENCC-FR', 'delegated-ripencc'),
+            (Subnet(Address('3.0.0.0'), 8), 'ARIN-US', 'delegated-arin'),
+        ])
+        # Importing again replaces what was imported before
+        self.data_mgr.bulk_upsert([
+            (Subnet(Address('2.0.0.0'), 12), 'RIPENCC-DE', 'delegated-ripencc'),
+        ])
+        self.assertEqual(
+            {
+                (Address('2.0.0.0'), 12): ('RIPENCC-DE', 'delegated-ripencc'),
+                (Address('3.0.0.0'), 8): ('AMAZON', None),
+            },
+            self._records()
+        )
+
+    def test_placeholders_refined(self):
+        self.data_mgr.bulk_upsert([
+            (Subnet(Address('2.0.0.0'), 12), 'RIPENCC-FR', 'delegated-ripencc'),
+        ])
+        # Placeholders aren't good enough to skip RDAP
+        network = Subnet(Address('2.1.2.3'), 32)
+        self.assertIsNone(self.data_mgr.longest_match(network))
+
+        self.data_mgr.update_records(
+            (AssignedSubnet(Address('2.0.0.0'), 12, 'FR-ORANGE'),)
+        )
+        self.assertEqual(
+            {(Address('2.0.0.0'), 12): ('FR-ORANGE', None)}, self._records()
+        )
+        self.assertEqual('FR-ORANGE', self.data_mgr.longest_match(network).name)
@@ -1,7 +1,17 @@
 from unittest import TestCase
 from mock import patch, Mock, call
+import io
+import os
+import shutil
+import tempfile
+import requests
+import time
 
-from src.metadata.IANA_IPv4_assignments import TopLevelDelegation, populate_IANA_IPv4_assignments
+from src.metadata.IANA_IPv4_assignments import (
+    TopLevelDelegation, parse_IANA_IPv4_assignments,
+    populate_IANA_IPv4_assignments
+)
+from src.metadata.constants import IANA_REGISTRY_MAX_AGE
 from src.net.IPv4 import Subnet, Address
 
 class test_Delegations(TestCase):
@@ -61,6 +71,28 @@ regional areas of the world. RFC 1466 <xref type="rfc" data="rfc1466"/> document
 </registry>
     '''.strip()
 
+    def setUp(self):
+        registry_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, registry_dir)
+        self.registry_path = os.path.join(registry_dir, 'ipv4-address-space.xml')
+
+    def _response(self, status_code=200, xml=None):
+        response = Mock(status_code=status_code, ok=status_code < 400)
+        if xml is None:
+            xml = self.address_space_xml
+        # Small chunks, so that the registry is written in several goes
+        xml = xml.encode('utf-8')
+        response.iter_content = lambda chunk_size: [
+            xml[offset:offset + 100] for offset in range(0, len(xml), 100)
+        ]
+        return response
+
+    def _write_registry(self, age):
+        with open(self.registry_path, 'w') as registry:
+            registry.write(self.address_space_xml.replace('APNIC', 'LOCAL'))
+        mtime = time.time() - age
+        os.utime(self.registry_path, (mtime, mtime))
+
     def test_delegation_repr(self):
         deleg = TopLevelDelegation(10)
         deleg.rdap_URLs = ['http://example.org', 'https://example.com']
@@ -73,69 +105,126 @@ regional areas of the world. RFC 1466 <xref type="rfc" data="rfc1466"/> document
 
     @patch('src.metadata.IANA_IPv4_assignments.requests.get')
     def test_populate_success(self, mock_get):
-        response = Mock(ok=True)
-        response.iter_lines = lambda: self.address_space_xml.splitlines()
-        mock_get.return_value = response
-        assignments = populate_IANA_IPv4_assignments()
-
-        expected_subnets = set([
-            Subnet(Address("0.0.0.0"), 8),
-            Subnet(Address("1.0.0.0"), 8),
-            Subnet(Address("2.0.0.0"), 8),
-            Subnet(Address("3.0.0.0"), 8),
-        ])
-
-        self.assertTrue(isinstance(assignments, dict))
-        self.assertEquals(4, len(assignments))
-        self.assertEquals(expected_subnets, set(assignments.keys()))
+        mock_get.return_value = self._response()
+        assignments = populate_IANA_IPv4_assignments(self.registry_path)
 
+        # The registry is indexed by top byte
+        self.assertTrue(isinstance(assignments, list))
+        self.assertEqual(256, len(assignments))
+        self.assertEqual([None] * 252, assignments[4:])
+        self.assertEqual(
+            [Subnet(Address((top_byte, 0, 0, 0)), 8) for top_byte in range(4)],
+            [tld.delegation_subnet for tld in assignments[:4]]
+        )
         self.assertTrue(
-            all(isinstance(assignments[tld], TopLevelDelegation) for tld in assignments)
+            all(isinstance(tld, TopLevelDelegation) for tld in assignments[:4])
         )
 
-        self.assertEquals(set(), assignments[Subnet(Address("0.0.0.0"), 8)].rdap_URLs)
-        self.assertIsNone(assignments[Subnet(Address("0.0.0.0"), 8)].whois_host)
+        self.assertEquals(set(), assignments[0].rdap_URLs)
+        self.assertIsNone(assignments[0].whois_host)
         #
         self.assertEquals(
             # The trailing slash is trimmed here
             {"https://rdap.apnic.net",},
-            assignments[Subnet(Address("1.0.0.0"), 8)].rdap_URLs
-        )
-        self.assertEquals(
-            "whois.apnic.net",
-            assignments[Subnet(Address("1.0.0.0"), 8)].whois_host
+            assignments[1].rdap_URLs
         )
+        self.assertEquals("whois.apnic.net", assignments[1].whois_host)
         #
         self.assertEquals(
             # The trailing slash is trimmed here
             {"https://rdap.db.ripe.net",},
-            assignments[Subnet(Address("2.0.0.0"), 8)].rdap_URLs
-        )
-        self.assertEquals(
-            "whois.ripe.net",
-            assignments[Subnet(Address("2.0.0.0"), 8)].whois_host
+            assignments[2].rdap_URLs
         )
+        self.assertEquals("whois.ripe.net", assignments[2].whois_host)
         #
         self.assertEquals(
             {"https://rdap.arin.net/registry", "http://rdap.arin.net/registry"},
-            assignments[Subnet(Address("3.0.0.0"), 8)].rdap_URLs
+            assignments[3].rdap_URLs
         )
-        self.assertEquals(
-            "whois.arin.net",
-            assignments[Subnet(Address("3.0.0.0"), 8)].whois_host
+        self.assertEquals("whois.arin.net", assignments[3].whois_host)
+
+        # The registry was downloaded in full, and saved for next time
+        self.assertEqual(
+            [call(
+                'http://www.iana.org/assignments/ipv4-address-space/ipv4-address-space.xml',
+                headers={}, stream=True
+            )],
+            mock_get.mock_calls
         )
+        with open(self.registry_path) as registry:
+            self.assertEqual(self.address_space_xml, registry.read())
+
+    @patch('src.metadata.IANA_IPv4_assignments.requests.get')
+    def test_populate_fresh_local_copy(self, mock_get):
+        self._write_registry(IANA_REGISTRY_MAX_AGE - 60)
+        assignments = populate_IANA_IPv4_assignments(self.registry_path)
+        self.assertEqual('LOCAL', assignments[1].designation)
+        # No network round trip
+        self.assertEqual([], mock_get.mock_calls)
+
+    @patch('src.metadata.IANA_IPv4_assignments.requests.get')
+    def test_populate_stale_local_copy_not_modified(self, mock_get):
+        self._write_registry(IANA_REGISTRY_MAX_AGE + 60)
+        mock_get.return_value = self._response(304)
+
+        assignments = populate_IANA_IPv4_assignments(self.registry_path)
+        self.assertEqual('LOCAL', assignments[1].designation)
+        self.assertIn('If-Modified-Since', mock_get.call_args[1]['headers'])
+        # The local copy is fresh again
+        self.assertLess(time.time() - os.path.getmtime(self.registry_path), 60)
+
+    @patch('src.metadata.IANA_IPv4_assignments.requests.get')
+    def test_populate_stale_local_copy_modified(self, mock_get):
+        self._write_registry(IANA_REGISTRY_MAX_AGE + 60)
+        mock_get.return_value = self._response()
+
+        assignments = populate_IANA_IPv4_assignments(self.registry_path)
+        self.assertEqual('APNIC', assignments[1].designation)
+
+    @patch('src.metadata.IANA_IPv4_assignments.requests.get')
+    def test_populate_stale_local_copy_offline(self, mock_get):
+        self._write_registry(IANA_REGISTRY_MAX_AGE + 60)
+        mock_get.side_effect = requests.ConnectionError("No network")
+
+        assignments = populate_IANA_IPv4_assignments(self.registry_path)
+        self.assertEqual('LOCAL', assignments[1].designation)
 
     @patch('src.metadata.IANA_IPv4_assignments.requests.get')
     def test_populate_http_failure(self, mock_get):
-        response = Mock(ok=False)
-        response.raise_for_status = Mock(side_effect=Exception)
+        response = self._response(503)
+        response.raise_for_status = Mock(side_effect=requests.HTTPError)
         mock_get.return_value = response
 
-        with self.assertRaises(Exception):
-            assignments = populate_IANA_IPv4_assignments()
+        # We fall back on the bundled snapshot
+        assignments = populate_IANA_IPv4_assignments(self.registry_path)
+        self.assertEqual(256, len(assignments))
+        self.assertTrue(all(tld is not None for tld in assignments))
+        self.assertEqual('APNIC', assignments[1].registry)
+        self.assertFalse(os.path.exists(self.registry_path))
+
+    @patch('src.metadata.IANA_IPv4_assignments.requests.get')
+    def test_populate_broken_download(self, mock_get):
+        self._write_registry(IANA_REGISTRY_MAX_AGE + 60)
+        mock_get.return_value = self._response(xml=self.address_space_xml[:-50])
+
+        # The broken download doesn't replace the local copy
+        assignments = populate_IANA_IPv4_assignments(self.registry_path)
+        self.assertEqual('LOCAL', assignments[1].designation)
+        self.assertEqual(
+            ['ipv4-address-space.xml'],
+            os.listdir(os.path.dirname(self.registry_path))
+        )
 
     @patch('src.metadata.IANA_IPv4_assignments.requests.get')
-    def test_populate_with_broken_xml_no_prefix(self, mock_get):
+    def test_populate_offline(self, mock_get):
+        assignments = populate_IANA_IPv4_assignments(self.registry_path, offline=True)
+        self.assertEqual([], mock_get.mock_calls)
+        self.assertEqual(
+            ['RESERVED'] * 16,
+            [tld.status for tld in assignments[224:240]]
+        )
+
+    def test_parse_with_broken_xml_no_prefix(self):
         no_prefix_xml = '''
 <?xml version='1.0' encoding='UTF-8'?>
 <?oxygen RNGSchema="ipv4-address-space.rng" type="xml"?>
@@ -156,15 +245,11 @@ regional areas of the world. RFC 1466 <xref type="rfc" data="rfc1466"/> document
 </registry>
         '''.strip()
 
-        response = Mock(ok=True)
-        response.iter_lines = lambda: no_prefix_xml.splitlines()
-        mock_get.return_value = response
         with self.assertRaises(ValueError) as ex:
-            populate_IANA_IPv4_assignments()
+            parse_IANA_IPv4_assignments(io.BytesIO(no_prefix_xml.encode('utf-8')))
         self.assertEqual("Record does not have a prefix element", str(ex.exception))
 
-    @patch('src.metadata.IANA_IPv4_assignments.requests.get')
-    def test_populate_with_broken_xml_malformed_prefix(self, mock_get):
+    def test_parse_with_broken_xml_malformed_prefix(self):
         no_prefix_xml = '''
 <?xml version='1.0' encoding='UTF-8'?>
 <?oxygen RNGSchema="ipv4-address-space.rng" type="xml"?>
@@ -186,9 +271,22 @@ regional areas of the world. RFC 1466 <xref type="rfc" data="rfc1466"/> document
 </registry>
         '''.strip()
 
-        response = Mock(ok=True)
-        response.iter_lines = lambda: no_prefix_xml.splitlines()
-        mock_get.return_value = response
         with self.assertRaises(ValueError) as ex:
-            populate_IANA_IPv4_assignments()
+            parse_IANA_IPv4_assignments(io.BytesIO(no_prefix_xml.encode('utf-8')))
         self.assertEqual("Malformed record prefix: 001", str(ex.exception))
+
+    def test_parse_status_and_registry(self):
+        assignments = parse_IANA_IPv4_assignments(
+            io.BytesIO(self.address_space_xml.encode('utf-8'))
+        )
+
+        reserved = assignments[0]
+        self.assertEqual('RESERVED', reserved.status)
+        self.assertFalse(reserved.is_mappable())
+        self.assertEqual('IANA - Local Identification', reserved.registry)
+
+        legacy = assignments[3]
+        self.assertEqual('LEGACY', legacy.status)
+        self.assertEqual('General Electric Company', legacy.designation)
+        self.assertTrue(legacy.is_mappable())
+        self.assertEqual('ARIN', legacy.registry)
@@ -0,0 +1,62 @@
+from unittest import TestCase
+
+from src.metadata.failures import FailureCache, Failure
+from src.net.IPv4 import Address
+from test.test_ratelimit import FakeClock
+
+class test_FailureCache(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = FailureCache(':memory:', clock=self.clock.now)
+        self.addCleanup(self.cache.close)
+
+    def test_range_failure(self):
+        self.assertIsNone(self.cache.range_failure(Address('10.0.0.1')))
+        self.cache.record_range_failure(
+            Address('10.0.0.0'), Address('10.0.0.255'), 'No inetnum'
+        )
+
+        self.assertEqual(
+            Failure('No inetnum', 1, self.clock.time, self.clock.time + FailureCache.RANGE_TTL),
+            self.cache.range_failure(Address('10.0.0.42'))
+        )
+        self.assertIsNone(self.cache.range_failure(Address('10.0.1.0')))
+        self.assertIsNone(self.cache.range_failure(Address('9.255.255.255')))
+
+    def test_exponential_ttl(self):
+        ttls = []
+        for _ in range(5):
+            failure = self.cache.record_endpoint_failure('whois.example.org', 'Timeout')
+            ttls.append(failure.expires - failure.failed)
+            self.clock.time += 1
+        self.assertEqual(
+            [FailureCache.ENDPOINT_TTL * 2 ** n for n in range(5)], ttls
+        )
+        self.assertEqual(5, self.cache.endpoint_failure('whois.example.org').failures)
+
+    def test_ttl_cap(self):
+        for _ in range(30):
+            failure = self.cache.record_range_failure(1, 1, 'Nope')
+        self.assertEqual(FailureCache.RANGE_MAX_TTL, failure.expires - failure.failed)
+
+    def test_expiry(self):
+        self.cache.record_endpoint_failure('whois.example.org', 'Timeout')
+        failure = self.cache.endpoint_failure('whois.example.org')
+        self.clock.time += FailureCache.ENDPOINT_TTL - 10
+        self.assertEqual(10, self.cache.time_left(failure))
+        self.assertIsNotNone(self.cache.endpoint_failure('whois.example.org'))
+
+        self.clock.time += 10
+        self.assertIsNone(self.cache.endpoint_failure('whois.example.org'))
+        # Expired failures still count towards the next TTL
+        failure = self.cache.record_endpoint_failure('whois.example.org', 'Timeout')
+        self.assertEqual(2, failure.failures)
+
+    def test_endpoint_succeeded(self):
+        self.cache.record_endpoint_failure('whois.example.org', 'Timeout')
+        self.cache.endpoint_succeeded('whois.example.org')
+        self.assertIsNone(self.cache.endpoint_failure('whois.example.org'))
+        self.assertEqual(
+            1, self.cache.record_endpoint_failure('whois.example.org', 'Timeout').failures
+        )
@@ -0,0 +1,131 @@
+from unittest import TestCase
+from mock import patch
+
+from src.metadata.assigned import AssignedSubnet
+from src.metadata.gaps import Gap, GapFinder
+from src.metadata.IANA_IPv4_assignments import TopLevelDelegation
+from src.metadata.orm import DataManager
+from src.metadata.whois import WHOIS_PARENT_SOURCE
+from src.net.IPv4 import Address, Subnet
+
+def _delegation(top_byte, status, whois_host=None, designation=None):
+    tld = TopLevelDelegation(top_byte)
+    tld.status = status
+    tld.whois_host = whois_host
+    tld.designation = designation
+    return tld
+
+class test_gap_finder(TestCase):
+
+    def setUp(self):
+        sqlite_path = patch('src.metadata.orm.SQLITE_PATH', ':memory:')
+        sqlite_path.start()
+        self.addCleanup(sqlite_path.stop)
+        self.data_mgr = DataManager()
+
+        delegations = (
+            _delegation(1, 'ALLOCATED', 'whois.apnic.net', 'APNIC'),
+            _delegation(2, 'ALLOCATED', 'whois.ripe.net', 'RIPE NCC'),
+            _delegation(3, 'LEGACY', 'whois.arin.net', 'General Electric'),
+            _delegation(4, 'RESERVED', None, 'IANA - Reserved'),
+            _delegation(10, 'ALLOCATED', 'whois.arin.net', 'ARIN'),
+            _delegation(11, 'ALLOCATED', 'whois.arin.net', 'ARIN'),
+        )
+        top_level = [None] * 256
+        for tld in delegations:
+            top_level[tld.delegation_subnet.floor()._uint >> 24] = tld
+        self.finder = GapFinder(self.data_mgr, top_level)
+
+    def test_registry(self):
+        self.assertEqual('ARIN', _delegation(3, 'LEGACY', 'whois.arin.net', 'GE').registry)
+        self.assertEqual('IANA', _delegation(4, 'RESERVED', None, 'IANA').registry)
+
+    def test_mappable_space(self):
+        # 4/8 isn't allocated and 10/8 is reserved
+        self.assertEqual(
+            [
+                (int(Address('1.0.0.0')), int(Address('3.255.255.255')), None),
+                (int(Address('11.0.0.0')), int(Address('11.255.255.255')), None),
+            ],
+            self.finder.mappable_space()
+        )
+        self.assertEqual(
+            ['APNIC', 'RIPE NCC', 'ARIN', 'ARIN'],
+            [registry for *_, registry in self.finder.mappable_space(True)]
+        )
+
+    def test_no_assignments(self):
+        self.assertEqual(
+            [
+                Gap(Address('1.0.0.0'), Address('3.255.255.255'), None),
+                Gap(Address('11.0.0.0'), Address('11.255.255.255'), None),
+            ],
+            list(self.finder.gaps())
+        )
+
+    def test_gaps(self):
+        self.data_mgr.update_records((
+            AssignedSubnet(Address('1.0.0.0'), 9, "a"),
+            AssignedSubnet(Address('1.0.0.0'), 16, "b"),
+            AssignedSubnet(Address('1.192.0.0'), 10, "c"),
+            AssignedSubnet(Address('2.0.0.0'), 8, "d"),
+            AssignedSubnet(Address('3.0.0.0'), 24, "e"),
+            AssignedSubnet(Address('10.0.0.0'), 8, "f"),
+            AssignedSubnet(Address('11.255.254.0'), 23, "g"),
+        ))
+
+        gaps = list(self.finder.gaps())
+        self.assertEqual(
+            [
+                ('1.128.0.0 - 1.191.255.255', None),
+                ('3.0.1.0 - 3.255.255.255', None),
+                ('11.0.0.0 - 11.255.253.255', None),
+            ],
+            [(str(gap), gap.registry) for gap in gaps]
+        )
+        self.assertEqual(2 ** 22, gaps[0].size)
+
+        self.assertEqual(
+            ['3.0.1.0 - 3.255.255.255', '11.0.0.0 - 11.255.253.255',
+             '1.128.0.0 - 1.191.255.255'],
+            [str(gap) for gap in self.finder.gaps(by_size=True)]
+        )
+
+        self.assertEqual(
+            [
+                ('1.128.0.0 - 1.191.255.255', 'APNIC'),
+                ('3.0.1.0 - 3.255.255.255', 'ARIN'),
+                ('11.0.0.0 - 11.255.253.255', 'ARIN'),
+            ],
+            [(str(gap), gap.registry) for gap in self.finder.gaps(by_registry=True)]
+        )
+
+    def test_incomplete_assignments(self):
+        # A leaf and the parent whois returned with it, and a placeholder
+        leaf = AssignedSubnet(Address('11.0.0.0'), 24, "leaf")
+        parent = AssignedSubnet(Address('11.0.0.0'), 8, "parent")
+        parent._source = WHOIS_PARENT_SOURCE
+        self.data_mgr.update_records((leaf, parent))
+        self.data_mgr.bulk_upsert([
+            (Subnet(Address('1.0.0.0'), 8), 'placeholder', 'delegated-apnic'),
+        ])
+
+        # Their space is still to be mapped
+        self.assertEqual(
+            ['1.0.0.0 - 3.255.255.255', '11.0.1.0 - 11.255.255.255'],
+            [str(gap) for gap in self.finder.gaps()]
+        )
+
+    def test_registry_boundaries(self):
+        self.data_mgr.update_records((
+            AssignedSubnet(Address('1.0.0.0'), 9, "a"),
+        ))
+        self.assertEqual(
+            ['1.128.0.0 - 3.255.255.255', '11.0.0.0 - 11.255.255.255'],
+            [str(gap) for gap in self.finder.gaps()]
+        )
+        self.assertEqual(
+            ['1.128.0.0 - 1.255.255.255', '2.0.0.0 - 2.255.255.255',
+             '3.0.0.0 - 3.255.255.255', '11.0.0.0 - 11.255.255.255'],
+            [str(gap) for gap in self.finder.gaps(by_registry=True)]
+        )
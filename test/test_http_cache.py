@@ -0,0 +1,57 @@
+from unittest import TestCase
+
+from src.metadata.http_cache import RDAPCache, CachedResponse
+from test.test_ratelimit import FakeClock
+
+class test_RDAPCache(TestCase):
+    URL = 'http://rdap.example.org/ip/10.0.0.0'
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = RDAPCache(':memory:', ttl=60, clock=self.clock.now)
+        self.addCleanup(self.cache.close)
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.lookup(self.URL))
+
+    def test_store_and_lookup(self):
+        self.cache.store(self.URL, 200, b'{}', {
+            'ETag': '"abc"', 'Last-Modified': 'Sat, 17 Oct 2026 10:00:00 GMT',
+        })
+        self.assertEqual(
+            CachedResponse(
+                200, None, b'{}', '"abc"', 'Sat, 17 Oct 2026 10:00:00 GMT',
+                self.clock.time
+            ),
+            self.cache.lookup(self.URL)
+        )
+        self.assertEqual(
+            {
+                'If-None-Match': '"abc"',
+                'If-Modified-Since': 'Sat, 17 Oct 2026 10:00:00 GMT',
+            },
+            self.cache.lookup(self.URL).validators()
+        )
+
+    def test_redirect(self):
+        self.cache.store(self.URL, 301, b'', {'Location': 'http://x/ip/1'})
+        cached = self.cache.lookup(self.URL)
+        self.assertEqual('http://x/ip/1', cached.location)
+        self.assertEqual({}, cached.validators())
+
+    def test_freshness(self):
+        self.cache.store(self.URL, 200, b'{}', {})
+        self.clock.time += 59
+        self.assertTrue(self.cache.is_fresh(self.cache.lookup(self.URL)))
+        self.clock.time += 1
+        self.assertFalse(self.cache.is_fresh(self.cache.lookup(self.URL)))
+
+        self.cache.revalidated(self.URL)
+        self.assertTrue(self.cache.is_fresh(self.cache.lookup(self.URL)))
+
+    def test_replace_and_discard(self):
+        self.cache.store(self.URL, 200, b'{"a": 1}', {})
+        self.cache.store(self.URL, 200, b'{"a": 2}', {})
+        self.assertEqual(b'{"a": 2}', self.cache.lookup(self.URL).body)
+        self.cache.discard(self.URL)
+        self.assertIsNone(self.cache.lookup(self.URL))
@@ -0,0 +1,106 @@
+from unittest import TestCase
+import random
+
+from src.net.IPv4 import Address, Subnet
+from src.net.intervals import IntervalSet
+
+MAX_UINT32 = 2 ** 32 - 1
+
+def _addresses(interval_set):
+    return {a for first, last in interval_set for a in range(first, last + 1)}
+
+class test_IntervalSet(TestCase):
+
+    def test_build_coalesces(self):
+        intervals = IntervalSet([(10, 20), (5, 9), (30, 40), (35, 50), 60, (21, 21)])
+        self.assertEqual([(5, 21), (30, 50), (60, 60)], list(intervals))
+        self.assertEqual(3, len(intervals))
+        self.assertEqual(17 + 21 + 1, intervals.address_count())
+
+    def test_build_from_subnets_and_addresses(self):
+        intervals = IntervalSet([
+            Subnet(Address('10.0.0.0'), 9),
+            Subnet(Address('10.128.0.0'), 9),
+            Address('11.0.0.0'),
+        ])
+        self.assertEqual(
+            [(int(Address('10.0.0.0')), int(Address('11.0.0.0')))],
+            list(intervals)
+        )
+        self.assertEqual(
+            [Subnet(Address('10.0.0.0'), 8), Subnet(Address('11.0.0.0'), 32)],
+            list(intervals.subnets())
+        )
+
+    def test_invalid_ranges(self):
+        for invalid in ((2, 1), (-1, 5), (0, MAX_UINT32 + 1)):
+            with self.assertRaises(ValueError):
+                IntervalSet([invalid])
+        with self.assertRaises(ValueError):
+            IntervalSet().add((5, 4))
+
+    def test_add(self):
+        intervals = IntervalSet([(10, 20), (30, 40)])
+        intervals.add((21, 29))
+        self.assertEqual([(10, 40)], list(intervals))
+        intervals.add(5)
+        intervals.add((42, 45))
+        self.assertEqual([(5, 5), (10, 40), (42, 45)], list(intervals))
+        intervals.add((0, 100))
+        self.assertEqual([(0, 100)], list(intervals))
+
+    def test_discard(self):
+        intervals = IntervalSet([(10, 20), (30, 40)])
+        intervals.discard((15, 35))
+        self.assertEqual([(10, 14), (36, 40)], list(intervals))
+        intervals.discard(10)
+        intervals.discard((40, 50))
+        intervals.discard((0, 5))
+        self.assertEqual([(11, 14), (36, 39)], list(intervals))
+        intervals.discard((0, MAX_UINT32))
+        self.assertFalse(intervals)
+
+    def test_contains_and_overlaps(self):
+        intervals = IntervalSet([Subnet(Address('10.0.0.0'), 8)])
+        self.assertIn(Address('10.1.2.3'), intervals)
+        self.assertIn(Subnet(Address('10.1.0.0'), 16), intervals)
+        self.assertNotIn(Address('11.0.0.0'), intervals)
+        self.assertNotIn(Subnet(Address('10.0.0.0'), 7), intervals)
+        self.assertTrue(intervals.overlaps(Subnet(Address('10.0.0.0'), 7)))
+        self.assertFalse(intervals.overlaps(Subnet(Address('12.0.0.0'), 8)))
+        self.assertNotIn(0, IntervalSet())
+
+    def test_complement(self):
+        self.assertEqual([(0, MAX_UINT32)], list(~IntervalSet()))
+        self.assertEqual([], list(~IntervalSet([(0, MAX_UINT32)])))
+        self.assertEqual(
+            [(0, 9), (21, MAX_UINT32 - 1)],
+            list(~IntervalSet([(10, 20), MAX_UINT32]))
+        )
+
+    def test_set_operations_agree_with_sets(self):
+        rng = random.Random(3)
+        for _ in range(50):
+            sets = []
+            for _ in range(2):
+                ranges = []
+                for _ in range(rng.randint(0, 8)):
+                    first = rng.randint(0, 200)
+                    ranges.append((first, first + rng.randint(0, 20)))
+                sets.append(IntervalSet(ranges))
+            a, b = sets
+            self.assertEqual(_addresses(a) | _addresses(b), _addresses(a | b))
+            self.assertEqual(_addresses(a) & _addresses(b), _addresses(a & b))
+            self.assertEqual(_addresses(a) - _addresses(b), _addresses(a - b))
+            self.assertEqual(_addresses(a) ^ _addresses(b), _addresses(a ^ b))
+            # Results are coalesced
+            for result in (a | b, a & b, a - b, a ^ b):
+                self.assertEqual(IntervalSet(result), result)
+
+    def test_copy_and_equality(self):
+        intervals = IntervalSet([(1, 2)])
+        copied = intervals.copy()
+        copied.add(3)
+        self.assertEqual(IntervalSet([(1, 2)]), intervals)
+        self.assertEqual(IntervalSet([(1, 3)]), copied)
+        self.assertNotEqual(intervals, copied)
@@ -1,8 +1,12 @@
 from unittest import TestCase
-from mock import patch, Mock, call
+from mock import patch, Mock, call, ANY
 
-from src.metadata import ResolutionException
+from src.metadata import (
+    ResolutionException, RateLimitationException, QueryDeferredException,
+    WhoisConnectionException
+)
 from src.metadata.assigned import AssignedSubnet
+from src.metadata.async_whois import WhoisBatcher
 from src.metadata.mapper import SubnetMapper
 from src.metadata.orm import DataManager
 from src.net.IPv4 import Address, Subnet
@@ -53,6 +57,70 @@ class test_Mapper(TestCase):
         )
 
 
+    def test_stop_after_last_address(self):
+        a = AssignedSubnet(Address("11.0.0.0"), 24, "alpha")
+        b = AssignedSubnet(Address("11.0.1.0"), 24, "bravo")
+        c = AssignedSubnet(Address("11.0.2.0"), 24, "charlie")
+
+        self._resolve_mock.side_effect = [a, b, c]
+        self.mapper.scan_up(Address("11.0.0.0"), Address("11.0.1.7"))
+
+        # The scan stops at the range that includes the last address
+        self.assertEqual(
+            [
+                call(Subnet(Address("11.0.0.0"), 32)),
+                call(Subnet(Address("11.0.1.0"), 32)),
+            ],
+            self._resolve_mock.mock_calls
+        )
+        self.assertEqual(
+            [a, b],
+            [s for s in self.mock_data_mgr.all_records().order_by(AssignedSubnet.mapped_network)],
+        )
+
+    def test_whois_timeout(self):
+        a = AssignedSubnet(Address("11.0.0.0"), 24, "alpha")
+        timeout = WhoisConnectionException("Whois query failed: timeout")
+
+        self._resolve_mock.side_effect = [a, timeout]
+        self.mapper.scan_up(Address("11.0.0.0"))
+
+        # The scan stops, and the failure is recorded against the range that
+        # timed out
+        self.assertEqual(
+            [call(Subnet(Address("11.0.1.0"), 32), timeout)],
+            self._resolver_mock.record_failure.mock_calls
+        )
+        self.assertEqual([a], list(self.mock_data_mgr.all_records()))
+
+    def test_related_ranges(self):
+        start_address = Address((11, 0, 0, 0))
+        # A whois reply with the parent and the next sibling of the inetnum
+        a = AssignedSubnet(Address("11.0.0.0"), 24, "alpha")
+        parent = AssignedSubnet(Address("11.0.0.0"), 16, "parent")
+        b = AssignedSubnet(Address("11.0.1.0"), 24, "bravo")
+        a.related_ranges = ((parent,), (b,))
+        c = AssignedSubnet(Address("11.0.2.0"), 24, "charlie")
+
+        self._resolve_mock.side_effect = [a, c, ResolutionException]
+        self.mapper.scan_up(start_address)
+
+        # The sibling wasn't queried
+        self.assertEqual(
+            [
+                call(Subnet(Address("11.0.0.0"), 32)),
+                call(Subnet(Address("11.0.2.0"), 32)),
+                call(Subnet(Address("11.0.3.0"), 32)),
+            ],
+            self._resolve_mock.mock_calls
+        )
+        self.assertEqual(
+            [parent, a, b, c],
+            list(self.mock_data_mgr.all_records().order_by(
+                AssignedSubnet.mapped_network, AssignedSubnet.mapped_prefix_length
+            ))
+        )
+
     def test_not_contiguous_subnets(self):
         start_address = Address((10, 0, 0, 0))
         a = AssignedSubnet(Address("10.0.0.0"), 8, "alpha")
@@ -102,3 +170,301 @@ class test_Mapper(TestCase):
             [],
             [s for s in self.mock_data_mgr.all_records().order_by(AssignedSubnet.mapped_network)],
         )
+
+    def test_misaligned_range(self):
+        start_address = Address((1, 2, 3, 0))
+        a, b = AssignedSubnet.from_range(
+            Address("1.2.3.0"), Address("1.2.5.255"), "alpha"
+        )
+        c = AssignedSubnet(Address("1.2.6.0"), 24, "bravo")
+
+        self._resolve_mock.side_effect = [
+            a, c, ResolutionException,
+        ]
+        self.mapper.scan_up(start_address)
+
+        # The whole range is skipped over in one go
+        self.assertEqual(
+            [
+                call(Subnet(Address("1.2.3.0"), 32)),
+                call(Subnet(Address("1.2.6.0"), 32)),
+                call(Subnet(Address("1.2.7.0"), 32)),
+            ],
+            self._resolve_mock.mock_calls
+        )
+
+        # All subnets in the range are saved to the DB
+        self.assertEqual(
+            [a, b, c],
+            [s for s in self.mock_data_mgr.all_records().order_by(AssignedSubnet.mapped_network)],
+        )
+
+    def test_scan_addr_in_later_subnet_of_range(self):
+        start_address = Address((1, 2, 4, 10))
+        a, b = AssignedSubnet.from_range(
+            Address("1.2.3.0"), Address("1.2.5.255"), "alpha"
+        )
+
+        self._resolve_mock.side_effect = [
+            a, ResolutionException,
+        ]
+        self.mapper.scan_up(start_address)
+
+        self.assertEqual(
+            [
+                call(Subnet(Address("1.2.4.10"), 32)),
+                call(Subnet(Address("1.2.6.0"), 32)),
+            ],
+            self._resolve_mock.mock_calls
+        )
+
+class test_parallel_Mapper(TestCase):
+
+    def setUp(self):
+        sqlite_path = patch('src.metadata.orm.SQLITE_PATH', ':memory:')
+        sqlite_path.start()
+        self.addCleanup(sqlite_path.stop)
+        self.mock_data_mgr = DataManager()
+
+        delegations = [None] * 256
+        for top_byte, status, registry in (
+                (1, 'ALLOCATED', 'APNIC'), (2, 'ALLOCATED', 'RIPE NCC'),
+                (3, 'LEGACY', 'ARIN'), (4, 'RESERVED', 'IANA'),
+                (5, 'ALLOCATED', 'RIPE NCC'), (6, 'ALLOCATED', 'RIPE NCC'),
+                (7, 'ALLOCATED', 'ARIN')):
+            tld = Mock(
+                registry=registry,
+                delegation_subnet=Subnet(Address((top_byte, 0, 0, 0)), 8)
+            )
+            tld.is_mappable = Mock(return_value=status != 'RESERVED')
+            delegations[top_byte] = tld
+
+        self._resolver_mock = Mock()
+        self._resolver_mock.top_level_delegations = Mock(return_value=delegations)
+        # Workers get their own resolver
+        self._resolver_mock.clone = Mock(return_value=self._resolver_mock)
+        self._resolver_mock.resolve = Mock(side_effect=self._resolve)
+        self.resolver_patch = patch(
+            'src.metadata.mapper.DelegationResolver',
+            Mock(return_value=self._resolver_mock)
+        )
+        self.resolver_patch.start()
+        self.addCleanup(self.resolver_patch.stop)
+        self.mapper = SubnetMapper(self.mock_data_mgr)
+
+    @staticmethod
+    def _resolve(network):
+        # Every /8 is made of two /9s, except 5/8 which can't be resolved
+        address = network.floor()
+        top_byte = int(address) >> 24
+        if top_byte == 5:
+            raise ResolutionException("Nope")
+        return AssignedSubnet((network % 9).floor(), 9, "NET-{0}".format(address))
+
+    def test_work_units(self):
+        self.assertEqual(
+            [
+                (Address('1.0.0.0'), Address('1.255.255.255')),
+                (Address('2.0.0.0'), Address('2.255.255.255')),
+                (Address('3.0.0.0'), Address('3.255.255.255')),
+                (Address('5.0.0.0'), Address('5.255.255.255')),
+                (Address('6.0.0.0'), Address('6.255.255.255')),
+                (Address('7.0.0.0'), Address('7.255.255.255')),
+            ],
+            sorted(self.mapper.work_units(Address('0.0.0.0')))
+        )
+        # Registries are interleaved
+        self.assertEqual(
+            ['1.0.0.0', '2.0.0.0', '3.0.0.0', '5.0.0.0', '7.0.0.0', '6.0.0.0'],
+            [str(first) for first, _ in self.mapper.work_units(Address('0.0.0.0'))]
+        )
+        self.assertEqual(
+            [
+                (Address('1.128.0.0'), Address('1.255.255.255')),
+                (Address('2.0.0.0'), Address('2.255.255.255')),
+                (Address('3.0.0.0'), Address('3.0.0.255')),
+            ],
+            self.mapper.work_units(Address('1.128.0.0'), Address('3.0.0.255'))
+        )
+
+    def test_map_parallel(self):
+        self.mapper.map_parallel(Address('1.0.0.0'), workers=3)
+
+        self.assertEqual(
+            ['1.0.0.0/9', '1.128.0.0/9', '2.0.0.0/9', '2.128.0.0/9',
+             '3.0.0.0/9', '3.128.0.0/9', '6.0.0.0/9', '6.128.0.0/9',
+             '7.0.0.0/9', '7.128.0.0/9'],
+            [
+                "{0}/{1}".format(s.network, s.prefix_length)
+                for s in self.mock_data_mgr.all_records().order_by(
+                    AssignedSubnet.mapped_network
+                )
+            ]
+        )
+        # Units stop at their end, or at the first failure
+        self.assertEqual(11, self._resolver_mock.resolve.call_count)
+
+    def test_map_parallel_worker_error(self):
+        self._resolver_mock.resolve.side_effect = KeyError
+        with self.assertRaises(KeyError):
+            self.mapper.map_parallel(Address('1.0.0.0'), workers=2)
+
+    def test_map_parallel_deferred(self):
+        resolve = self._resolve
+        deferred = []
+
+        def throttled_resolve(network):
+            # 1/8's host defers its first query, but 2/8 carries on
+            if int(network.floor()) >> 24 == 1 and not deferred:
+                deferred.append(network)
+                raise QueryDeferredException('rdap.example.org', 0.05)
+            return resolve(network)
+
+        self._resolver_mock.resolve.side_effect = throttled_resolve
+        self.mapper.map_parallel(
+            Address('1.0.0.0'), Address('2.255.255.255'), workers=1
+        )
+
+        self.assertEqual(
+            [
+                call(Subnet(Address('1.0.0.0'), 32)),
+                call(Subnet(Address('2.0.0.0'), 32)),
+                call(Subnet(Address('2.128.0.0'), 32)),
+                call(Subnet(Address('1.0.0.0'), 32)),
+                call(Subnet(Address('1.128.0.0'), 32)),
+            ],
+            self._resolver_mock.resolve.mock_calls
+        )
+        self.assertEqual(4, self.mock_data_mgr.all_records().count())
+        self._resolver_mock.clone.assert_called_with(
+            max_wait=SubnetMapper.MAX_PACING_WAIT
+        )
+
+    @patch('src.metadata.mapper.SubnetMapper.RETRY_BACKOFF', 0.001)
+    def test_map_parallel_transient_failures(self):
+        resolve = self._resolve
+        failures = [
+            WhoisConnectionException("Connection reset"),
+            RateLimitationException("Whois rate limitation", retry_after=0.01),
+        ]
+
+        def flaky_resolve(network):
+            if int(network.floor()) >> 24 == 2:
+                raise WhoisConnectionException("Unreachable")
+            if failures:
+                raise failures.pop()
+            return resolve(network)
+
+        self._resolver_mock.resolve.side_effect = flaky_resolve
+        self.mapper.map_parallel(
+            Address('1.0.0.0'), Address('2.255.255.255'), workers=2
+        )
+
+        # 1/8 is mapped in spite of the transient failures, 2/8 is given up
+        # on once out of retries
+        self.assertEqual(
+            ['1.0.0.0/9', '1.128.0.0/9'],
+            [
+                "{0}/{1}".format(s.network, s.prefix_length)
+                for s in self.mock_data_mgr.all_records().order_by(
+                    AssignedSubnet.mapped_network
+                )
+            ]
+        )
+        self.assertEqual(
+            SubnetMapper.RETRY_LIMIT + 1,
+            self._resolver_mock.resolve.mock_calls.count(
+                call(Subnet(Address('2.0.0.0'), 32))
+            )
+        )
+        # ...and recorded as a range failure
+        self.assertEqual(
+            [Subnet(Address('2.0.0.0'), 32)],
+            [
+                c.args[0]
+                for c in self._resolver_mock.record_failure.mock_calls
+            ]
+        )
+
+    def test_map_parallel_long_deferral(self):
+        resolve = self._resolve
+
+        def dead_whois_resolve(network):
+            if int(network.floor()) >> 24 == 2:
+                raise QueryDeferredException(
+                    'whois.example.org', SubnetMapper.MAX_DEFERRAL + 1
+                )
+            return resolve(network)
+
+        self._resolver_mock.resolve.side_effect = dead_whois_resolve
+        self.mapper.map_parallel(
+            Address('1.0.0.0'), Address('2.255.255.255'), workers=2
+        )
+
+        # 2/8 is given up on straight away
+        self.assertEqual(3, self._resolver_mock.resolve.call_count)
+        self.assertEqual(2, self.mock_data_mgr.all_records().count())
+
+    def _async_resolve(self, resolve=None):
+        resolve = resolve or self._resolve
+
+        async def resolve_async(network, rdap_resolver, whois):
+            self.assertIs(
+                self._resolver_mock.async_RDAP_resolver.return_value,
+                rdap_resolver
+            )
+            # The scans' whois fallbacks are batched
+            self.assertIsInstance(whois.__self__, WhoisBatcher)
+            return resolve(network)
+        return resolve_async
+
+    def test_map_async(self):
+        self._resolver_mock.resolve_async = Mock(
+            side_effect=self._async_resolve()
+        )
+        self.mapper.map_async(Address('1.0.0.0'), scans=3)
+
+        self.assertEqual(
+            ['1.0.0.0/9', '1.128.0.0/9', '2.0.0.0/9', '2.128.0.0/9',
+             '3.0.0.0/9', '3.128.0.0/9', '6.0.0.0/9', '6.128.0.0/9',
+             '7.0.0.0/9', '7.128.0.0/9'],
+            [
+                "{0}/{1}".format(s.network, s.prefix_length)
+                for s in self.mock_data_mgr.all_records().order_by(
+                    AssignedSubnet.mapped_network
+                )
+            ]
+        )
+        # The scans share one RDAP resolver
+        self._resolver_mock.async_RDAP_resolver.assert_called_once_with(None)
+        self.assertEqual(3, self._resolver_mock.clone.call_count)
+        self.assertEqual([], self._resolver_mock.resolve.mock_calls)
+
+    @patch('src.metadata.mapper.SubnetMapper.RETRY_BACKOFF', 0.001)
+    def test_map_async_transient_failures(self):
+        resolve = self._resolve
+        failures = [WhoisConnectionException("Connection reset")]
+
+        def flaky_resolve(network):
+            if int(network.floor()) >> 24 == 2:
+                raise WhoisConnectionException("Unreachable")
+            if failures:
+                raise failures.pop()
+            return resolve(network)
+
+        self._resolver_mock.resolve_async = Mock(
+            side_effect=self._async_resolve(flaky_resolve)
+        )
+        self.mapper.map_async(
+            Address('1.0.0.0'), Address('2.255.255.255'), scans=2
+        )
+
+        self.assertEqual(2, self.mock_data_mgr.all_records().count())
+        self.assertEqual(
+            SubnetMapper.RETRY_LIMIT + 1,
+            [c.args[0] for c in self._resolver_mock.resolve_async.mock_calls]
+            .count(Subnet(Address('2.0.0.0'), 32))
+        )
+        self._resolver_mock.record_failure.assert_called_once_with(
+            Subnet(Address('2.0.0.0'), 32), ANY
+        )
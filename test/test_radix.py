@@ -0,0 +1,171 @@
+from unittest import TestCase
+import random
+
+from src.net.IPv4 import Address, Subnet
+from src.net.arrays import AddressArray
+from src.net.radix import RadixTree
+
+def _subnet(cidr):
+    network, prefix_length = cidr.split('/')
+    return Subnet(Address(network), int(prefix_length))
+
+class test_RadixTree(TestCase):
+
+    def setUp(self):
+        self.cidrs = [
+            '0.0.0.0/0', '10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24',
+            '10.1.3.0/24', '10.128.0.0/9', '192.168.0.0/16', '8.8.8.8/32',
+        ]
+        self.tree = RadixTree((_subnet(c), c) for c in self.cidrs)
+
+    def test_len_and_contains(self):
+        self.assertEqual(len(self.cidrs), len(self.tree))
+        for cidr in self.cidrs:
+            self.assertIn(_subnet(cidr), self.tree)
+            self.assertEqual(cidr, self.tree[_subnet(cidr)])
+        self.assertNotIn(_subnet('10.0.0.0/9'), self.tree)
+        with self.assertRaises(KeyError):
+            self.tree[_subnet('10.1.0.0/17')]
+
+    def test_replace_payload(self):
+        self.tree[_subnet('10.1.0.0/16')] = 'foo'
+        self.assertEqual(len(self.cidrs), len(self.tree))
+        self.assertEqual('foo', self.tree[_subnet('10.1.0.0/16')])
+
+    def test_insert_invalid(self):
+        with self.assertRaises(TypeError):
+            self.tree.insert(Address('1.2.3.4'))
+
+    def test_longest_match(self):
+        expected = {
+            '10.1.2.3': '10.1.2.0/24',
+            '10.1.4.1': '10.1.0.0/16',
+            '10.200.0.0': '10.128.0.0/9',
+            '10.2.0.0': '10.0.0.0/8',
+            '8.8.8.8': '8.8.8.8/32',
+            '8.8.8.9': '0.0.0.0/0',
+            '255.255.255.255': '0.0.0.0/0',
+        }
+        for address, cidr in expected.items():
+            subnet, payload = self.tree.longest_match(Address(address))
+            self.assertEqual(cidr, payload)
+            self.assertEqual(_subnet(cidr), subnet)
+
+        _, payload = self.tree.longest_match(_subnet('10.1.0.0/23'))
+        self.assertEqual('10.1.0.0/16', payload)
+        _, payload = self.tree.longest_match(_subnet('10.1.3.0/24'))
+        self.assertEqual('10.1.3.0/24', payload)
+
+    def test_longest_match_missing(self):
+        tree = RadixTree([(_subnet('10.0.0.0/8'), None)])
+        with self.assertRaises(KeyError):
+            tree.longest_match(Address('11.0.0.0'))
+        with self.assertRaises(KeyError):
+            tree.longest_match(_subnet('10.0.0.0/7'))
+        with self.assertRaises(KeyError):
+            RadixTree().longest_match(Address('11.0.0.0'))
+
+    def test_covering(self):
+        self.assertEqual(
+            ['0.0.0.0/0', '10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24'],
+            [p for _, p in self.tree.covering(Address('10.1.2.3'))]
+        )
+        self.assertEqual(
+            ['0.0.0.0/0', '10.0.0.0/8'],
+            [p for _, p in self.tree.covering(_subnet('10.0.0.0/8'))]
+        )
+
+    def test_subtree(self):
+        self.assertEqual(
+            ['10.1.0.0/16', '10.1.2.0/24', '10.1.3.0/24'],
+            [p for _, p in self.tree.subtree(_subnet('10.1.0.0/16'))]
+        )
+        self.assertEqual(
+            ['10.1.2.0/24', '10.1.3.0/24'],
+            [p for _, p in self.tree.subtree(_subnet('10.1.2.0/23'))]
+        )
+        self.assertEqual(
+            [], list(self.tree.subtree(_subnet('10.1.4.0/24')))
+        )
+        self.assertEqual(
+            sorted(self.cidrs, key=lambda c: (_subnet(c).floor(), _subnet(c).prefix_length)),
+            [p for _, p in self.tree.items()]
+        )
+        self.assertEqual([_subnet(c) for c in self.cidrs[:1]], list(self.tree)[:1])
+
+    def test_delete(self):
+        del self.tree[_subnet('10.1.0.0/16')]
+        self.assertEqual(len(self.cidrs) - 1, len(self.tree))
+        self.assertNotIn(_subnet('10.1.0.0/16'), self.tree)
+        _, payload = self.tree.longest_match(Address('10.1.4.1'))
+        self.assertEqual('10.0.0.0/8', payload)
+        _, payload = self.tree.longest_match(Address('10.1.3.1'))
+        self.assertEqual('10.1.3.0/24', payload)
+
+        with self.assertRaises(KeyError):
+            self.tree.delete(_subnet('10.1.0.0/16'))
+        with self.assertRaises(KeyError):
+            self.tree.delete(_subnet('10.1.2.0/23'))
+
+        for cidr in self.cidrs:
+            if _subnet(cidr) in self.tree:
+                self.tree.delete(_subnet(cidr))
+        self.assertEqual(0, len(self.tree))
+        self.assertIsNone(self.tree._root)
+
+    def test_agrees_with_linear_scan(self):
+        rng = random.Random(7)
+        subnets = [
+            Subnet(Address(rng.getrandbits(32) & 0x0FFFFFFF), rng.randint(4, 32))
+            for _ in range(300)
+        ]
+        tree = RadixTree((s, s) for s in subnets)
+        for subnet in subnets[::3]:
+            if subnet in tree:
+                tree.delete(subnet)
+        remaining = list(tree)
+        addresses = [Address(rng.getrandbits(32) & 0x1FFFFFFF) for _ in range(2000)]
+        addresses += [s.floor() for s in remaining] + [s.ceiling() for s in remaining]
+
+        def expected(address):
+            candidates = [s for s in remaining if address in s]
+            return max(candidates, key=lambda s: s.prefix_length, default=None)
+
+        # The first lookups walk the tree, later ones use the flat table
+        for address in addresses:
+            try:
+                subnet, payload = tree.longest_match(address)
+            except KeyError:
+                subnet = None
+            self.assertEqual(expected(address), subnet)
+        self.assertIsNotNone(tree._range_starts)
+
+        matches = tree.longest_matches(AddressArray.from_addresses(addresses))
+        self.assertEqual(
+            [expected(a) for a in addresses],
+            [m and m[0] for m in matches]
+        )
+        self.assertEqual(matches, tree.longest_matches(addresses))
+
+    def test_flat_table_invalidated(self):
+        self.tree.longest_matches([Address('10.1.4.1')])
+        self.tree.insert(_subnet('10.1.4.0/24'), 'new')
+        self.assertEqual(
+            [(_subnet('10.1.4.0/24'), 'new')],
+            self.tree.longest_matches([Address('10.1.4.1')])
+        )
+        self.assertEqual(
+            [None], RadixTree().longest_matches([int(Address('10.1.4.1'))])
+        )
+
+    def test_build(self):
+        self.tree.build()
+        starts = self.tree._range_starts
+        self.assertIsNotNone(starts)
+        self.assertEqual(
+            (_subnet('10.1.2.0/24'), '10.1.2.0/24'),
+            self.tree.longest_match(Address('10.1.2.3'))
+        )
+        # Lookups use the table as it is
+        self.assertIs(starts, self.tree._range_starts)
+        self.assertEqual(0, self.tree._stale_lookups)
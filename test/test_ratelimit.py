@@ -0,0 +1,121 @@
+from unittest import TestCase
+from email.utils import formatdate
+import asyncio
+
+from src.metadata import QueryDeferredException
+from src.metadata.ratelimit import HostRateLimiter, parse_retry_after
+
+class FakeClock(object):
+    '''
+    A monotonic clock that only moves when something sleeps
+    '''
+
+    def __init__(self):
+        self.time = 1000.0
+        self.sleeps = []
+
+    def now(self):
+        return self.time
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.time += delay
+
+    def limiter(self, **kwargs):
+        return HostRateLimiter(clock=self.now, sleep=self.sleep, **kwargs)
+
+class test_parse_retry_after(TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(120, parse_retry_after('120'))
+        self.assertEqual(5, parse_retry_after(' 5 '))
+
+    def test_http_date(self):
+        now = 1500000000
+        self.assertEqual(30, parse_retry_after(formatdate(now + 30, usegmt=True), now))
+        self.assertEqual(0, parse_retry_after(formatdate(now - 30, usegmt=True), now))
+
+    def test_unusable(self):
+        for value in (None, '', 'soon', '-5', 42):
+            self.assertIsNone(parse_retry_after(value))
+
+class test_host_rate_limiter(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = self.clock.limiter()
+
+    def test_burst_then_paced(self):
+        for _ in range(HostRateLimiter.BURST + 3):
+            self.limiter.wait('rdap.example.org')
+        self.assertEqual(3 * [1 / HostRateLimiter.INITIAL_RATE], self.clock.sleeps)
+
+    def test_hosts_are_independent(self):
+        for _ in range(HostRateLimiter.BURST):
+            self.limiter.wait('rdap.example.org')
+        self.limiter.wait('whois.example.org')
+        self.assertEqual([], self.clock.sleeps)
+
+    def test_initial_host_rate(self):
+        limiter = self.clock.limiter(host_rates={'fast.example.org': 10.0})
+        self.assertEqual(10.0, limiter.rate('fast.example.org'))
+        self.assertEqual(HostRateLimiter.INITIAL_RATE, limiter.rate('example.org'))
+
+    def test_additive_increase(self):
+        for _ in range(5):
+            self.limiter.succeeded('rdap.example.org')
+        self.assertAlmostEqual(
+            HostRateLimiter.INITIAL_RATE + 5 * HostRateLimiter.RATE_INCREASE,
+            self.limiter.rate('rdap.example.org')
+        )
+        limiter = self.clock.limiter(host_rates={'rdap.example.org': HostRateLimiter.MAX_RATE})
+        limiter.succeeded('rdap.example.org')
+        self.assertEqual(HostRateLimiter.MAX_RATE, limiter.rate('rdap.example.org'))
+
+    def test_multiplicative_decrease(self):
+        self.limiter.throttle('rdap.example.org')
+        self.assertEqual(0.5, self.limiter.rate('rdap.example.org'))
+        # The bucket is emptied, so the next query waits for the new rate
+        self.limiter.wait('rdap.example.org')
+        self.assertEqual([2.0], self.clock.sleeps)
+
+        for _ in range(20):
+            self.limiter.throttle('rdap.example.org')
+        self.assertEqual(HostRateLimiter.MIN_RATE, self.limiter.rate('rdap.example.org'))
+
+    def test_retry_after(self):
+        self.limiter.throttle('rdap.example.org', retry_after=30)
+        self.limiter.wait('rdap.example.org')
+        self.limiter.wait('rdap.example.org')
+        self.assertEqual([30, 2.0], self.clock.sleeps)
+
+    def test_tokens_refill(self):
+        for _ in range(HostRateLimiter.BURST):
+            self.limiter.wait('rdap.example.org')
+        self.clock.time += 60
+        for _ in range(HostRateLimiter.BURST):
+            self.limiter.wait('rdap.example.org')
+        self.assertEqual([], self.clock.sleeps)
+
+    def test_max_wait(self):
+        deferring = self.limiter.with_max_wait(0.5)
+        for _ in range(HostRateLimiter.BURST):
+            deferring.wait('rdap.example.org')
+        with self.assertRaises(QueryDeferredException) as ex:
+            deferring.wait('rdap.example.org')
+        self.assertEqual('rdap.example.org', ex.exception.host)
+        self.assertEqual(1 / HostRateLimiter.INITIAL_RATE, ex.exception.retry_after)
+        self.assertEqual([], self.clock.sleeps)
+
+        # Deferring didn't take a token, and the original limiter still waits
+        self.clock.time += 1 / HostRateLimiter.INITIAL_RATE
+        deferring.wait('rdap.example.org')
+        self.limiter.wait('rdap.example.org')
+        self.assertEqual([1 / HostRateLimiter.INITIAL_RATE], self.clock.sleeps)
+
+    def test_wait_async(self):
+        limiter = HostRateLimiter(host_rates={'rdap.example.org': 1000.0})
+        async def many_waits():
+            for _ in range(HostRateLimiter.BURST + 10):
+                await limiter.wait_async('rdap.example.org')
+        asyncio.run(many_waits())
@@ -0,0 +1,133 @@
+from unittest import TestCase
+from mock import patch, Mock, call
+import json
+import os
+import shutil
+import tempfile
+import requests
+import time
+
+from src.metadata.RDAP_bootstrap import (
+    parse_RDAP_bootstrap, populate_RDAP_bootstrap
+)
+from src.metadata.RDAP import RDAP_Resolver
+from src.metadata.constants import RDAP_BOOTSTRAP_MAX_AGE
+from src.net.IPv4 import Subnet, Address
+
+class test_RDAP_bootstrap(TestCase):
+
+    bootstrap = {
+        "description": "RDAP bootstrap file for IPv4 address allocations",
+        "publication": "2024-01-01T00:00:00Z",
+        "services": [
+            [
+                ["41.0.0.0/8", "102.0.0.0/8"],
+                ["https://rdap.afrinic.net/rdap/", "http://rdap.afrinic.net/rdap/"]
+            ],
+            [
+                ["193.0.0.0/8"],
+                ["https://rdap.db.ripe.net/"]
+            ],
+            [
+                ["193.1.0.0/16"],
+                ["https://rdap.arin.net/registry/", "http://rdap.arin.net/registry/"]
+            ],
+        ],
+        "version": "1.0"
+    }
+
+    def setUp(self):
+        bootstrap_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, bootstrap_dir)
+        self.bootstrap_path = os.path.join(bootstrap_dir, 'rdap-ipv4.json')
+
+    def _write_bootstrap(self, age, bootstrap=None):
+        with open(self.bootstrap_path, 'w') as bootstrap_file:
+            json.dump(bootstrap or self.bootstrap, bootstrap_file)
+        mtime = time.time() - age
+        os.utime(self.bootstrap_path, (mtime, mtime))
+
+    def _response(self, status_code=200, body=None):
+        response = Mock(status_code=status_code, ok=status_code < 400)
+        if body is None:
+            body = json.dumps(self.bootstrap)
+        response.iter_content = lambda chunk_size: [body.encode('utf-8')]
+        return response
+
+    def test_parse(self):
+        self._write_bootstrap(0)
+        prefixes = parse_RDAP_bootstrap(self.bootstrap_path)
+        self.assertEqual(4, len(prefixes))
+
+        subnet, URLs = prefixes.longest_match(Address('102.3.4.5'))
+        self.assertEqual(Subnet(Address('102.0.0.0'), 8), subnet)
+        self.assertEqual(
+            ('https://rdap.afrinic.net/rdap', 'http://rdap.afrinic.net/rdap'),
+            URLs
+        )
+        # The most specific prefix wins
+        _, URLs = prefixes.longest_match(Subnet(Address('193.1.2.0'), 24))
+        self.assertEqual('https://rdap.arin.net/registry', URLs[0])
+        _, URLs = prefixes.longest_match(Address('193.2.0.1'))
+        self.assertEqual(('https://rdap.db.ripe.net',), URLs)
+        with self.assertRaises(KeyError):
+            prefixes.longest_match(Address('11.0.0.1'))
+
+    @patch('src.metadata.IANA_IPv4_assignments.requests.get')
+    def test_populate_download(self, mock_get):
+        mock_get.return_value = self._response()
+        prefixes = populate_RDAP_bootstrap(self.bootstrap_path)
+        self.assertEqual(4, len(prefixes))
+        self.assertEqual(
+            [call('https://data.iana.org/rdap/ipv4.json', headers={}, stream=True)],
+            mock_get.mock_calls
+        )
+        self.assertTrue(os.path.exists(self.bootstrap_path))
+
+    @patch('src.metadata.IANA_IPv4_assignments.requests.get')
+    def test_populate_fresh_local_copy(self, mock_get):
+        self._write_bootstrap(RDAP_BOOTSTRAP_MAX_AGE - 60)
+        self.assertEqual(4, len(populate_RDAP_bootstrap(self.bootstrap_path)))
+        self.assertEqual([], mock_get.mock_calls)
+
+    @patch('src.metadata.IANA_IPv4_assignments.requests.get')
+    def test_populate_broken_download(self, mock_get):
+        self._write_bootstrap(RDAP_BOOTSTRAP_MAX_AGE + 60)
+        mock_get.return_value = self._response(body='{"services": [[')
+
+        # The stale local copy is still used
+        self.assertEqual(4, len(populate_RDAP_bootstrap(self.bootstrap_path)))
+        self.assertIn('If-Modified-Since', mock_get.call_args[1]['headers'])
+
+    @patch('src.metadata.IANA_IPv4_assignments.requests.get')
+    def test_populate_offline(self, mock_get):
+        mock_get.side_effect = requests.ConnectionError("No network")
+        self.assertIsNone(populate_RDAP_bootstrap(self.bootstrap_path))
+        self.assertIsNone(populate_RDAP_bootstrap(self.bootstrap_path, offline=True))
+        self.assertEqual(1, mock_get.call_count)
+
+    def test_RDAP_URL(self):
+        self._write_bootstrap(0)
+        delegation_rslvr = Mock()
+        delegation_rslvr.get_top_level_assignment = Mock(
+            return_value=Mock(rdap_URLs=['http://rdap.example.org/'])
+        )
+        rslvr = RDAP_Resolver(
+            delegation_rslvr, bootstrap=parse_RDAP_bootstrap(self.bootstrap_path)
+        )
+
+        self.assertEqual(
+            'https://rdap.arin.net/registry/ip/193.1.2.0',
+            rslvr._RDAP_URL(Subnet(Address('193.1.2.0'), 24))
+        )
+        self.assertEqual(
+            'https://rdap.afrinic.net/rdap/ip/41.1.2.3',
+            rslvr._RDAP_URL(Subnet(Address('41.1.2.3'), 32))
+        )
+        self.assertEqual([], delegation_rslvr.get_top_level_assignment.mock_calls)
+
+        # Prefixes that aren't in the bootstrap registry fall back on the /8
+        self.assertEqual(
+            'http://rdap.example.org/ip/11.1.2.3',
+            rslvr._RDAP_URL(Subnet(Address('11.1.2.3'), 32))
+        )
@@ -1,5 +1,7 @@
 from mock import patch, Mock, call
 from unittest import TestCase
+import json
+import requests
 
 from src.net.IPv4 import Address, Subnet
 from src.metadata.assigned import AssignedSubnet
@@ -7,6 +9,9 @@ from src.metadata.RDAP import (
     RDAP_Resolver, RDAPResolutionException, RDAPRedirectException,
     RDAPRedirectionDetected
 )
+from src.metadata.failures import FailureCache
+from src.metadata.http_cache import RDAPCache
+from test.test_ratelimit import FakeClock
 
 class test_RDAP_resolver(TestCase):
     TEST_URI = 'http://example.org/foo'
@@ -16,7 +21,8 @@ class test_RDAP_resolver(TestCase):
     def setUp(self):
         self._delegation_rslvr = Mock()
         self._delegation_rslvr.get_top_level_assignment = Mock(return_value=42)
-        self.rslvr = RDAP_Resolver(self._delegation_rslvr)
+        self.clock = FakeClock()
+        self.rslvr = RDAP_Resolver(self._delegation_rslvr, self.clock.limiter())
 
     def test_raw_JSON_getter_success_on_first_try(self):
         response = Mock(status_code=200, is_redirect=False)
@@ -425,6 +431,28 @@ class test_RDAP_resolver(TestCase):
 
         self.assertEquals(expected_provisional_assigned_subnet, assigned_subnet)
 
+    def test_resolve_from_url_misaligned_range(self):
+        response = Mock(status_code=200, is_redirect=False)
+        response.json = Mock(return_value={
+            'startAddress': '1.2.3.0',
+            'endAddress': '1.2.5.255',
+            'name': 'foo',
+        })
+        self.rslvr._session = Mock()
+        self.rslvr._session.get = Mock(return_value=response)
+
+        assigned_subnet = self.rslvr.resolve_from_url(self.TEST_URI)
+        self.assertEquals(
+            AssignedSubnet(Address('1.2.3.0'), 24, "foo"), assigned_subnet
+        )
+        self.assertEquals(
+            (
+                AssignedSubnet(Address('1.2.3.0'), 24, "foo"),
+                AssignedSubnet(Address('1.2.4.0'), 23, "foo"),
+            ),
+            assigned_subnet.range_subnets
+        )
+
     def test_resolve_from_url_dodgy_RDAP_with_whois(self):
         response = Mock(status_code=200, is_redirect=False)
         response.json = Mock(return_value={
@@ -460,8 +488,7 @@ class test_RDAP_resolver(TestCase):
         )
         self.assertIsNone(malformed_ex.exception.whois_host)
 
-    @patch('src.metadata.RDAP.time.sleep')
-    def test_resolve_from_url_rate_limitation_on_first_request(self, mock_sleep):
+    def test_resolve_from_url_rate_limitation_on_first_request(self):
         # Does anyone even use 429? https://http.cat/429
         first_response = Mock(status_code=200, is_redirect=False)
         first_response.json = Mock(return_value={
@@ -486,13 +513,11 @@ class test_RDAP_resolver(TestCase):
             Address((10, 0, 0, 0)), 8, "foo"
         )
         self.assertEquals(expected_provisional_assigned_subnet, assigned_subnet)
-        self.assertEquals(
-            [call(self.rslvr.RATE_LIMITATION_DELAY)],
-            mock_sleep.mock_calls
-        )
+        # We slowed down instead of sleeping for a whole minute
+        self.assertEquals([2.0], self.clock.sleeps)
+        self.assertEquals(0.5 + 0.1, self.rslvr._rate_limiter.rate('example.org'))
 
-    @patch('src.metadata.RDAP.time.sleep')
-    def test_resolve_from_url_rate_limitation_out_of_retries(self, mock_sleep):
+    def test_resolve_from_url_rate_limitation_out_of_retries(self):
         # Does anyone even use 429? https://http.cat/429
         rate_lim_response = Mock(status_code=200, is_redirect=False)
         rate_lim_response.json = Mock(return_value={
@@ -510,11 +535,44 @@ class test_RDAP_resolver(TestCase):
             str(malformed_ex.exception),
         )
 
-        self.assertEquals(
-            self.rslvr.RATE_LIMITATION_RETRIES * [call(self.rslvr.RATE_LIMITATION_DELAY)],
-            mock_sleep.mock_calls
-        )
+        # Every complaint halves the query rate
+        self.assertEquals([2.0, 4.0, 8.0, 16.0], self.clock.sleeps)
 
+    def test_resolve_from_url_too_many_requests(self):
+        too_many_response = Mock(status_code=429, is_redirect=False)
+        too_many_response.headers = {'Retry-After': '20'}
+        #
+        ok_response = Mock(status_code=200, is_redirect=False)
+        ok_response.json = Mock(return_value={
+            'startAddress': '10.0.0.0',
+            'endAddress': '10.255.255.255',
+            'name': 'foo',
+        })
+
+        self.rslvr._session = Mock()
+        self.rslvr._session.get = Mock(side_effect=[too_many_response, ok_response])
+
+        assigned_subnet = self.rslvr.resolve_from_url(self.TEST_URI)
+        self.assertEquals('foo', assigned_subnet.name)
+        # Retry-After is honoured
+        self.assertEquals([20], self.clock.sleeps)
+        self.assertEquals(2, len(self.rslvr._session.get.mock_calls))
+
+    def test_requests_are_paced(self):
+        ok_response = Mock(status_code=200, is_redirect=False)
+        ok_response.json = Mock(return_value={
+            'startAddress': '10.0.0.0',
+            'endAddress': '10.255.255.255',
+            'name': 'foo',
+        })
+        self.rslvr._session = Mock()
+        self.rslvr._session.get = Mock(return_value=ok_response)
+
+        for _ in range(5):
+            self.rslvr.resolve_from_url(self.TEST_URI)
+        # Three queries in a burst, then paced at the slowly increasing rate
+        self.assertEquals(2, len(self.clock.sleeps))
+        self.assertTrue(all(0 < delay < 1 for delay in self.clock.sleeps))
 
     def test_resolve_subnet_known_RDAP_url(self):
         self._delegation_rslvr = Mock()
@@ -594,3 +652,169 @@ class test_RDAP_resolver(TestCase):
             self.rslvr._session.get.mock_calls
         )
 
+
+class test_RDAP_resolver_cache(TestCase):
+    TEST_URI = 'http://example.org/ip/11.0.0.0'
+    RDAP_BODY = b'{"startAddress": "11.0.0.0", "endAddress": "11.0.255.255", "name": "foo"}'
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = RDAPCache(':memory:', ttl=60, clock=self.clock.now)
+        self.addCleanup(self.cache.close)
+        self.rslvr = RDAP_Resolver(Mock(), self.clock.limiter(), self.cache)
+        self.rslvr._session = Mock()
+
+    def _response(self, status_code, body=b'', headers=None):
+        response = Mock(status_code=status_code, is_redirect=False, content=body)
+        response.headers = headers or {}
+        response.json = Mock(side_effect=lambda: json.loads(body.decode('utf-8')))
+        return response
+
+    def test_fresh_hit_without_network(self):
+        self.rslvr._session.get = Mock(return_value=self._response(
+            200, self.RDAP_BODY, {'ETag': '"v1"'}
+        ))
+        first = self.rslvr.resolve_from_url(self.TEST_URI)
+        second = self.rslvr.resolve_from_url(self.TEST_URI)
+
+        self.assertEqual(first, second)
+        self.assertEqual('foo', second.name)
+        self.assertEqual(
+            [call(self.TEST_URI, allow_redirects=False)],
+            self.rslvr._session.get.mock_calls
+        )
+
+    def test_stale_entry_revalidated(self):
+        self.cache.store(self.TEST_URI, 200, self.RDAP_BODY, {
+            'ETag': '"v1"', 'Last-Modified': 'Sat, 17 Oct 2026 10:00:00 GMT',
+        })
+        self.clock.time += 120
+        self.rslvr._session.get = Mock(return_value=self._response(304))
+
+        assigned = self.rslvr.resolve_from_url(self.TEST_URI)
+        self.assertEqual('foo', assigned.name)
+        self.assertEqual(
+            [call(self.TEST_URI, allow_redirects=False, headers={
+                'If-None-Match': '"v1"',
+                'If-Modified-Since': 'Sat, 17 Oct 2026 10:00:00 GMT',
+            })],
+            self.rslvr._session.get.mock_calls
+        )
+        # The entry is fresh again
+        self.assertTrue(self.cache.is_fresh(self.cache.lookup(self.TEST_URI)))
+
+    def test_stale_entry_replaced(self):
+        self.cache.store(self.TEST_URI, 200, b'{"name": "old"}', {'ETag': '"v1"'})
+        self.clock.time += 120
+        self.rslvr._session.get = Mock(return_value=self._response(
+            200, self.RDAP_BODY, {'ETag': '"v2"'}
+        ))
+
+        self.assertEqual('foo', self.rslvr.resolve_from_url(self.TEST_URI).name)
+        cached = self.cache.lookup(self.TEST_URI)
+        self.assertEqual(self.RDAP_BODY, cached.body)
+        self.assertEqual('"v2"', cached.etag)
+
+    def test_cached_redirect(self):
+        redirect = self._response(301, b'', {'Location': 'http://example.com/ip/11.0.0.0'})
+        redirect.is_redirect = True
+        self.rslvr._session.get = Mock(return_value=redirect)
+
+        for _ in range(2):
+            with self.assertRaises(RDAPRedirectException) as ex:
+                self.rslvr.resolve_from_url(self.TEST_URI)
+            self.assertEqual('http://example.com/ip/11.0.0.0', ex.exception.redir_url)
+        self.assertEqual(1, self.rslvr._session.get.call_count)
+
+    def test_errors_not_cached(self):
+        self.rslvr._session.get = Mock(return_value=self._response(404))
+        with self.assertRaises(RDAPResolutionException):
+            self.rslvr.resolve_from_url(self.TEST_URI)
+        self.assertIsNone(self.cache.lookup(self.TEST_URI))
+
+    def test_rate_limitation_notice_not_cached(self):
+        notice = json.dumps({'notices': [{'title': 'Rate Limit Exceeded'}]})
+        self.rslvr._session.get = Mock(side_effect=[
+            self._response(200, notice.encode('utf-8')),
+            self._response(200, self.RDAP_BODY),
+        ])
+        self.assertEqual('foo', self.rslvr.resolve_from_url(self.TEST_URI).name)
+        self.assertEqual(self.RDAP_BODY, self.cache.lookup(self.TEST_URI).body)
+
+class test_RDAP_resolver_failures(TestCase):
+    TEST_URI = 'http://example.org/ip/11.0.0.0'
+    HOST = 'example.org'
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.failures = FailureCache(':memory:', clock=self.clock.now)
+        self.addCleanup(self.failures.close)
+        self.rslvr = RDAP_Resolver(
+            Mock(), self.clock.limiter(), failure_cache=self.failures
+        )
+        self.rslvr._session = Mock()
+
+    def test_failing_host_skipped(self):
+        self.rslvr._session.get = Mock(side_effect=requests.ConnectionError('refused'))
+        with self.assertRaises(RDAPResolutionException):
+            self.rslvr.resolve_from_url(self.TEST_URI)
+
+        # Queries for other addresses on the same host are skipped too
+        with self.assertRaises(RDAPResolutionException) as ex:
+            self.rslvr.resolve_from_url('http://example.org/ip/11.1.0.0')
+        self.assertEqual(
+            "Skipping example.org, it failed 1 time(s): RDAP request to {0} "
+            "failed: ConnectionError('refused')".format(self.TEST_URI),
+            str(ex.exception)
+        )
+        self.assertEqual(1, self.rslvr._session.get.call_count)
+
+        # Until the failure expires
+        self.clock.time += FailureCache.ENDPOINT_TTL
+        with self.assertRaises(RDAPResolutionException):
+            self.rslvr.resolve_from_url(self.TEST_URI)
+        self.assertEqual(2, self.rslvr._session.get.call_count)
+        self.assertEqual(2, self.failures.endpoint_failure(self.HOST).failures)
+
+    def test_out_of_retries_recorded(self):
+        self.rslvr._session.get = Mock(
+            return_value=Mock(status_code=503, is_redirect=False)
+        )
+        with self.assertRaises(RDAPResolutionException):
+            self.rslvr.resolve_from_url(self.TEST_URI)
+        self.assertEqual(
+            "Out of retries for RDAP resource: {0}".format(self.TEST_URI),
+            self.failures.endpoint_failure(self.HOST).reason
+        )
+
+    def test_missing_resource_not_recorded(self):
+        # The host is fine, it just doesn't have that address
+        self.rslvr._session.get = Mock(
+            return_value=Mock(status_code=404, is_redirect=False)
+        )
+        with self.assertRaises(RDAPResolutionException):
+            self.rslvr.resolve_from_url(self.TEST_URI)
+        self.assertIsNone(self.failures.endpoint_failure(self.HOST))
+
+    def test_success_clears_failures(self):
+        self.failures.record_endpoint_failure(self.HOST, 'Out of retries')
+        self.clock.time += FailureCache.ENDPOINT_TTL
+
+        response = Mock(status_code=200, is_redirect=False)
+        response.json = Mock(return_value={
+            'startAddress': '11.0.0.0', 'endAddress': '11.0.0.255', 'name': 'foo',
+        })
+        self.rslvr._session.get = Mock(return_value=response)
+        self.rslvr.resolve_from_url(self.TEST_URI)
+
+        self.assertEqual(
+            1, self.failures.record_endpoint_failure(self.HOST, 'x').failures
+        )
+
+    def test_rate_limitation_not_recorded(self):
+        response = Mock(status_code=200, is_redirect=False)
+        response.json = Mock(return_value={'notices': [{'title': 'Rate limit exceeded'}]})
+        self.rslvr._session.get = Mock(return_value=response)
+        with self.assertRaises(RDAPResolutionException):
+            self.rslvr.resolve_from_url(self.TEST_URI)
+        self.assertIsNone(self.failures.endpoint_failure(self.HOST))
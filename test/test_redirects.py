@@ -0,0 +1,103 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+
+from src.metadata.redirects import RedirectMap, WhoisReferralMap, RDAP_base_URL
+from src.net.IPv4 import Address
+from test.test_ratelimit import FakeClock
+
+class test_RedirectMap(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.redirects = RedirectMap(':memory:', clock=self.clock.now)
+        self.addCleanup(self.redirects.close)
+
+    def test_base_URL(self):
+        self.assertEqual(
+            'https://rdap.db.ripe.net',
+            RDAP_base_URL('https://rdap.db.ripe.net/ip/193.0.0.1')
+        )
+        self.assertEqual(
+            'https://rdap.example.org/rdap',
+            RDAP_base_URL('https://rdap.example.org/rdap/ip/10.0.0.0')
+        )
+        self.assertIsNone(RDAP_base_URL('https://rdap.example.org/autnum/1'))
+
+    def test_lookup(self):
+        self.assertIsNone(self.redirects.lookup(Address('193.0.0.1')))
+        self.redirects.learn(
+            Address('193.0.0.0'), Address('193.255.255.255'), 'https://ripe'
+        )
+        self.assertEqual('https://ripe', self.redirects.lookup(Address('193.0.0.1')))
+        self.assertEqual('https://ripe', self.redirects.lookup(Address('193.255.255.255')))
+        self.assertIsNone(self.redirects.lookup(Address('192.255.255.255')))
+        self.assertIsNone(self.redirects.lookup(Address('194.0.0.0')))
+
+    def test_narrowest_range_wins(self):
+        self.redirects.learn(
+            Address('193.0.0.0'), Address('193.255.255.255'), 'https://ripe'
+        )
+        self.redirects.learn(
+            Address('193.1.0.0'), Address('193.1.0.255'), 'https://afrinic'
+        )
+        self.assertEqual('https://afrinic', self.redirects.lookup(Address('193.1.0.7')))
+        self.assertEqual('https://ripe', self.redirects.lookup(Address('193.1.1.7')))
+
+    def test_expiry_and_forget(self):
+        self.redirects.learn(
+            Address('193.0.0.0'), Address('193.255.255.255'), 'https://ripe'
+        )
+        self.clock.time += RedirectMap.DEFAULT_TTL - 1
+        self.assertEqual('https://ripe', self.redirects.lookup(Address('193.0.0.1')))
+        self.clock.time += 1
+        self.assertIsNone(self.redirects.lookup(Address('193.0.0.1')))
+
+        self.redirects.learn(
+            Address('193.0.0.0'), Address('193.255.255.255'), 'https://ripe'
+        )
+        self.redirects.forget(Address('193.4.5.6'))
+        self.assertIsNone(self.redirects.lookup(Address('193.0.0.1')))
+
+    def test_forget_keeps_other_ranges(self):
+        self.redirects.learn(
+            Address('193.0.0.0'), Address('193.255.255.255'), 'https://ripe'
+        )
+        self.redirects.learn(
+            Address('193.1.0.3'), Address('193.1.0.200'), 'https://afrinic'
+        )
+        self.redirects.learn(
+            Address('193.2.0.0'), Address('193.2.0.255'), 'https://lacnic'
+        )
+        self.redirects.forget(Address('193.2.0.1'))
+        self.assertIsNone(self.redirects.lookup(Address('193.2.0.1')))
+        self.assertIsNone(self.redirects.lookup(Address('193.1.1.7')))
+        self.assertEqual('https://afrinic', self.redirects.lookup(Address('193.1.0.7')))
+
+        self.redirects.forget(Address('193.1.0.7'))
+        self.assertIsNone(self.redirects.lookup(Address('193.1.0.7')))
+        self.assertEqual(0, len(self.redirects._ranges))
+
+    def test_reopen(self):
+        db_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, db_dir)
+        db_path = os.path.join(db_dir, 'redirects.db')
+
+        redirects = RedirectMap(db_path, clock=self.clock.now)
+        redirects.learn(
+            Address('193.0.0.0'), Address('193.255.255.255'), 'https://ripe'
+        )
+        redirects.learn(
+            Address('193.1.0.0'), Address('193.1.0.255'), 'https://afrinic'
+        )
+        redirects.close()
+
+        redirects = RedirectMap(db_path, clock=self.clock.now)
+        self.addCleanup(redirects.close)
+        self.assertEqual('https://afrinic', redirects.lookup(Address('193.1.0.7')))
+        self.assertEqual('https://ripe', redirects.lookup(Address('193.1.1.7')))
+
+        referrals = WhoisReferralMap(db_path, clock=self.clock.now)
+        self.addCleanup(referrals.close)
+        self.assertIsNone(referrals.lookup(Address('193.1.0.7')))
@@ -1,14 +1,20 @@
 from unittest import TestCase
 from mock import patch, Mock, call
+import requests
+import socket
 
 from src.metadata.IANA_IPv4_assignments import populate_IANA_IPv4_assignments
 from src.metadata.IANA_IPv4_assignments import TopLevelDelegation
 from src.metadata.assigned import AssignedSubnet
 from src.net.IPv4 import Subnet, Address
 from src.metadata.constants import reserved_networks
+from src.metadata.failures import FailureCache
+from src.metadata.redirects import RedirectMap
+from src.metadata import RateLimitationException, WhoisConnectionException
 
 from src.metadata.resolver import (
     DelegationResolver,
+    QueryDeferredException,
     RDAPRedirectException,
     RDAPResolutionException,
     ResolutionException,
@@ -20,11 +26,12 @@ class test_AssignedSubnetResolver(TestCase):
     def setUp(self, mock_populate_IANA):
         # For our purposes, let's say that all tests use addresses within
         # 11.0.0.0/8
-        eleven_dot = Subnet(Address('11.0.0.0'), 8)
         eleven_dot_delegation = TopLevelDelegation(11)
         eleven_dot_delegation.rdap_URLs = ['http://fake_rdap/']
         eleven_dot_delegation.whois_host = ['11.10.10.10']
-        mock_populate_IANA.return_value = {eleven_dot: eleven_dot_delegation}
+        top_level = [None] * 256
+        top_level[11] = eleven_dot_delegation
+        mock_populate_IANA.return_value = top_level
         self.resolver = DelegationResolver()
 
     def test_subnet_is_whole_address_space(self):
@@ -79,7 +86,7 @@ class test_AssignedSubnetResolver(TestCase):
     def test_RDAP_success_but_invalid_subnet(self):
         eleven_dot_unknown_size_subnet = Subnet(Address('11.12.13.0'), 32)
         eleven_dot_invalid_subnet = Subnet(Address('11.12.13.0'), 4)
-        eleven_dot_valid_subnet = Subnet(Address('11.12.13.0'), 24)
+        eleven_dot_valid_subnet = AssignedSubnet(Address('11.12.13.0'), 24, 'WHOIS-NET')
 
         mock_reserved_resolver = Mock(return_value=None)
         self.resolver._resolve_reserved_networks = mock_reserved_resolver
@@ -115,7 +122,7 @@ class test_AssignedSubnetResolver(TestCase):
 
     def test_RDAP_redirect_then_success(self):
         eleven_dot_unknown_size_subnet = Subnet(Address('11.12.13.0'), 32)
-        eleven_dot_valid_subnet = Subnet(Address('11.12.13.0'), 24)
+        eleven_dot_valid_subnet = AssignedSubnet(Address('11.12.13.0'), 24, 'WHOIS-NET')
 
         mock_reserved_resolver = Mock(return_value=None)
         self.resolver._resolve_reserved_networks = mock_reserved_resolver
@@ -265,7 +272,7 @@ class test_AssignedSubnetResolver(TestCase):
 
     def test_RDAP_failure_then_whois_success(self):
         eleven_dot_unknown_size_subnet = Subnet(Address('11.12.13.0'), 32)
-        eleven_dot_valid_subnet = Subnet(Address('11.12.13.0'), 24)
+        eleven_dot_valid_subnet = AssignedSubnet(Address('11.12.13.0'), 24, 'WHOIS-NET')
 
         mock_reserved_resolver = Mock(return_value=None)
         self.resolver._resolve_reserved_networks = mock_reserved_resolver
@@ -304,6 +311,158 @@ class test_AssignedSubnetResolver(TestCase):
 
         self.assertTrue(resolved_assignment is eleven_dot_valid_subnet)
 
+    def test_whois_related_ranges(self):
+        eleven_dot_unknown_size_subnet = Subnet(Address('11.12.13.0'), 32)
+        whois_assignment = AssignedSubnet(Address('11.12.13.0'), 24, 'WHOIS-NET')
+        parent = AssignedSubnet(Address('11.0.0.0'), 8, 'PARENT-NET')
+        whole_space = AssignedSubnet(Address('0.0.0.0'), 0, 'IANA-BLK')
+        whois_assignment.related_ranges = ((parent,), (whole_space,))
+
+        self.resolver._resolve_reserved_networks = Mock(return_value=None)
+        self.resolver._rdap_resolver.resolve_from_url = Mock(
+            side_effect=RDAPResolutionException("Could not resolve using RDAP")
+        )
+        self.resolver._whois_resolver = Mock()
+        self.resolver._whois_resolver.resolve = Mock(return_value=whois_assignment)
+
+        resolved_assignment = self.resolver.resolve(eleven_dot_unknown_size_subnet)
+        # Assignments that would fail validation aren't kept
+        self.assertEqual(((parent,),), resolved_assignment.related_ranges)
+
+    def test_RDAP_network_error_then_whois(self):
+        eleven_dot_unknown_size_subnet = Subnet(Address('11.12.13.0'), 32)
+        eleven_dot_valid_subnet = AssignedSubnet(Address('11.12.13.0'), 24, 'WHOIS-NET')
+        self.resolver._rdap_resolver._session = Mock()
+        self.resolver._rdap_resolver._session.get = Mock(
+            side_effect=requests.ConnectionError('refused')
+        )
+        self.resolver._whois_resolver = Mock()
+        self.resolver._whois_resolver.resolve = Mock(return_value=eleven_dot_valid_subnet)
+
+        resolved_assignment = self.resolver.resolve(eleven_dot_unknown_size_subnet)
+        self.assertTrue(resolved_assignment is eleven_dot_valid_subnet)
+
+    def test_RDAP_deferred_no_whois(self):
+        eleven_dot_unknown_size_subnet = Subnet(Address('11.12.13.0'), 32)
+
+        self.resolver._rdap_resolver.resolve_from_url = Mock(
+            side_effect=QueryDeferredException('fake_rdap', 12.0)
+        )
+        mock_whois_resolver = Mock()
+        self.resolver._whois_resolver = mock_whois_resolver
+
+        with self.assertRaises(QueryDeferredException) as ex:
+            self.resolver.resolve(eleven_dot_unknown_size_subnet)
+        self.assertEqual(12.0, ex.exception.retry_after)
+
+        # Deferred queries are retried later, not handed over to whois
+        self.assertEqual([], mock_whois_resolver.resolve.mock_calls)
+
+    def _failing_resolver(self, whois_exception):
+        failures = FailureCache(':memory:')
+        self.addCleanup(failures.close)
+        resolver = DelegationResolver(
+            self.resolver.top_level_delegations(), failure_cache=failures
+        )
+        resolver._rdap_resolver.resolve_from_url = Mock(
+            side_effect=RDAPResolutionException("Could not resolve using RDAP")
+        )
+        resolver._whois_resolver.resolve = Mock(side_effect=whois_exception)
+        return resolver, failures
+
+    def test_unresolvable_address_skipped(self):
+        resolver, failures = self._failing_resolver(
+            ResolutionException("No inetnum in whois record")
+        )
+        network = Subnet(Address('11.12.13.0'), 32)
+        with self.assertRaises(ResolutionException):
+            resolver.resolve(network)
+        self.assertEqual(
+            "No inetnum in whois record",
+            failures.range_failure(Address('11.12.13.0')).reason
+        )
+
+        with self.assertRaises(ResolutionException) as ex:
+            resolver.resolve(network)
+        self.assertEqual(
+            "Skipping {0!r}, it failed 1 time(s): No inetnum in whois record".format(network),
+            str(ex.exception)
+        )
+        # Neither RDAP nor whois were queried again
+        self.assertEqual(1, resolver._rdap_resolver.resolve_from_url.call_count)
+        self.assertEqual(1, resolver._whois_resolver.resolve.call_count)
+
+    def test_rate_limitation_not_recorded(self):
+        resolver, failures = self._failing_resolver(
+            RateLimitationException("Whois rate limitation by whois.example.org")
+        )
+        with self.assertRaises(RateLimitationException):
+            resolver.resolve(Subnet(Address('11.12.13.0'), 32))
+        self.assertIsNone(failures.range_failure(Address('11.12.13.0')))
+
+    def test_whois_timeout_not_recorded(self):
+        resolver, failures = self._failing_resolver(None)
+        del resolver._whois_resolver.resolve
+        resolver._rdap_resolver.resolve_from_url.side_effect = \
+            RDAPResolutionException(
+                "Could not resolve using RDAP", whois_host='whois.example.org'
+            )
+
+        def timing_out(whois_host, query):
+            raise socket.timeout("timed out")
+            yield
+
+        resolver._whois_resolver._client.query_lines = Mock(
+            side_effect=timing_out
+        )
+        with self.assertRaises(WhoisConnectionException):
+            resolver.resolve(Subnet(Address('11.12.13.0'), 32))
+        # The mapper decides whether to retry
+        self.assertIsNone(failures.range_failure(Address('11.12.13.0')))
+
+    def test_resolve_whois_many(self):
+        resolver, failures = self._failing_resolver(None)
+        valid = AssignedSubnet(Address('11.12.13.0'), 24, 'WHOIS-NET')
+        too_large = AssignedSubnet(Address('0.0.0.0'), 0, 'EVERYTHING')
+        not_found = ResolutionException("No inetnum in whois record")
+        resolver._whois_resolver.resolve_many = Mock(
+            return_value=[valid, too_large, not_found]
+        )
+        networks = [
+            Subnet(Address('11.12.13.0'), 32),
+            Subnet(Address('11.12.14.0'), 32),
+            Subnet(Address('11.12.15.0'), 32),
+        ]
+
+        results = resolver.resolve_whois_many(networks, 'whois.example.org')
+        self.assertIs(valid, results[0])
+        self.assertEqual("Whole address space!", str(results[1]))
+        self.assertIs(not_found, results[2])
+        resolver._whois_resolver.resolve_many.assert_called_once_with(
+            networks, 'whois.example.org'
+        )
+        # Failures are recorded like resolve()'s
+        self.assertIsNone(failures.range_failure(Address('11.12.13.0')))
+        self.assertEqual(
+            "Whole address space!",
+            failures.range_failure(Address('11.12.14.0')).reason
+        )
+        self.assertEqual(
+            "No inetnum in whois record",
+            failures.range_failure(Address('11.12.15.0')).reason
+        )
+
+    def test_clone_max_wait(self):
+        clone = self.resolver.clone()
+        self.assertIs(self.resolver._rate_limiter, clone._rate_limiter)
+
+        deferring_clone = self.resolver.clone(max_wait=1.5)
+        self.assertEqual(1.5, deferring_clone._rate_limiter._max_wait)
+        self.assertIs(
+            self.resolver._rate_limiter._buckets,
+            deferring_clone._rate_limiter._buckets
+        )
+
     def test_no_delegation(self):
         s = Subnet(Address("12.13.14.0"), 24)
         with self.assertRaises(ResolutionException) as ex:
@@ -314,3 +473,99 @@ class test_AssignedSubnetResolver(TestCase):
             "Couldn't find top-level delegation for {0}".format(repr(slash_eight)),
             str(ex.exception)
         )
+
+    def _redirecting_resolver(self):
+        redirects = RedirectMap(':memory:')
+        self.addCleanup(redirects.close)
+        resolver = DelegationResolver(
+            self.resolver.top_level_delegations(), redirect_map=redirects
+        )
+        return resolver, redirects
+
+    def test_redirect_learned(self):
+        resolver, redirects = self._redirecting_resolver()
+        provisional, *_ = AssignedSubnet.from_range(
+            Address('11.12.0.0'), Address('11.13.255.255'), "NET-ERX"
+        )
+        authoritative = AssignedSubnet(Address('11.12.13.0'), 24, "AUTH")
+        resolver._rdap_resolver.resolve_from_url = Mock(side_effect=[
+            RDAPRedirectException(
+                "Redirection",
+                redir_url='http://other_fake_rdap/ip/11.12.13.0',
+                provisional=provisional,
+            ),
+            authoritative,
+            authoritative,
+        ])
+
+        resolver.resolve(Subnet(Address('11.12.13.0'), 32))
+        self.assertEqual(
+            'http://other_fake_rdap', redirects.lookup(Address('11.13.0.1'))
+        )
+
+        # Later queries in the same range skip the redirect
+        self.assertIs(
+            authoritative, resolver.resolve(Subnet(Address('11.13.0.1'), 32))
+        )
+        self.assertEqual(
+            [
+                call('http://fake_rdap/ip/11.12.13.0'),
+                call('http://other_fake_rdap/ip/11.12.13.0'),
+                call('http://other_fake_rdap/ip/11.13.0.1'),
+            ],
+            resolver._rdap_resolver.resolve_from_url.mock_calls
+        )
+
+    def test_learned_redirect_failure(self):
+        resolver, redirects = self._redirecting_resolver()
+        redirects.learn(
+            Address('11.12.0.0'), Address('11.12.255.255'),
+            'http://other_fake_rdap'
+        )
+        assignment = AssignedSubnet(Address('11.12.13.0'), 24, "HOME")
+        resolver._rdap_resolver.resolve_from_url = Mock(side_effect=[
+            RDAPResolutionException("RDAP resource not found"),
+            assignment,
+        ])
+
+        self.assertIs(
+            assignment, resolver.resolve(Subnet(Address('11.12.13.0'), 32))
+        )
+        # We fell back on the /8's RDAP service and forgot the redirect
+        self.assertEqual(
+            [
+                call('http://other_fake_rdap/ip/11.12.13.0'),
+                call('http://fake_rdap/ip/11.12.13.0'),
+            ],
+            resolver._rdap_resolver.resolve_from_url.mock_calls
+        )
+        self.assertIsNone(redirects.lookup(Address('11.12.13.0')))
+
+    def test_local_store_hit(self):
+        local_assignment = AssignedSubnet(Address('11.12.0.0'), 16, "LOCAL")
+        local_store = Mock()
+        local_store.longest_match.return_value = local_assignment
+        resolver = DelegationResolver(
+            self.resolver.top_level_delegations(), local_store=local_store,
+            max_age=3600
+        )
+        resolver._rdap_resolver.resolve = Mock()
+
+        network = Subnet(Address('11.12.13.0'), 24)
+        self.assertIs(local_assignment, resolver.resolve(network))
+        local_store.longest_match.assert_called_once_with(network, 3600)
+        self.assertEqual([], resolver._rdap_resolver.resolve.mock_calls)
+        self.assertIs(local_store, resolver.clone()._local_store)
+
+    def test_local_store_miss(self):
+        rdap_assignment = AssignedSubnet(Address('11.12.0.0'), 16, "REMOTE")
+        local_store = Mock()
+        local_store.longest_match.return_value = None
+        resolver = DelegationResolver(
+            self.resolver.top_level_delegations(), local_store=local_store
+        )
+        resolver._rdap_resolver.resolve = Mock(return_value=rdap_assignment)
+
+        network = Subnet(Address('11.12.13.0'), 24)
+        self.assertIs(rdap_assignment, resolver.resolve(network))
+        local_store.longest_match.assert_called_once_with(network, None)
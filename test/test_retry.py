@@ -0,0 +1,61 @@
+from unittest import TestCase
+import threading
+
+from src.metadata.retry import RetryQueue
+from test.test_ratelimit import FakeClock
+
+class test_RetryQueue(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.queue = RetryQueue(clock=self.clock.now)
+
+    def test_eligible_order(self):
+        self.queue.push('later', 10)
+        self.queue.push('first')
+        self.queue.push('second')
+        self.queue.push('soon', 5)
+        self.assertEqual(4, len(self.queue))
+        self.assertEqual(0, self.queue.next_eligible())
+
+        self.assertEqual('first', self.queue.get())
+        self.assertEqual('second', self.queue.get())
+        self.assertEqual(5, self.queue.next_eligible())
+
+        self.clock.time += 10
+        self.assertEqual('soon', self.queue.get())
+        self.assertEqual('later', self.queue.get())
+        self.assertIsNone(self.queue.next_eligible())
+
+    def test_done_when_empty(self):
+        self.assertIsNone(self.queue.get())
+
+        self.queue.push('only')
+        self.assertEqual('only', self.queue.get())
+        self.queue.task_done()
+        self.assertIsNone(self.queue.get())
+
+    def test_waits_for_follow_up(self):
+        queue = RetryQueue()
+        queue.push(3)
+        results = []
+
+        def consume():
+            while True:
+                item = queue.get()
+                if item is None:
+                    break
+                results.append(item)
+                # Each item but the last is followed by another one, which
+                # other consumers must wait for rather than give up
+                if item:
+                    queue.push(item - 1, 0.01)
+                queue.task_done()
+
+        consumers = [threading.Thread(target=consume) for _ in range(3)]
+        for consumer in consumers:
+            consumer.start()
+        for consumer in consumers:
+            consumer.join(5)
+            self.assertFalse(consumer.is_alive())
+        self.assertEqual([3, 2, 1, 0], results)
@@ -0,0 +1,143 @@
+from unittest import TestCase
+from mock import patch
+import gzip
+import os
+import shutil
+import tempfile
+
+from src.metadata.orm import DataManager
+from src.metadata.rpsl import (
+    RPSLSyntaxError, parse_RPSL_attributes, iter_RPSL_objects, inetnum_rows,
+    open_RPSL_dump
+)
+from src.net.IPv4 import Subnet, Address
+
+class test_RPSL(TestCase):
+
+    dump = '''#
+# The contents of this file are subject to
+# RIPE Database Terms and Conditions
+#
+
+inetnum:        1.2.3.0 - 1.2.5.255
+netname:        ODD-RANGE
+descr:          A range that isn't a
++               CIDR subnet
+country:        FR
+source:         RIPE # Filtered
+
+route:          1.2.3.0/24
+origin:         AS3333
+source:         RIPE
+
+inetnum:        2.0.0.0 - 2.0.0.255
+netname:        BROKEN
+this line is malformed
+source:         RIPE
+
+inetnum:        3.0.0.0 - 3.0.0.255
+remarks:        No netname
+source:         RIPE
+
+inetnum:        4.0.0.0 - 4.0.0.255
+netname:        LAST-ONE
+source:         APNIC'''
+
+    def test_attributes(self):
+        attributes = parse_RPSL_attributes([
+            '% A comment',
+            'inetnum:        1.2.3.0 - 1.2.5.255',
+            'descr:          first line',
+            '                second line',
+            '\tthird line',
+            'descr:          another descr',
+            'remarks:',
+            '',
+        ])
+        self.assertEqual(['1.2.3.0 - 1.2.5.255'], attributes['inetnum'])
+        self.assertEqual(
+            ['first line second line third line', 'another descr'],
+            attributes['descr']
+        )
+        self.assertEqual([], attributes['remarks'])
+
+        with self.assertRaises(RPSLSyntaxError) as ex:
+            parse_RPSL_attributes(['inetnum: 1.2.3.0 - 1.2.3.255', 'foo'])
+        self.assertEqual('foo', ex.exception.line)
+        with self.assertRaises(RPSLSyntaxError):
+            parse_RPSL_attributes(['   leading continuation'])
+
+    def test_objects(self):
+        objects = list(iter_RPSL_objects(self.dump.splitlines()))
+        self.assertEqual(4, len(objects))
+        self.assertEqual(['AS3333'], objects[1]['origin'])
+        self.assertEqual(
+            ["A range that isn't a CIDR subnet"], objects[0]['descr']
+        )
+
+        inetnums = list(iter_RPSL_objects(
+            self.dump.encode('latin-1').splitlines(True),
+            object_classes=('inetnum',)
+        ))
+        # The malformed object is skipped
+        self.assertEqual(
+            [['1.2.3.0 - 1.2.5.255'], ['3.0.0.0 - 3.0.0.255'], ['4.0.0.0 - 4.0.0.255']],
+            [attributes['inetnum'] for attributes in inetnums]
+        )
+
+    def test_inetnum_rows(self):
+        rows = list(inetnum_rows(
+            iter_RPSL_objects(self.dump.splitlines(), ('inetnum',))
+        ))
+        self.assertEqual(
+            [
+                (Subnet(Address('1.2.3.0'), 24), 'ODD-RANGE', 'rpsl-ripe'),
+                (Subnet(Address('1.2.4.0'), 23), 'ODD-RANGE', 'rpsl-ripe'),
+                (Subnet(Address('4.0.0.0'), 24), 'LAST-ONE', 'rpsl-apnic'),
+            ],
+            rows
+        )
+
+    def test_gzipped_dump(self):
+        dump_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dump_dir)
+        dump_path = os.path.join(dump_dir, 'ripe.db.inetnum.gz')
+        with gzip.open(dump_path, 'wb') as dump:
+            dump.write(self.dump.encode('latin-1'))
+
+        with open_RPSL_dump(dump_path) as dump:
+            rows = list(inetnum_rows(iter_RPSL_objects(dump, ('inetnum',))))
+        self.assertEqual(3, len(rows))
+
+    @patch('src.metadata.orm.SQLITE_PATH', ':memory:')
+    def test_import(self):
+        data_mgr = DataManager()
+        data_mgr.bulk_upsert([
+            (Subnet(Address('1.2.3.0'), 24), 'RIPENCC-FR', 'delegated-ripencc'),
+            (Subnet(Address('4.0.0.0'), 24), 'APNIC-AU', 'delegated-apnic'),
+        ])
+        data_mgr.bulk_upsert(inetnum_rows(
+            iter_RPSL_objects(self.dump.splitlines(), ('inetnum',))
+        ))
+        # Delegated placeholders don't replace names from RPSL
+        data_mgr.bulk_upsert([
+            (Subnet(Address('4.0.0.0'), 24), 'APNIC-AU', 'delegated-apnic'),
+        ])
+
+        self.assertEqual(
+            [
+                ('ODD-RANGE', 'rpsl-ripe'),
+                ('ODD-RANGE', 'rpsl-ripe'),
+                ('LAST-ONE', 'rpsl-apnic'),
+            ],
+            [
+                (record.name, record.source) for record in
+                data_mgr.all_records().order_by('address')
+            ]
+        )
+        # Unlike delegated placeholders, RPSL names are good enough to skip
+        # RDAP
+        self.assertEqual(
+            'LAST-ONE',
+            data_mgr.longest_match(Subnet(Address('4.0.0.42'), 32)).name
+        )
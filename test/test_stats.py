@@ -5,6 +5,7 @@ from src.net.IPv4 import Address, Subnet
 from src.metadata.assigned import AssignedSubnet
 from src.metadata.orm import DataManager
 from src.metadata.stats import StatsProcessor
+from src.metadata.whois import WHOIS_PARENT_SOURCE
 
 class test_stats_processor(TestCase):
 
@@ -42,3 +43,24 @@ class test_stats_processor(TestCase):
         total_coverage, coverage = self.stats_mgr.coverage()
         self.assertEquals(33554432, total_coverage)
         self.assertEquals('0.781', str(coverage))
+
+    def test_coverage_nested(self):
+        a = AssignedSubnet(Address('10.0.0.0'), 8, "foo")
+        b = AssignedSubnet(Address('10.0.0.0'), 16, "foo")
+        c = AssignedSubnet(Address('10.1.0.0'), 16, "foo")
+        d = AssignedSubnet(Address('12.0.0.0'), 8, "foo")
+
+        self.mock_data_mgr.update_records((a, b, c, d))
+
+        total_coverage, coverage = self.stats_mgr.coverage()
+        self.assertEquals(33554432, total_coverage)
+        self.assertEquals('0.781', str(coverage))
+
+    def test_coverage_whois_parent(self):
+        leaf = AssignedSubnet(Address('11.0.0.0'), 9, "leaf")
+        parent = AssignedSubnet(Address('11.0.0.0'), 8, "parent")
+        parent._source = WHOIS_PARENT_SOURCE
+        self.mock_data_mgr.update_records((leaf, parent))
+
+        total_coverage, coverage = self.stats_mgr.coverage()
+        self.assertEquals(8388608, total_coverage)
@@ -0,0 +1,217 @@
+from mock import patch, Mock
+from unittest import TestCase
+
+from src.metadata import ResolutionException
+from src.metadata.whois_client import LineReader, WhoisClient
+from test.test_ratelimit import FakeClock
+
+
+class FakeSocket(object):
+    '''
+    Replays chunks of bytes to recv_into() and records what's sent. Once the
+    chunks run out, the peer is deemed to have closed the connection.
+    '''
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.sent = b''
+        self.closed = False
+        self.connect = Mock()
+        self.settimeout = Mock()
+
+    def sendall(self, data):
+        self.sent += data
+
+    def recv_into(self, buffer):
+        if not self.chunks:
+            return 0
+        chunk = self.chunks.pop(0)
+        if len(chunk) > len(buffer):
+            # The rest is read next time
+            self.chunks.insert(0, chunk[len(buffer):])
+            chunk = chunk[:len(buffer)]
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class test_whois_client(TestCase):
+    KEEPALIVE_HOST = 'whois.ripe.net'
+    OTHER_HOST = 'whois.arin.net'
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.client = WhoisClient(clock=self.clock.now)
+        self.sockets = []
+        getaddrinfo_patch = patch(
+            'src.metadata.whois_client.getaddrinfo',
+            return_value=[(None, None, None, None, ('192.0.2.43', 43))]
+        )
+        self.getaddrinfo = getaddrinfo_patch.start()
+        self.addCleanup(getaddrinfo_patch.stop)
+        socket_patch = patch(
+            'src.metadata.whois_client.socket', side_effect=self._socket
+        )
+        socket_patch.start()
+        self.addCleanup(socket_patch.stop)
+
+    def _socket(self, **kwargs):
+        fake_socket = FakeSocket(self.replies.pop(0))
+        self.sockets.append(fake_socket)
+        return fake_socket
+
+    def test_one_connection_per_query(self):
+        self.replies = [[b'first ', b'reply'], [b'second reply']]
+        self.assertEqual(b'first reply', self.client.query(self.OTHER_HOST, 'foo'))
+        self.assertEqual(b'second reply', self.client.query(self.OTHER_HOST, 'bar'))
+        self.assertEqual([b'foo\n', b'bar\n'], [s.sent for s in self.sockets])
+        self.assertTrue(all(s.closed for s in self.sockets))
+        # The server's address was only looked up once
+        self.assertEqual(1, self.getaddrinfo.call_count)
+
+    def test_persistent_connection(self):
+        self.replies = [[b'% header\n\nfirst\n\n\n', b'second\n\n', b'\n']]
+        self.assertEqual(b'% header\n\nfirst\n', self.client.query(self.KEEPALIVE_HOST, 'foo'))
+        self.assertEqual(b'second\n', self.client.query(self.KEEPALIVE_HOST, 'bar'))
+
+        self.assertEqual(1, len(self.sockets))
+        # Only the first query asks for the connection to be kept open
+        self.assertEqual(b'-k foo\nbar\n', self.sockets[0].sent)
+        self.assertFalse(self.sockets[0].closed)
+
+        self.client.close()
+        self.assertEqual(b'-k foo\nbar\n-k\n', self.sockets[0].sent)
+        self.assertTrue(self.sockets[0].closed)
+
+    def test_pipelining(self):
+        self.replies = [[b'one\n\n', b'\ntwo\n\n\nthr', b'ee\n\n\n']]
+        self.assertEqual(
+            [b'one\n', b'two\n', b'three\n'],
+            self.client.query_many(self.KEEPALIVE_HOST, ['1', '2', '3'])
+        )
+        # All the queries were sent at once
+        self.assertEqual(b'-k 1\n2\n3\n', self.sockets[0].sent)
+
+    def test_reconnect(self):
+        # The server hangs up after the first response
+        self.replies = [[b'one\n\n\ntw'], [b'two\n\n\nthree\n\n\n']]
+        self.assertEqual(
+            [b'one\n', b'two\n', b'three\n'],
+            self.client.query_many(self.KEEPALIVE_HOST, ['1', '2', '3'])
+        )
+        # Only the unanswered queries are sent again
+        self.assertEqual(b'-k 2\n3\n', self.sockets[1].sent)
+        self.assertTrue(self.sockets[0].closed)
+
+    def test_reconnect_once(self):
+        # The server hangs up on an idle connection, then on the new one
+        self.replies = [[b'one\n\n\n'], []]
+        self.client.query(self.KEEPALIVE_HOST, '1')
+        with self.assertRaises(ConnectionError):
+            self.client.query(self.KEEPALIVE_HOST, '2')
+        self.assertEqual(2, len(self.sockets))
+        self.assertTrue(all(s.closed for s in self.sockets))
+
+    def test_no_reconnect_on_new_connection(self):
+        self.replies = [[]]
+        with self.assertRaises(ConnectionError):
+            self.client.query(self.KEEPALIVE_HOST, 'foo')
+        self.assertEqual(1, len(self.sockets))
+
+    def test_query_lines(self):
+        self.replies = [[b'% header\n\nfirst', b' line\nsecond\n\n\n']]
+        lines = self.client.query_lines(self.KEEPALIVE_HOST, 'foo')
+        self.assertEqual(b'% header\n', next(lines))
+        self.assertEqual(b'\n', next(lines))
+        self.assertEqual(b'first line\n', next(lines))
+        # The response wasn't read in full, so the connection can't be reused
+        lines.close()
+        self.assertTrue(self.sockets[0].closed)
+
+    def test_idle_connection(self):
+        self.replies = [[b'one\n\n\n'], [b'two\n\n\n']]
+        self.client.query(self.KEEPALIVE_HOST, '1')
+        self.clock.time += WhoisClient.IDLE_TIMEOUT + 1
+        self.assertEqual(b'two\n', self.client.query(self.KEEPALIVE_HOST, '2'))
+        self.assertTrue(self.sockets[0].closed)
+        self.assertEqual(b'-k 2\n', self.sockets[1].sent)
+
+    def test_connection_failure(self):
+        self.getaddrinfo.side_effect = [
+            [(None, None, None, None, ('192.0.2.43', 43))],
+            [(None, None, None, None, ('192.0.2.44', 43))],
+        ]
+        self.replies = [[], [b'reply']]
+
+        def refusing_socket(**kwargs):
+            fake_socket = self._socket(**kwargs)
+            if len(self.sockets) == 1:
+                fake_socket.connect.side_effect = ConnectionRefusedError
+            return fake_socket
+        with patch('src.metadata.whois_client.socket', side_effect=refusing_socket):
+            with self.assertRaises(ConnectionRefusedError):
+                self.client.query(self.OTHER_HOST, 'foo')
+            self.assertEqual(b'reply', self.client.query(self.OTHER_HOST, 'foo'))
+        # The address was looked up again after the failure
+        self.assertEqual(2, self.getaddrinfo.call_count)
+        self.sockets[1].connect.assert_called_once_with(('192.0.2.44', 43))
+
+
+class test_line_reader(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def _reader(self, chunks, buffer_size=LineReader.BUFFER_SIZE):
+        self.socket = FakeSocket(chunks)
+        return LineReader(
+            self.socket, 30, buffer_size=buffer_size, clock=self.clock.now
+        )
+
+    def _lines(self, reader):
+        lines = []
+        while True:
+            line = reader.readline(self.clock.now() + 60)
+            if not line:
+                return lines
+            lines.append(line)
+
+    def test_lines_across_reads(self):
+        reader = self._reader([b'inetnum: 1', b'0.0.0.0\nnetname:', b' X\r\nlast'])
+        self.assertEqual(
+            [b'inetnum: 10.0.0.0\n', b'netname: X\r\n', b'last'],
+            self._lines(reader)
+        )
+
+    def test_small_buffer(self):
+        # Partial lines are moved to the front of the buffer to make room
+        reader = self._reader([b'abc\ndefg\nhi\n'], buffer_size=6)
+        self.assertEqual([b'abc\n', b'defg\n', b'hi\n'], self._lines(reader))
+
+    def test_line_too_long(self):
+        reader = self._reader([b'abcdefgh\n'], buffer_size=6)
+        with self.assertRaises(ResolutionException) as ex:
+            reader.readline(self.clock.now() + 60)
+        self.assertEqual("Whois line longer than 6 bytes", str(ex.exception))
+
+    def test_deadline(self):
+        reader = self._reader([b'first\n', b'sec'])
+        deadline = self.clock.now() + 10
+        self.assertEqual(b'first\n', reader.readline(deadline))
+        # Reads don't wait past the deadline
+        self.clock.time += 4
+        self.socket.chunks.append(b'ond\n')
+        self.assertEqual(b'second\n', reader.readline(deadline))
+        self.assertEqual(6, self.socket.settimeout.call_args[0][0])
+
+        self.clock.time += 6
+        with self.assertRaises(TimeoutError):
+            reader.readline(deadline)
@@ -1,10 +1,39 @@
 from mock import patch, Mock, call
 from unittest import TestCase
+from socket import gaierror
 
 from src.net.IPv4 import Address, Subnet
 from src.metadata.assigned import AssignedSubnet
 from src.metadata.whois import Whois_Resolver
-from src.metadata import ResolutionException
+from src.metadata import (
+    ResolutionException, RateLimitationException, QueryDeferredException,
+    WhoisConnectionException
+)
+from src.metadata.failures import FailureCache
+from src.metadata.redirects import WhoisReferralMap
+from test.test_ratelimit import FakeClock
+
+def replay(*chunks):
+    '''
+    Returns a recv_into() side effect that copies chunks into the buffer, one
+    per call.
+    '''
+    chunks = list(chunks)
+
+    def recv_into(buffer):
+        chunk = chunks.pop(0)
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+    return recv_into
+
+
+def whois_lines(entry):
+    '''
+    Returns a generator of the lines of a whois entry, like
+    Whois_Resolver.iter_whois_lines()
+    '''
+    return (line for line in entry.strip().splitlines(True))
+
 
 class test_whois_resolver(TestCase):
     WHOIS_HOST = 'whois.example.org'
@@ -14,9 +43,10 @@ class test_whois_resolver(TestCase):
         self._delegation_rslvr.get_top_level_assignment = Mock(
             return_value=Mock(whois_host=self.WHOIS_HOST),
         )
-        self.rslvr = Whois_Resolver(self._delegation_rslvr)
+        self.clock = FakeClock()
+        self.rslvr = Whois_Resolver(self._delegation_rslvr, self.clock.limiter())
         self._name_resolution_patch = patch(
-            'src.metadata.whois.getaddrinfo',
+            'src.metadata.whois_client.getaddrinfo',
             return_value=[
                 (None, None, None, None, ('192.168.42.42', 43)),
             ]
@@ -28,9 +58,9 @@ class test_whois_resolver(TestCase):
         #
         mock_socket_ctx_mgr = Mock()
         mock_socket_ctx_mgr.__enter__ = Mock(return_value=self._mock_socket_object)
-        mock_socket_ctx_mgr.__exit__ = Mock()
+        mock_socket_ctx_mgr.__exit__ = Mock(return_value=False)
         self._socket_context_patch = patch(
-            'src.metadata.whois.socket',
+            'src.metadata.whois_client.socket',
             return_value=mock_socket_ctx_mgr,
         )
         # mock_tmp.return_value.__enter__.return_value.name = mytmpname
@@ -38,7 +68,7 @@ class test_whois_resolver(TestCase):
 
     def test_get_whois_entry_whois_supplied(self):
         addr = Subnet(Address("10.0.0.0"), 8)
-        self._mock_socket_object.recv = Mock(side_effect=[b'raw_whois', b''])
+        self._mock_socket_object.recv_into = Mock(side_effect=replay(b'raw_whois', b''))
         whois_response = self.rslvr.get_whois_entry(addr, self.WHOIS_HOST)
 
         self.assertTrue(isinstance(whois_response, str))
@@ -46,15 +76,49 @@ class test_whois_resolver(TestCase):
 
     def test_get_whois_entry_multiple_reads(self):
         addr = Subnet(Address("10.0.0.0"), 8)
-        self._mock_socket_object.recv = Mock(side_effect=[b'raw_whois', b'more_whois', b''])
+        self._mock_socket_object.recv_into = Mock(side_effect=replay(b'raw_whois', b'more_whois', b''))
         whois_response = self.rslvr.get_whois_entry(addr, self.WHOIS_HOST)
 
         self.assertTrue(isinstance(whois_response, str))
         self.assertEqual('raw_whoismore_whois', whois_response)
 
+    def test_get_whois_entry_rate_limitation(self):
+        addr = Subnet(Address("10.0.0.0"), 8)
+        self._mock_socket_object.recv_into = Mock(side_effect=replay(b'%ERROR:201: access denied for 192.0.2.1\n', b''))
+        with self.assertRaises(RateLimitationException):
+            self.rslvr.get_whois_entry(addr, self.WHOIS_HOST)
+        self.assertEqual(0.5, self.rslvr._rate_limiter.rate(self.WHOIS_HOST))
+
+        # The next query is paced
+        self._mock_socket_object.recv_into = Mock(side_effect=replay(b'raw_whois', b''))
+        self.rslvr.get_whois_entry(addr, self.WHOIS_HOST)
+        self.assertEqual([2.0], self.clock.sleeps)
+
+    def test_get_whois_entry_failing_host(self):
+        failures = FailureCache(':memory:', clock=self.clock.now)
+        self.addCleanup(failures.close)
+        rslvr = Whois_Resolver(self._delegation_rslvr, self.clock.limiter(), failures)
+        addr = Subnet(Address("10.0.0.0"), 8)
+
+        with patch('src.metadata.whois_client.getaddrinfo', side_effect=gaierror) as mock_getaddrinfo:
+            with self.assertRaises(WhoisConnectionException):
+                rslvr.get_whois_entry(addr, self.WHOIS_HOST)
+
+            # The host isn't tried again until the failure expires
+            self.clock.time += 20
+            with self.assertRaises(QueryDeferredException) as ex:
+                rslvr.get_whois_entry(addr, self.WHOIS_HOST)
+            self.assertEqual(FailureCache.ENDPOINT_TTL - 20, ex.exception.retry_after)
+            self.assertEqual(1, mock_getaddrinfo.call_count)
+
+        self.clock.time += FailureCache.ENDPOINT_TTL
+        self._mock_socket_object.recv_into = Mock(side_effect=replay(b'raw_whois', b''))
+        self.assertEqual('raw_whois', rslvr.get_whois_entry(addr, self.WHOIS_HOST))
+        self.assertIsNone(failures.endpoint_failure(self.WHOIS_HOST))
+
     def test_get_whois_entry_no_whois_supplied(self):
         addr = Subnet(Address("10.11.12.0"), 24)
-        self._mock_socket_object.recv = Mock(side_effect=[b'raw_whois', b''])
+        self._mock_socket_object.recv_into = Mock(side_effect=replay(b'raw_whois', b''))
         whois_response = self.rslvr.get_whois_entry(addr)
 
         self.assertTrue(isinstance(whois_response, str))
@@ -75,19 +139,19 @@ class test_whois_resolver(TestCase):
             self.rslvr.get_whois_entry(addr)
         self.assertEqual("No whois host set on the top-level delegation", str(ex.exception))
 
-    @patch('src.metadata.whois.Whois_Resolver.get_whois_entry')
+    @patch('src.metadata.whois.Whois_Resolver.iter_whois_lines')
     def test_resolve_malformed_whois(self, mock_get_entry):
         addr = Subnet(Address("10.0.0.0"), 8)
-        mock_get_entry.return_value = 'foo'
+        mock_get_entry.return_value = whois_lines('foo')
 
         with self.assertRaises(ResolutionException) as ex:
             self.rslvr.resolve(addr, self.WHOIS_HOST)
         self.assertEqual("Malformed Whois entry: foo", str(ex.exception))
 
-    @patch('src.metadata.whois.Whois_Resolver.get_whois_entry')
+    @patch('src.metadata.whois.Whois_Resolver.iter_whois_lines')
     def test_resolve_well_formed_whois(self, mock_get_entry):
         addr = Subnet(Address("45.0.0.0"), 8)
-        mock_get_entry.return_value = '''
+        mock_get_entry.return_value = whois_lines('''
 % This is the RIPE Database query service.
 % The objects are in RPSL format.
 %
@@ -117,7 +181,7 @@ mnt-by:         RIPE-NCC-HM-MNT
 created:        2014-05-21T08:19:20Z
 last-modified:  2015-09-23T13:18:33Z
 source:         RIPE
-        '''.strip()
+        ''')
 
 
 
@@ -136,10 +200,31 @@ source:         RIPE
             assigned._name
         )
 
-    @patch('src.metadata.whois.Whois_Resolver.get_whois_entry')
+    @patch('src.metadata.whois.Whois_Resolver.iter_whois_lines')
+    def test_resolve_misaligned_range(self, mock_get_entry):
+        addr = Subnet(Address("1.2.3.0"), 32)
+        mock_get_entry.return_value = whois_lines('''
+inetnum:        1.2.3.0 - 1.2.5.255
+netname:        ODD-RANGE
+source:         RIPE
+        ''')
+
+        assigned = self.rslvr.resolve(addr, self.WHOIS_HOST)
+        self.assertEqual(
+            AssignedSubnet(Address("1.2.3.0"), 24, 'ODD-RANGE'), assigned
+        )
+        self.assertEqual(
+            (
+                AssignedSubnet(Address("1.2.3.0"), 24, 'ODD-RANGE'),
+                AssignedSubnet(Address("1.2.4.0"), 23, 'ODD-RANGE'),
+            ),
+            assigned.range_subnets
+        )
+
+    @patch('src.metadata.whois.Whois_Resolver.iter_whois_lines')
     def test_resolve_bullshit_continuations(self, mock_get_entry):
         addr = Subnet(Address("45.0.0.0"), 8)
-        mock_get_entry.return_value = '''
+        mock_get_entry.return_value = whois_lines('''
 inetnum:        45.0.0.0 - 45.255.255.255
 inetnum:
 netname:        EU-ZZ-45
@@ -158,7 +243,7 @@ mnt-by:         RIPE-NCC-HM-MNT
 created:        2014-05-21T08:19:20Z
 last-modified:  2015-09-23T13:18:33Z
 source:         RIPE
-        '''.strip()
+        ''')
 
         assigned = self.rslvr.resolve(addr, self.WHOIS_HOST)
         self.assertTrue(isinstance(assigned, AssignedSubnet))
@@ -175,10 +260,74 @@ source:         RIPE
             assigned._name
         )
 
-    @patch('src.metadata.whois.Whois_Resolver.get_whois_entry')
+    @patch('src.metadata.whois.Whois_Resolver.iter_whois_lines')
+    def test_resolve_several_inetnums(self, mock_get_entry):
+        addr = Subnet(Address("45.1.2.3"), 32)
+        mock_get_entry.return_value = whois_lines('''
+% Information related to '45.0.0.0 - 45.255.255.255'
+
+inetnum:        45.0.0.0 - 45.255.255.255
+netname:        EU-ZZ-45
+source:         RIPE
+
+inetnum:        45.1.0.0 - 45.1.255.255
+netname:        PARENT-NET
+source:         RIPE
+
+route:          45.1.0.0/16
+origin:         AS64496
+source:         RIPE
+
+inetnum:        45.1.2.0 - 45.1.4.255
+netname:        CHILD-NET
+source:         RIPE
+
+inetnum:        45.1.5.0 - 45.1.5.255
+source:         RIPE
+
+inetnum:        45.1.6.0 - 45.1.6.255
+netname:        SIBLING-NET
+source:         RIPE
+        ''')
+
+        assigned = self.rslvr.resolve(addr, self.WHOIS_HOST)
+        # The most specific inetnum for the address
+        self.assertEqual(
+            AssignedSubnet(Address("45.1.2.0"), 23, 'CHILD-NET'), assigned
+        )
+        self.assertEqual(2, len(assigned.range_subnets))
+        self.assertIsNone(assigned.source)
+        # The others, save the one with no netname. The enclosing ones are
+        # tagged as such.
+        self.assertEqual(
+            [
+                [(Subnet(Address("45.0.0.0"), 8), 'EU-ZZ-45', 'whois-parent')],
+                [(Subnet(Address("45.1.0.0"), 16), 'PARENT-NET', 'whois-parent')],
+                [(Subnet(Address("45.1.6.0"), 24), 'SIBLING-NET', None)],
+            ],
+            [
+                [(Subnet(s.network, s.prefix_length), s.name, s.source) for s in range_subnets]
+                for range_subnets in assigned.related_ranges
+            ]
+        )
+
+    @patch('src.metadata.whois.Whois_Resolver.iter_whois_lines')
+    def test_resolve_no_matching_inetnum(self, mock_get_entry):
+        addr = Subnet(Address("46.0.0.0"), 32)
+        mock_get_entry.return_value = whois_lines('''
+inetnum:        45.0.0.0 - 45.255.255.255
+netname:        EU-ZZ-45
+source:         RIPE
+        ''')
+
+        with self.assertRaises(ResolutionException) as ex:
+            self.rslvr.resolve(addr, self.WHOIS_HOST)
+        self.assertEqual("No inetnum for 46.0.0.0 in whois record", str(ex.exception))
+
+    @patch('src.metadata.whois.Whois_Resolver.iter_whois_lines')
     def test_resolve_no_inetnum(self, mock_get_entry):
         addr = Subnet(Address("45.0.0.0"), 8)
-        mock_get_entry.return_value = '''
+        mock_get_entry.return_value = whois_lines('''
 netname:        EU-ZZ-45
 descr:          To determine the registration information for a more
 descr:          specific range, please try a more specific query.
@@ -187,16 +336,16 @@ descr:          it means the IP address is currently in the free pool of
 descr:          address space managed by the RIPE NCC.
                 Bullshit continuation
 source:         RIPE
-        '''.strip()
+        ''')
 
         with self.assertRaises(ResolutionException) as ex:
             self.rslvr.resolve(addr, self.WHOIS_HOST)
         self.assertEqual("No inetnum in whois record", str(ex.exception))
 
-    @patch('src.metadata.whois.Whois_Resolver.get_whois_entry')
+    @patch('src.metadata.whois.Whois_Resolver.iter_whois_lines')
     def test_resolve_no_netname(self, mock_get_entry):
         addr = Subnet(Address("45.0.0.0"), 8)
-        mock_get_entry.return_value = '''
+        mock_get_entry.return_value = whois_lines('''
 inetnum:        45.0.0.0 - 45.255.255.255
 descr:          To determine the registration information for a more
 descr:          specific range, please try a more specific query.
@@ -205,8 +354,213 @@ descr:          it means the IP address is currently in the free pool of
 descr:          address space managed by the RIPE NCC.
                 Bullshit continuation
 source:         RIPE
-        '''.strip()
+        ''')
 
         with self.assertRaises(ResolutionException) as ex:
             self.rslvr.resolve(addr, self.WHOIS_HOST)
         self.assertEqual("No netname in whois record", str(ex.exception))
+
+    def test_resolve_stops_reading_malformed_whois(self):
+        closed = []
+
+        def query_lines(whois_host, query):
+            try:
+                yield b'inetnum: 10.0.0.0 - 10.0.0.255\n'
+                yield b'garbage\n'
+                yield b'netname: NEVER-READ\n'
+            finally:
+                closed.append(whois_host)
+        client = Mock()
+        client.query_lines = Mock(side_effect=query_lines)
+        rate_limiter = Mock()
+        rslvr = Whois_Resolver(self._delegation_rslvr, rate_limiter, client=client)
+
+        with self.assertRaises(ResolutionException) as ex:
+            rslvr.resolve(Subnet(Address("10.0.0.0"), 32), self.WHOIS_HOST)
+        self.assertEqual("Malformed Whois entry: garbage", str(ex.exception))
+        # The response is closed and doesn't count as a success
+        self.assertEqual([self.WHOIS_HOST], closed)
+        self.assertEqual([], rate_limiter.succeeded.mock_calls)
+
+    def test_get_whois_entries_pipelined(self):
+        client = Mock()
+        client.query_many = Mock(return_value=[b'first', b'second'])
+        rslvr = Whois_Resolver(self._delegation_rslvr, self.clock.limiter(), client=client)
+
+        entries = rslvr.get_whois_entries(
+            [Subnet(Address("10.0.0.0"), 8), Subnet(Address("11.1.2.0"), 24)],
+            'whois.ripe.net'
+        )
+        self.assertEqual(['first', 'second'], entries)
+        client.query_many.assert_called_once_with(
+            'whois.ripe.net', ['-V Md5.1 10.0.0.0', '-V Md5.1 11.1.2.0']
+        )
+
+    def test_resolve_many(self):
+        client = Mock()
+        client.query_many = Mock(return_value=[
+            b'inetnum: 10.0.0.0 - 10.0.0.255\nnetname: FIRST\n',
+            b'garbage\n',
+            b'inetnum: 10.2.0.0 - 10.2.255.255\nnetname: THIRD\n',
+        ])
+        rslvr = Whois_Resolver(self._delegation_rslvr, self.clock.limiter(), client=client)
+
+        results = rslvr.resolve_many([
+            Subnet(Address("10.0.0.7"), 32),
+            Subnet(Address("10.1.0.0"), 32),
+            Subnet(Address("10.2.3.4"), 32),
+        ])
+        self.assertEqual(AssignedSubnet(Address("10.0.0.0"), 24, 'FIRST'), results[0])
+        self.assertEqual("Malformed Whois entry: garbage", str(results[1]))
+        self.assertEqual(AssignedSubnet(Address("10.2.0.0"), 16, 'THIRD'), results[2])
+        # The queries went out together
+        client.query_many.assert_called_once_with(
+            self.WHOIS_HOST,
+            ['-V Md5.1 10.0.0.7', '-V Md5.1 10.1.0.0', '-V Md5.1 10.2.3.4']
+        )
+
+    def test_resolve_many_failing_host(self):
+        client = Mock()
+        client.query_many = Mock(side_effect=ConnectionResetError)
+        rslvr = Whois_Resolver(self._delegation_rslvr, self.clock.limiter(), client=client)
+
+        results = rslvr.resolve_many([
+            Subnet(Address("10.0.0.7"), 32), Subnet(Address("10.1.0.0"), 32),
+        ])
+        self.assertEqual(2, len(results))
+        for result in results:
+            self.assertIsInstance(result, WhoisConnectionException)
+
+class test_whois_referrals(TestCase):
+    ARIN_REPLY = '''
+# ARIN WHOIS data and services are subject to the Terms of Use
+
+NetRange:       193.0.0.0 - 193.255.255.255
+CIDR:           193.0.0.0/8
+NetName:        RIPE-CBLK2
+ReferralServer: whois://whois.ripe.net:43
+'''
+    RIPE_REPLY = '''
+inetnum:        193.0.0.0 - 193.0.7.255
+netname:        RIPE-NCC
+source:         RIPE
+'''
+
+    def setUp(self):
+        self._delegation_rslvr = Mock()
+        self._delegation_rslvr.get_top_level_assignment = Mock(
+            return_value=Mock(whois_host='whois.arin.net'),
+        )
+        self.referrals = WhoisReferralMap(':memory:')
+        self.addCleanup(self.referrals.close)
+        self.rslvr = Whois_Resolver(
+            self._delegation_rslvr, referral_map=self.referrals
+        )
+        self.replies = {}
+        lines_patch = patch(
+            'src.metadata.whois.Whois_Resolver.iter_whois_lines',
+            side_effect=lambda net, host: whois_lines(self.replies[host])
+        )
+        self.iter_whois_lines = lines_patch.start()
+        self.addCleanup(lines_patch.stop)
+
+    def _queried_hosts(self):
+        return [c[1][1] for c in self.iter_whois_lines.mock_calls]
+
+    def test_referral(self):
+        self.replies = {
+            'whois.arin.net': self.ARIN_REPLY,
+            'whois.ripe.net': self.RIPE_REPLY,
+        }
+        addr = Subnet(Address("193.0.0.1"), 32)
+        self.assertEqual(
+            AssignedSubnet(Address("193.0.0.0"), 21, 'RIPE-NCC'),
+            self.rslvr.resolve(addr)
+        )
+        self.assertEqual(['whois.arin.net', 'whois.ripe.net'], self._queried_hosts())
+
+        # The whole range ARIN referred us for goes straight to RIPE now
+        self.assertEqual('whois.ripe.net', self.referrals.lookup(Address("193.255.0.0")))
+        self.rslvr.resolve(addr)
+        self.assertEqual(
+            ['whois.arin.net', 'whois.ripe.net', 'whois.ripe.net'],
+            self._queried_hosts()
+        )
+
+    def test_referral_loop(self):
+        self.replies = {
+            'whois.arin.net': self.ARIN_REPLY,
+            'whois.ripe.net': 'refer: whois.arin.net\n',
+        }
+        with self.assertRaises(ResolutionException) as ex:
+            self.rslvr.resolve(Subnet(Address("193.0.0.1"), 32))
+        self.assertEqual(
+            "Whois referral loop: whois.arin.net -> whois.ripe.net -> whois.arin.net",
+            str(ex.exception)
+        )
+        self.assertIsNone(self.referrals.lookup(Address("193.0.0.1")))
+
+    def test_ignored_referrals(self):
+        # Referrals to the same server or to rwhois servers aren't followed
+        self.replies = {
+            'whois.arin.net': '''
+NetRange:       198.51.100.0 - 198.51.100.255
+ReferralServer: rwhois://rwhois.example.net:4321
+ReferralServer: whois://whois.arin.net
+
+inetnum:        198.51.100.0 - 198.51.100.255
+netname:        EXAMPLE-NET
+''',
+        }
+        self.assertEqual(
+            AssignedSubnet(Address("198.51.100.0"), 24, 'EXAMPLE-NET'),
+            self.rslvr.resolve(Subnet(Address("198.51.100.7"), 32))
+        )
+        self.assertEqual(['whois.arin.net'], self._queried_hosts())
+
+    def test_stale_referral(self):
+        self.referrals.learn(
+            Address("193.0.0.0"), Address("193.255.255.255"), 'whois.apnic.net'
+        )
+        self.replies = {
+            'whois.apnic.net': 'inetnum: 10.0.0.0 - 10.0.0.255\nnetname: NOPE\n',
+            'whois.arin.net': self.ARIN_REPLY,
+            'whois.ripe.net': self.RIPE_REPLY,
+        }
+        self.assertEqual(
+            AssignedSubnet(Address("193.0.0.0"), 21, 'RIPE-NCC'),
+            self.rslvr.resolve(Subnet(Address("193.0.0.1"), 32))
+        )
+        self.assertEqual(
+            ['whois.apnic.net', 'whois.arin.net', 'whois.ripe.net'],
+            self._queried_hosts()
+        )
+        self.assertEqual('whois.ripe.net', self.referrals.lookup(Address("193.0.0.1")))
+
+    def test_resolve_many_referral(self):
+        self.replies = {'whois.ripe.net': self.RIPE_REPLY}
+        self.rslvr._client = Mock()
+        self.rslvr._client.query_many = Mock(return_value=[
+            self.ARIN_REPLY.encode('ASCII'),
+            b'inetnum: 198.51.100.0 - 198.51.100.255\nnetname: EXAMPLE-NET\n',
+        ])
+        ripe_addr = Subnet(Address("193.0.0.1"), 32)
+        self.assertEqual(
+            [
+                AssignedSubnet(Address("193.0.0.0"), 21, 'RIPE-NCC'),
+                AssignedSubnet(Address("198.51.100.0"), 24, 'EXAMPLE-NET'),
+            ],
+            self.rslvr.resolve_many([
+                ripe_addr, Subnet(Address("198.51.100.7"), 32)
+            ])
+        )
+        # The referral is followed for the network it's about
+        self.assertEqual(['whois.ripe.net'], self._queried_hosts())
+
+        # ...and learned
+        self.assertEqual(
+            [AssignedSubnet(Address("193.0.0.0"), 21, 'RIPE-NCC')],
+            self.rslvr.resolve_many([ripe_addr])
+        )
+        self.assertEqual(['whois.ripe.net', 'whois.ripe.net'], self._queried_hosts())
+        self.assertEqual(1, self.rslvr._client.query_many.call_count)